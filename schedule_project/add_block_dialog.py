@@ -1,11 +1,14 @@
 from PySide6.QtWidgets import (
         QDialog, QVBoxLayout, QFormLayout, QLineEdit, QDialogButtonBox,
-    QLabel, QDoubleSpinBox, QComboBox, QDateEdit,
+    QLabel, QDoubleSpinBox, QComboBox, QDateEdit, QCheckBox, QHBoxLayout, QSpinBox,
 )
 import re
 from PySide6.QtCore import QTime,QDate,QDateTime
 from utils import log
 from encoder_utils import get_encoder_display_name
+from recurrence import FREQS, WEEKDAY_NAMES, expand_rule, last_date, normalize_recurrence
+
+RULE_CHECK_DAYS = 28   # 不限期的重複排程：新增時檢查前幾天內的每一次（之後的在展開時檢查，重疊的那一次略過並警告）
 class AddBlockDialog(QDialog):
     def __init__(self, parent=None, encoder_names=None, overlap_checker=None):
         super().__init__(parent)
@@ -36,6 +39,25 @@ class AddBlockDialog(QDialog):
             display = get_encoder_display_name(name)
             self.encoder_selector.addItem(display, userData=name)
 
+        # ➤ 重複排程（選填）：規則只存一筆，每一次在需要時才展開
+        self.repeat_selector = QComboBox()
+        self.repeat_selector.addItem("不重複", userData=None)
+        for freq, text in FREQS.items():
+            self.repeat_selector.addItem(text, userData=freq)
+        self.weekday_boxes = [QCheckBox(name) for name in WEEKDAY_NAMES]
+        weekday_row = QHBoxLayout()
+        for box in self.weekday_boxes:
+            weekday_row.addWidget(box)
+        self.until_check = QCheckBox("結束日期：")
+        self.until_input = QDateEdit(QDate.currentDate().addMonths(3))
+        self.until_input.setCalendarPopup(True)
+        self.until_check.toggled.connect(self.until_input.setEnabled)
+        self.count_input = QSpinBox()
+        self.count_input.setRange(0, 9999)
+        self.count_input.setSpecialValueText("不限")
+        self.repeat_selector.currentIndexChanged.connect(self.update_repeat_inputs)
+        self.update_repeat_inputs()
+
         self.status_label = QLabel()
         self.status_label.setStyleSheet("color: red")
         
@@ -45,6 +67,10 @@ class AddBlockDialog(QDialog):
         form.addRow("開始時間：", self.time_input)
         form.addRow("持續時間（小時）：", self.duration_input)
         form.addRow("錄影設備：", self.encoder_selector)
+        form.addRow("重複：", self.repeat_selector)
+        form.addRow("星期：", weekday_row)
+        form.addRow(self.until_check, self.until_input)
+        form.addRow("次數：", self.count_input)
 
         self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         self.buttons.accepted.connect(self.accept)
@@ -55,6 +81,28 @@ class AddBlockDialog(QDialog):
         layout.addWidget(self.status_label)
         layout.addWidget(self.buttons)
         self.setLayout(layout)
+    def update_repeat_inputs(self):
+        freq = self.repeat_selector.currentData()
+        if freq == "weekly" and not any(box.isChecked() for box in self.weekday_boxes):
+            self.weekday_boxes[self.date_input.date().dayOfWeek() - 1].setChecked(True)  # 預設排程日期那天
+        for box in self.weekday_boxes:
+            box.setEnabled(freq == "weekly")
+        self.until_check.setEnabled(freq is not None)
+        self.until_input.setEnabled(freq is not None and self.until_check.isChecked())
+        self.count_input.setEnabled(freq is not None)
+
+    def get_recurrence(self):
+        """重複設定 ➜ recurrence dict；不重複回 None。"""
+        freq = self.repeat_selector.currentData()
+        if freq is None:
+            return None
+        rec = {"freq": freq, "days": [i + 1 for i, box in enumerate(self.weekday_boxes) if box.isChecked()]}
+        if self.until_check.isChecked():
+            rec["until"] = self.until_input.date().toString("yyyy-MM-dd")
+        if self.count_input.value():
+            rec["count"] = self.count_input.value()
+        return normalize_recurrence(rec)
+
     def format_time_input(self):
         time = self.parse_time(self.time_input.text())
         if time:
@@ -119,10 +167,38 @@ class AddBlockDialog(QDialog):
             self.status_label.setText("❌ 結束時間不能早於現在時間")
             return
 
-        if self.overlap_checker and self.overlap_checker(track_index, start_hour, duration, qdate):
-            self.status_label.setText("⚠️ 時間重疊")
+        try:
+            recurrence = self.get_recurrence()
+        except ValueError as e:
+            self.status_label.setText(f"❌ {e}")
             return
 
+        if recurrence is None:
+            if self.overlap_checker and self.overlap_checker(track_index, start_hour, duration, qdate):
+                self.status_label.setText("⚠️ 時間重疊")
+                return
+        else:
+            rule = {"id": "check", "qdate": qdate, "track_index": track_index, "start_hour": start_hour,
+                    "duration": duration, "label": name, "recurrence": recurrence}
+            # ➤ 有結束日期 / 次數：每一次都檢查；不限期：先檢查 RULE_CHECK_DAYS 天
+            last = last_date(rule)
+            start_ts = start_dt.toSecsSinceEpoch()
+            if last is not None:
+                end_ts = QDateTime(last.addDays(1), QTime(0, 0)).toSecsSinceEpoch()
+            else:
+                end_ts = start_ts + RULE_CHECK_DAYS * 86400
+            occurrences = expand_rule(rule, start_ts, end_ts)
+            if not occurrences:
+                self.status_label.setText("❌ 重複設定沒有任何一次落在結束日期前")
+                return
+            clashes = [occ for occ in occurrences if self.overlap_checker
+                       and self.overlap_checker(track_index, start_hour, duration, occ["qdate"])]
+            if clashes:
+                first = clashes[0]["qdate"].toString("yyyy-MM-dd")
+                more = f" 等 {len(clashes)} 次" if len(clashes) > 1 else " 那一次"
+                self.status_label.setText(f"⚠️ {first}{more}時間重疊")
+                return
+
         self.parsed_time = time  # ✅ 儲存起來，供 get_values() 使用
         super().accept()
 
@@ -0,0 +1,128 @@
+# block_index.py
+import bisect
+from utils import block_time_range
+
+
+def block_key(b):
+    """block 在索引裡的 key；舊排程檔可能沒有 id，就用物件本身識別。"""
+    return b.get("id") or f"obj-{id(b)}"
+
+
+class BlockIntervalIndex:
+    """
+    每條軌道一份依開始時間排序的區間清單，用來做重疊檢查：
+    - overlaps() 用 bisect 找出可能重疊的範圍，O(log n + k)，不再逐筆建 QDateTime
+    - 增刪改時呼叫 upsert() / remove()；整批替換 block_data 時呼叫 rebuild()
+    """
+    def __init__(self):
+        self._starts = {}    # {track: [start_ts]}（與 _items 同順序，給 bisect 用）
+        self._items = {}     # {track: [(start_ts, end_ts, key)]}
+        self._lengths = {}   # {track: 排序後的區間秒數}；最後一個是最長的，決定往前要看多遠（刪掉長節目後會縮回來）
+        self._where = {}     # {key: (track, start_ts, end_ts)}
+        self._blocks = {}    # {key: block dict}
+        self._unindexed = set()  # 時間欄位無效、無法放進索引的 key（仍計入筆數）
+
+    def __len__(self):
+        return len(self._where) + len(self._unindexed)
+
+    def rebuild(self, block_data):
+        self._starts.clear()
+        self._items.clear()
+        self._lengths.clear()
+        self._where.clear()
+        self._blocks.clear()
+        self._unindexed.clear()
+        for b in block_data:
+            entry = self._entry(b)
+            if entry is None:
+                self._unindexed.add(block_key(b))
+                continue
+            track, start_ts, end_ts, key = entry
+            self._where[key] = (track, start_ts, end_ts)  # 重複 id 以最後一筆為準（與 upsert 相同）
+            self._blocks[key] = b
+        rows = {}
+        for key, (track, start_ts, end_ts) in self._where.items():
+            rows.setdefault(track, []).append((start_ts, end_ts, key))
+        for track, items in rows.items():
+            items.sort()
+            self._items[track] = items
+            self._starts[track] = [s for s, _, _ in items]
+            self._lengths[track] = sorted(e - s for s, e, _ in items)
+
+    @staticmethod
+    def _entry(b):
+        try:
+            track = int(b["track_index"])
+            start_ts, end_ts = block_time_range(b)
+        except Exception:
+            return None
+        return track, start_ts, end_ts, block_key(b)
+
+    def get(self, block_id):
+        """依 id 取回 block dict；不在索引裡就回 None。"""
+        return self._blocks.get(block_id)
+
+    def upsert(self, b):
+        """新增或更新一個 block；時間和軌道沒變就什麼都不做。"""
+        entry = self._entry(b)
+        if entry is None:
+            self._discard(block_key(b))
+            self._unindexed.add(block_key(b))
+            return
+        track, start_ts, end_ts, key = entry
+        self._unindexed.discard(key)
+        self._blocks[key] = b
+        if self._where.get(key) == (track, start_ts, end_ts):
+            return
+        self._discard(key)
+        self._where[key] = (track, start_ts, end_ts)
+        items = self._items.setdefault(track, [])
+        starts = self._starts.setdefault(track, [])
+        i = bisect.bisect_left(items, (start_ts, end_ts, key))
+        items.insert(i, (start_ts, end_ts, key))
+        starts.insert(i, start_ts)
+        bisect.insort(self._lengths.setdefault(track, []), end_ts - start_ts)
+
+    def remove(self, block_id):
+        self._discard(block_id)
+        self._unindexed.discard(block_id)
+        self._blocks.pop(block_id, None)
+
+    def _discard(self, key):
+        where = self._where.pop(key, None)
+        if where is None:
+            return
+        track, start_ts, end_ts = where
+        items = self._items.get(track, [])
+        i = bisect.bisect_left(items, (start_ts, end_ts, key))
+        if i < len(items) and items[i][2] == key:
+            del items[i]
+            del self._starts[track][i]
+            lengths = self._lengths[track]
+            del lengths[bisect.bisect_left(lengths, end_ts - start_ts)]
+
+    def overlaps(self, track_index, start_ts, end_ts, exclude_id=None):
+        """回傳與 [start_ts, end_ts) 重疊的 block dict（依開始時間排序）。"""
+        starts = self._starts.get(track_index)
+        if not starts:
+            return []
+        items = self._items[track_index]
+        lo = bisect.bisect_right(starts, start_ts - self._lengths[track_index][-1])
+        hi = bisect.bisect_left(starts, end_ts)
+        found = []
+        for s, e, key in items[lo:hi]:
+            if key == exclude_id or e <= start_ts:
+                continue
+            found.append(self._blocks[key])
+        return found
+
+    def in_range(self, start_ts, end_ts):
+        """所有軌道中與 [start_ts, end_ts) 重疊的 block（畫面範圍用）。"""
+        found = []
+        for track in list(self._items):
+            found.extend(self.overlaps(track, start_ts, end_ts))
+        return found
+
+    def intervals(self):
+        """所有已索引區間 [(track, start_ts, end_ts)]（批次比對用，不保證順序）。"""
+        return list(self._where.values())
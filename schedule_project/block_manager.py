@@ -67,6 +67,7 @@ class BlockManager:
 
         # 從 block_data 移除
         self.view.block_data = [b for b in self.view.block_data if b.get("id") != block_id]
+        self.view.forget_block(block_id)
         self.view.save_schedule()
         log(f"🗑️ 已刪除 block：{block_id}")
 
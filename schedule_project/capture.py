@@ -101,12 +101,12 @@ def take_snapshot_by_encoder(encoder_name, preview_root: str | None = None):
         #     log(f"❌ 無法讀取 snapshot_dir：{e}")
         #     return None
 
-        log(f"📸 為 {encoder_name} 拍照 ➜ 儲存預期路徑：{snapshot_full_path}")
-        log(f"🛰️ 傳給 encoder 的路徑（不含副檔名）：{snapshot_relative}")
+        log("📸 為 %s 拍照 ➜ 儲存預期路徑：%s", encoder_name, snapshot_full_path, level="DEBUG")
+        log("🛰️ 傳給 encoder 的路徑（不含副檔名）：%s", snapshot_relative, level="DEBUG")
 
         send_encoder_command(encoder_name, f'SetSnapshotFileName "{encoder_name}" "{snapshot_relative}"')
         res = send_encoder_command(encoder_name, f'SnapShot "{encoder_name}"')
-        log(f"📡 Snapshot 回應：{res}")
+        log("📡 Snapshot 回應：%s", res, level="DEBUG", encoder=encoder_name, command="SnapShot")
 
         cancel_event = threading.Event()
 
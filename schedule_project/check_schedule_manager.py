@@ -1,70 +1,34 @@
 # check_schedule_manager.py
-from PySide6.QtCore import QDateTime, QDate, QTime, QObject, Signal, QRunnable, QThreadPool
+import heapq
+import itertools
+from PySide6.QtCore import QDateTime, QDate, QTime, QObject, QTimer, Qt
 from shiboken6 import isValid
-from utils import log
+from utils import log, block_time_range
 from encoder_utils import get_encoder_display_name
-from encoder_status_manager import EncoderStatusManager
 
-# ---------------- Worker ----------------
-class _CheckWorkerSignals(QObject):
-    done = Signal(list)   # [{'action': 'start'|'stop', 'block_id': str, 'encoder_name': str}]
+START_GRACE_S = 1      # 開始時間過了幾秒內仍會啟動（與舊版每秒檢查的 0~1 秒相同）
+MAX_ARM_MS = 60000     # 計時器單次最長等待；系統時間跳動或休眠後最慢一分鐘內重新對時
+_ACTION_ORDER = {"stop": 0, "start": 1}  # 同一秒先停再開：接檔節目不會被前一檔的停止指令關掉
 
 
-class _CheckWorker(QRunnable):
-    """
-    真正做「排程計算」的背景工作：
-    - 不觸碰 UI 物件
-    - 不直接呼叫 runner（避免跨執行緒）
-    - 只回傳要做的動作清單，由主線程套用
-    """
-    def __init__(self, snapshot):
-        super().__init__()
-        self.snapshot = snapshot
-        self.signals = _CheckWorkerSignals()
-
-    def run(self):
-        now = QDateTime.currentDateTime()
-        actions = []
-
-        enc_names = self.snapshot["encoder_names"]
-        started = set(self.snapshot["already_started"])
-        stopped = set(self.snapshot["already_stopped"])
-
-        for b in self.snapshot["today_blocks"]:
-            block_id = b["id"]
-            if not block_id:
-                continue
-
-            qdate = b["qdate"]
-            end_qdate = b.get("end_qdate", qdate)
-
-            start_hour = float(b["start_hour"])
-            end_hour   = float(b.get("end_hour", b["start_hour"] + b["duration"]))
-
-            start_dt = QDateTime(qdate, QTime(int(start_hour), int((start_hour % 1) * 60)))
-            end_dt   = QDateTime(end_qdate, QTime(int(end_hour), int((end_hour % 1) * 60)))
-
-            track_idx = b["track_index"]
-            if not (0 <= track_idx < len(enc_names)):
-                continue
-            encoder_name = enc_names[track_idx]
-
-            # ➤ 自動開始
-            delta = start_dt.secsTo(now)  # start_dt -> now（到點=0）
-            if 0 <= delta <= 1 and block_id not in started:
-                actions.append({"action": "start", "block_id": block_id, "encoder_name": encoder_name})
+def _julian(d):
+    return d.toJulianDay() if isinstance(d, QDate) else d
 
-            # ➤ 自動停止
-            if now >= end_dt and block_id not in stopped:
-                actions.append({"action": "stop", "block_id": block_id, "encoder_name": encoder_name})
 
-        self.signals.done.emit(actions)
+def _block_signature(b):
+    """只用來判斷 block 的時間/軌道有沒有變，不做 QDateTime 運算（含 end_hour/end_qdate：跨日節目的結束時間由它們決定）。"""
+    return (_julian(b.get("qdate")), b.get("start_hour"), b.get("duration"),
+            b.get("end_hour"), _julian(b.get("end_qdate")), b.get("track_index"))
 
 
 # ---------------- Manager ----------------
 class CheckScheduleManager(QObject):
     """
-    管理『排程檢查』，把重工作業丟到背景，主線程只負責套用結果。
+    事件驅動的排程器：
+    - 以 min-heap 保存 (時間, 動作, block_id)，只為「下一個事件」設一個精準計時器
+    - 單筆增刪改（含拖拉）由 touch_block/forget_block 呼叫 notify_changed()/notify_removed()，只重算那幾筆
+    - 整份換掉（載入、換頁、軌道重排、重複規則重新展開）才呼叫 notify_schedule_changed() 完整比對一次
+    - 被修改/刪除的 block 舊事件不從 heap 移除，出列時比對 key 後略過（lazy invalidation）
     """
     def __init__(self, encoder_names, encoder_status_dict, runner, parent_view_getter):
         super().__init__()
@@ -77,59 +41,166 @@ class CheckScheduleManager(QObject):
         self.already_started = set()
         self.already_stopped = set()
         self.last_saved_ts = None
-        self.encoder_status_manager = EncoderStatusManager()
-        self._pool = QThreadPool.globalInstance()
-
-    # --- 將必要資料快照化，避免在 worker 內存取 Qt 物件 ---
-    def _make_snapshot(self):
-        today = QDate.currentDate()
-        today_blocks = []
-        for b in self.schedule_data:
+
+        self._heap = []              # [(ts, order, seq, action, block_id, key)]
+        self._keys = {}              # {block_id: (start_ts, end_ts, track_index)}；目前有效的事件 key
+        self._signatures = {}        # {block_id: _block_signature(b)}
+        self._seq = itertools.count()
+        self._changed = set()        # 待同步：新增/修改的 block_id
+        self._removed = set()        # 待同步：刪除的 block_id
+        self._full_sync = True       # 下一次同步要完整比對 block_data（第一次一定是）
+        self._sync_pending = False
+        self._is_closing = False
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.timeout.connect(self._on_timer)
+
+    # --- 排程異動 ---
+    def notify_schedule_changed(self):
+        """整份排程換掉時呼叫（載入、換頁、軌道重排、重複規則重新展開）：下一次同步完整比對 block_data。"""
+        self._full_sync = True
+        self._request_sync()
+
+    def notify_changed(self, block_ids):
+        """這幾筆 block 新增或修改了（touch_block 呼叫）：只重算它們的事件。"""
+        for block_id in block_ids:
+            if block_id:
+                self._removed.discard(block_id)
+                self._changed.add(block_id)
+        self._request_sync()
+
+    def notify_removed(self, block_ids):
+        """這幾筆 block 刪除了（forget_block 呼叫）：讓它們的舊事件失效。"""
+        for block_id in block_ids:
+            if block_id:
+                self._changed.discard(block_id)
+                self._removed.add(block_id)
+        self._request_sync()
+
+    def _request_sync(self):
+        """同一輪事件迴圈內的多次通知只同步一次（拖拉時很密集）。"""
+        if self._sync_pending or self._is_closing:
+            return
+        self._sync_pending = True
+        QTimer.singleShot(0, self.sync_blocks)
+
+    def sync_blocks(self):
+        """替新增/修改的 block 推入事件、讓刪除的舊事件失效；平常只看通知過的 id，整份換掉時才掃全部。"""
+        self._sync_pending = False
+        if self._is_closing:
+            return
+        parent_view = self.get_parent_view() if self.get_parent_view else None
+        if parent_view is not None:
+            self.schedule_data = parent_view.block_data
+        changed_ids, removed_ids = self._changed, self._removed
+        self._changed, self._removed = set(), set()
+        full = self._full_sync or parent_view is None
+        self._full_sync = False
+
+        if full:
+            blocks = self.schedule_data
+        else:
+            blocks = []
+            for block_id in changed_ids:
+                b = parent_view.block_index.get(block_id)
+                if b is None:
+                    removed_ids.add(block_id)  # 已不在排程裡（之後又被刪掉、或成了孤兒）
+                else:
+                    blocks.append(b)
+
+        now_ts = QDateTime.currentDateTime().toSecsSinceEpoch()
+        today_ts = QDateTime(QDate.currentDate(), QTime(0, 0)).toSecsSinceEpoch()
+        seen = set()
+        changed = 0
+
+        for b in blocks:
             block_id = b.get("id")
             if not block_id:
                 continue
+            seen.add(block_id)
+            sig = _block_signature(b)
+            if self._signatures.get(block_id) == sig:
+                continue
+            try:
+                start_ts, end_ts = block_time_range(b)
+                key = (start_ts, end_ts, int(b["track_index"]))
+            except Exception as e:
+                log(f"⚠️ 無法計算排程時間（{b.get('label')}）：{e}")
+                continue
+            self._signatures[block_id] = sig
+            self._keys[block_id] = key
+            self._push_events(block_id, key, now_ts, today_ts)
+            changed += 1
+
+        if full:
+            removed = [bid for bid in self._keys if bid not in seen]
+        else:
+            removed = [bid for bid in removed_ids if bid in self._keys]
+        for block_id in removed:
+            self._keys.pop(block_id, None)
+            self._signatures.pop(block_id, None)
+
+        # ⛑️ 失效事件太多就重建 heap，避免長時間編輯後越堆越大
+        if len(self._heap) > 4 * len(self._keys) + 64:
+            self._heap = [e for e in self._heap if self._keys.get(e[4]) == e[5]]
+            heapq.heapify(self._heap)
+
+        if changed or removed:
+            log("🗓️ 排程事件更新：變更 %d、刪除 %d（佇列 %d）", changed, len(removed), len(self._heap), level="DEBUG")
+        self._arm()
+
+    def _push_events(self, block_id, key, now_ts, today_ts):
+        start_ts, end_ts, _ = key
+        if start_ts >= now_ts - START_GRACE_S:
+            heapq.heappush(self._heap, (start_ts, _ACTION_ORDER["start"], next(self._seq), "start", block_id, key))
+        # ➤ 今天已結束的節目仍會補送一次停止（與舊版相同）；更早的就不管了
+        if end_ts >= now_ts or start_ts >= today_ts:
+            heapq.heappush(self._heap, (end_ts, _ACTION_ORDER["stop"], next(self._seq), "stop", block_id, key))
+
+    # --- 計時器 ---
+    def _arm(self):
+        while self._heap and self._keys.get(self._heap[0][4]) != self._heap[0][5]:
+            heapq.heappop(self._heap)
+        if self._is_closing or not self._heap:
+            self._timer.stop()
+            return
+        wait_ms = self._heap[0][0] * 1000 - QDateTime.currentMSecsSinceEpoch()
+        self._timer.start(int(min(max(wait_ms, 0), MAX_ARM_MS)))
 
-            qdate = b["qdate"]
-            if isinstance(qdate, str):
-                qdate = QDate.fromString(qdate, "yyyy-MM-dd")
-
-            # 只處理今天
-            if qdate != today:
+    def _on_timer(self):
+        if self._is_closing:
+            return
+        now_ts = QDateTime.currentDateTime().toSecsSinceEpoch()
+        actions = []
+        while self._heap and self._heap[0][0] <= now_ts:
+            ts, _, _, action, block_id, key = heapq.heappop(self._heap)
+            if self._keys.get(block_id) != key:
+                continue  # block 已被修改或刪除
+            track_idx = key[2]
+            if not (0 <= track_idx < len(self.encoder_names)):
+                continue
+            if action == "start" and now_ts - ts > START_GRACE_S:
+                log(f"⚠️ 錯過開始時間 {now_ts - ts} 秒，略過自動開始：{block_id}", level="WARNING", block_id=block_id)
                 continue
+            actions.append({"action": action, "block_id": block_id, "encoder_name": self.encoder_names[track_idx]})
 
-            end_qdate = b.get("end_qdate", qdate)
-            if isinstance(end_qdate, str):
-                end_qdate = QDate.fromString(end_qdate, "yyyy-MM-dd")
-
-            today_blocks.append({
-                "id": block_id,
-                "qdate": qdate,
-                "end_qdate": end_qdate,
-                "track_index": b["track_index"],
-                "start_hour": float(b["start_hour"]),
-                "duration": float(b["duration"]),
-                "end_hour": float(b.get("end_hour", b["start_hour"] + b["duration"])),
-                "label": b["label"]
-            })
-
-        return {
-            "encoder_names": list(self.encoder_names),
-            "already_started": list(self.already_started),
-            "already_stopped": list(self.already_stopped),
-            "today_blocks": today_blocks,
-        }
-
-    # 主線程呼叫：把檢查丟到背景
-    def tick_async(self):
         try:
-            snap = self._make_snapshot()
-            worker = _CheckWorker(snap)
-            worker.signals.done.connect(self._apply_actions_on_main)
-            self._pool.start(worker)
-        except Exception as e:
-            log(f"❌ tick_async error: {e}")
-
-    # 主線程 slot：依 worker 結果套用動作（這裡才觸碰 UI / runner）
+            self._apply_actions_on_main(actions)
+        finally:
+            self._arm()
+
+    def upcoming(self, limit=10):
+        """接下來的有效事件 [(ts, action, block_id)]（給狀態查詢用，不影響計時器）。"""
+        valid = (e for e in self._heap if self._keys.get(e[4]) == e[5])
+        return [(ts, action, block_id) for ts, _, _, action, block_id, _ in heapq.nsmallest(limit, valid)]
+
+    def stop(self):
+        self._is_closing = True
+        self._timer.stop()
+
+    # 主線程：套用到點的動作（這裡才觸碰 UI / runner）
     def _apply_actions_on_main(self, actions: list):
         if not actions:
             return
@@ -151,18 +222,22 @@ class CheckScheduleManager(QObject):
             label = block.label if block else next((b["label"] for b in self.schedule_data if b.get("id") == block_id), "")
 
             if action == "start" and block_id not in self.already_started:
-                log(f"🚀 [主線程] 啟動錄影：{label} ({block_id}) on {enc}")
+                log(f"🚀 [主線程] 啟動錄影：{label} ({block_id}) on {enc}", encoder=enc, block_id=block_id, command="start")
                 self.runner.start_encoder(enc, label, status_label, block_id)
                 self.already_started.add(block_id)
 
             elif action == "stop" and block_id not in self.already_stopped:
-                log(f"🛑 [主線程] 停止錄影：{label} ({block_id}) on {enc}")
+                log(f"🛑 [主線程] 停止錄影：{label} ({block_id}) on {enc}", encoder=enc, block_id=block_id, command="stop")
                 self.runner.stop_encoder(enc, status_label)
                 self.already_stopped.add(block_id)
 
         # 套用後更新畫面 / 儲存
         parent_view = self.get_parent_view()
         if parent_view:
+            for act in actions:
+                b = parent_view.block_index.get(act["block_id"])
+                if b is not None:
+                    parent_view.touch_block(b, materialize=False)  # runner 可能改了 status（重複排程的那一次不因此存檔）
             parent_view.save_schedule()
             parent_view.update()
 
@@ -0,0 +1,274 @@
+# control_api.py
+"""
+scheduler_daemon 的本機控制 API（只綁 127.0.0.1，config.json 設定 api_port 才啟用）：
+  GET  /api/blocks?from=yyyy-MM-dd&to=yyyy-MM-dd[&encoder=名稱]   查詢日期範圍（含 to 當天）
+  POST /api/blocks/batch   {"add": [...], "update": [...], "delete": [id, ...], "atomic": true, "dry_run": false}
+                           伺服器端檢查同軌重疊；atomic 時有一筆被拒絕就整批不套用（409）
+  GET  /api/status         encoder 狀態與接下來的排程事件
+  GET  /api/stream         WebSocket：encoder 狀態變化與排程事件，每則一個 JSON 文字訊息
+block 欄位與 schedule.json 相同（qdate / start_hour / duration / label / encoder_name 或 track_index / id）。
+
+安全性（只綁 127.0.0.1 不夠：瀏覽器裡的網頁也連得到本機）：
+- Host 必須是 127.0.0.1:<port> 或 localhost:<port>，擋 DNS rebinding（換成本機 IP 的外部網域）
+- WebSocket 不受 CORS 限制：帶了 Origin（瀏覽器一定會帶）就必須是本機來源
+- config.json 設定 api_token 時，所有請求都要帶 Authorization: Bearer <token>；
+  瀏覽器的 WebSocket 不能自訂 header，/api/stream 也接受 ?token=<token>
+- POST 一律要求 Content-Type: application/json
+"""
+import hmac
+import json
+from urllib.parse import parse_qs, urlsplit
+from PySide6.QtCore import QObject, QDate, QDateTime, QTime
+from PySide6.QtNetwork import QHostAddress, QTcpServer
+from PySide6.QtWebSockets import QWebSocketServer
+from utils import log, log_exception
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 8 * 1024 * 1024     # 一天幾百筆節目綽綽有餘
+UPCOMING_EVENTS = 10                 # /api/status 列出幾個接下來的事件
+_LOCAL_HOSTS = ("127.0.0.1", "localhost")
+_LOCAL_ORIGIN_HOSTS = ("127.0.0.1", "localhost", "::1")   # 本機其他 port 的頁面（例如自架的監看頁）也算
+_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+            413: "Payload Too Large", 415: "Unsupported Media Type", 431: "Request Header Fields Too Large",
+            500: "Internal Server Error"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_date(query, key):
+    values = query.get(key)
+    if not values:
+        raise ApiError(400, f"缺少參數 {key}（yyyy-MM-dd）")
+    qdate = QDate.fromString(values[0], "yyyy-MM-dd")
+    if not qdate.isValid():
+        raise ApiError(400, f"{key} 格式須為 yyyy-MM-dd")
+    return qdate
+
+
+class ControlApiServer(QObject):
+    """
+    HTTP/1.1（一個請求一條連線）+ WebSocket 串流，都在 daemon 的事件迴圈裡跑：
+    - 不另開執行緒，讀寫排程資料與排程器同一條線，不必加鎖
+    - /api/stream 的 Upgrade 請求交給 QWebSocketServer.handleConnection（同一個 port）
+    """
+    def __init__(self, daemon, token=None, parent=None):
+        super().__init__(parent)
+        self.daemon = daemon
+        self.token = token or None       # config.json 的 api_token；None 表示不驗證
+        self.port = None
+        self.server = QTcpServer(self)
+        self.server.newConnection.connect(self._on_new_connection)
+        self.ws_server = QWebSocketServer("recorder-scheduler", QWebSocketServer.NonSecureMode, self)
+        self.ws_server.newConnection.connect(self._on_ws_connection)
+        self._streams = []               # [QWebSocket]
+        daemon.eventBroadcast.connect(self._publish)
+        if daemon.status_service is not None:
+            daemon.status_service.statusChanged.connect(self._on_encoder_status)
+
+    def listen(self, port) -> bool:
+        if not self.server.listen(QHostAddress(QHostAddress.LocalHost), port):
+            log(f"❌ 控制 API 無法監聽 127.0.0.1:{port}：{self.server.errorString()}", level="ERROR")
+            return False
+        self.port = self.server.serverPort()
+        log(f"🌐 控制 API 已啟動：http://127.0.0.1:{self.port}/api/")
+        if self.token is None:
+            log("⚠️ 控制 API 未設定 api_token：本機任何程式都能修改排程", level="WARNING")
+        return True
+
+    # --- HTTP ---
+    def _on_new_connection(self):
+        while self.server.hasPendingConnections():
+            sock = self.server.nextPendingConnection()
+            sock.readyRead.connect(lambda s=sock: self._on_ready_read(s))
+            sock.disconnected.connect(sock.deleteLater)
+
+    def _on_ready_read(self, sock):
+        # ➤ 只 peek：完整收到 header + body 才取出；WebSocket 升級時原封不動交給 QWebSocketServer
+        data = bytes(sock.peek(sock.bytesAvailable()).data())
+        head_end = data.find(b"\r\n\r\n")
+        if head_end < 0:
+            if len(data) > MAX_HEADER_BYTES:
+                self._respond(sock, 431, {"error": "header 太大"})
+            return
+        try:
+            request_line, *header_lines = data[:head_end].decode("iso-8859-1").split("\r\n")
+            method, target, _ = request_line.split(" ", 2)
+            headers = {}
+            for line in header_lines:
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            self._respond(sock, 400, {"error": "無法解析的 HTTP 請求"})
+            return
+        path, _, query = target.partition("?")
+        query = parse_qs(query)
+
+        denied = self._check_access(headers, query, websocket=headers.get("upgrade", "").lower() == "websocket")
+        if denied is not None:
+            log("🌐 拒絕 %s %s：%s", method, path, denied[1], level="WARNING")
+            self._respond(sock, *denied)
+            return
+
+        if headers.get("upgrade", "").lower() == "websocket":
+            if path != "/api/stream":
+                self._respond(sock, 404, {"error": f"沒有這個串流：{path}"})
+                return
+            sock.readyRead.disconnect()
+            sock.disconnected.disconnect()
+            self.ws_server.handleConnection(sock)
+            return
+
+        if length > MAX_BODY_BYTES:
+            self._respond(sock, 413, {"error": f"內容超過 {MAX_BODY_BYTES} bytes"})
+            return
+        total = head_end + 4 + length
+        if len(data) < total:
+            return  # body 還沒收完
+        sock.read(total)
+        body = data[head_end + 4:total]
+
+        try:
+            status, payload = self._route(method, path, query, headers, body)
+        except ApiError as e:
+            status, payload = e.status, {"error": str(e)}
+        except Exception as e:
+            log_exception(f"❌ 控制 API 處理失敗（{method} {path}）：{e}")
+            status, payload = 500, {"error": str(e)}
+        log("🌐 %s %s ➜ %d", method, path, status, level="DEBUG")
+        self._respond(sock, status, payload)
+
+    def _check_access(self, headers, query, websocket=False):
+        """不允許就回 (status, payload)，允許回 None。"""
+        allowed = {f"{host}:{self.port}" for host in _LOCAL_HOSTS}
+        if headers.get("host", "").lower() not in allowed:
+            return 403, {"error": "Host 必須是 127.0.0.1 或 localhost"}
+        if websocket and "origin" in headers:
+            origin = urlsplit(headers["origin"])
+            if origin.scheme not in ("http", "https") or origin.hostname not in _LOCAL_ORIGIN_HOSTS:
+                return 403, {"error": "不接受本機以外的網頁連線"}
+        if self.token is not None:
+            auth = headers.get("authorization", "")
+            given = auth[7:].strip() if auth.lower().startswith("bearer ") else ""
+            if not given and websocket:
+                given = (query.get("token") or [""])[0]
+            if not hmac.compare_digest(given.encode("utf-8"), self.token.encode("utf-8")):
+                return 401, {"error": "缺少或錯誤的 api_token"}
+        return None
+
+    def _respond(self, sock, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n")
+        sock.write(head.encode("ascii") + body)
+        sock.disconnectFromHost()  # 寫完才真的關
+
+    def _route(self, method, path, query, headers, body):
+        routes = {
+            "/api/blocks": {"GET": lambda: self._get_blocks(query)},
+            "/api/blocks/batch": {"POST": lambda: self._post_batch(headers, body)},
+            "/api/status": {"GET": self._get_status},
+        }
+        handlers = routes.get(path.rstrip("/") or "/")
+        if handlers is None:
+            raise ApiError(404, f"沒有這個路徑：{path}")
+        handler = handlers.get(method)
+        if handler is None:
+            raise ApiError(405, f"{path} 只接受 {', '.join(handlers)}")
+        return handler()
+
+    def _get_blocks(self, query):
+        first, last = _parse_date(query, "from"), _parse_date(query, "to")
+        if last < first:
+            raise ApiError(400, "to 不能早於 from")
+        track = None
+        if query.get("encoder"):
+            name = query["encoder"][0]
+            if name not in self.daemon.encoder_names:
+                raise ApiError(404, f"沒有這台 encoder：{name}")
+            track = self.daemon.encoder_names.index(name)
+        start_ts = QDateTime(first, QTime(0, 0)).toSecsSinceEpoch()
+        end_ts = QDateTime(last.addDays(1), QTime(0, 0)).toSecsSinceEpoch()
+        blocks = self.daemon.query_range(start_ts, end_ts, track_index=track)
+        return 200, {"from": first.toString("yyyy-MM-dd"), "to": last.toString("yyyy-MM-dd"),
+                     "count": len(blocks), "blocks": blocks}
+
+    def _post_batch(self, headers, body):
+        if not headers.get("content-type", "").lower().startswith("application/json"):
+            raise ApiError(415, "Content-Type 必須是 application/json")
+        try:
+            payload = json.loads(body.decode("utf-8") or "{}")
+        except ValueError as e:
+            raise ApiError(400, f"JSON 格式錯誤：{e}")
+        if not isinstance(payload, dict):
+            raise ApiError(400, "內容必須是 JSON 物件")
+        ops = {}
+        for key in ("add", "update", "delete"):
+            value = payload.get(key) or []
+            if not isinstance(value, list):
+                raise ApiError(400, f"{key} 必須是陣列")
+            ops[key] = value
+        report = self.daemon.apply_batch(
+            add=ops["add"], update=ops["update"], delete=ops["delete"],
+            atomic=bool(payload.get("atomic", True)), dry_run=bool(payload.get("dry_run", False)),
+        )
+        # 409：因為有衝突/錯誤而整批沒套用；部分套用（atomic=false）或 dry_run 仍回 200
+        blocked = report["rejected"] and not report["applied"] and not report["dry_run"]
+        return (409 if blocked else 200), report
+
+    def _get_status(self):
+        daemon = self.daemon
+        return 200, {
+            "encoders": self._encoder_states(),
+            "blocks": len(daemon.block_data),
+            "orphans": len(daemon.orphan_blocks),
+            "source": daemon.store.db_path if daemon.store is not None else daemon.schedule_file,
+            "upcoming": [{"ts": ts, "action": action, "block_id": block_id}
+                         for ts, action, block_id in daemon.manager.upcoming(UPCOMING_EVENTS)],
+            "gui_clients": daemon.client_count,
+            "streams": len(self._streams),
+        }
+
+    def _encoder_states(self):
+        service = self.daemon.status_service
+        states = service.states() if service is not None else {}
+        return {name: {"text": text, "color": color} for name, (text, color) in states.items()}
+
+    # --- WebSocket 串流 ---
+    def _on_ws_connection(self):
+        while self.ws_server.hasPendingConnections():
+            ws = self.ws_server.nextPendingConnection()
+            self._streams.append(ws)
+            ws.disconnected.connect(lambda w=ws: self._drop_stream(w))
+            # ✅ 先送一次目前狀態，之後只送變化
+            ws.sendTextMessage(json.dumps({"event": "hello", "encoders": self._encoder_states()}, ensure_ascii=False))
+            log("🌐 狀態串流已連線（共 %d 個）", len(self._streams), level="DEBUG")
+
+    def _drop_stream(self, ws):
+        if ws in self._streams:
+            self._streams.remove(ws)
+        ws.deleteLater()
+
+    def _on_encoder_status(self, name, state):
+        text, color = state
+        self._publish({"event": "encoder", "name": name, "text": text, "color": color})
+
+    def _publish(self, msg):
+        if not self._streams:
+            return
+        text = json.dumps(msg, ensure_ascii=False)
+        for ws in list(self._streams):
+            ws.sendTextMessage(text)
+
+    def close(self):
+        for ws in list(self._streams):
+            ws.close()
+        self._streams.clear()
+        self.ws_server.close()
+        self.server.close()
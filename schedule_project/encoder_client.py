@@ -0,0 +1,255 @@
+# encoder_client.py
+import asyncio
+import re
+import threading
+import time
+
+import encoder_utils as eu
+from utils import log
+
+CONNECT_TIMEOUT_S = 3
+CONNECT_BACKOFF_S = 5     # 連線失敗後，這段時間內同主機的指令直接回失敗，不再逐一等 connect 逾時
+# 回覆中會帶 encoder 名稱的指令：用來確認回覆真的是這個請求的（例：OK: Bak4-1:Runned）
+_ECHO_NAME_RE = re.compile(r'^(EncStatus)\s+"([^"]+)"', re.IGNORECASE)
+
+
+class _Endpoint:
+    """一個實體 encoder 主機（host:port）的連線狀態；只在 event loop 執行緒內存取。"""
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.lock = asyncio.Lock()   # 同一條連線一次只跑一個指令
+        self.buf = b""
+        self.depth = 0               # 排隊中 + 執行中的指令數
+        self.max_depth = 0
+        self.mismatches = 0          # 回覆與請求對不上的次數
+        self.down_until = 0.0        # monotonic 秒；連線失敗後的快速失敗期限
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    def __str__(self):
+        return f"{self.host}:{self.port}"
+
+
+class EncoderClient:
+    """
+    asyncio 版 encoder 客戶端：
+    - 每個 host:port 只開一條連線，多個邏輯 encoder（Bak4-1、Bak4-2…）共用
+    - 同一條連線上的指令依序送出，回覆用 encoder_utils 的框架規則切開
+    - send() 可 await；send_sync() 給 Qt 端的同步呼叫者使用（執行緒安全）
+    """
+    def __init__(self):
+        self._endpoints: dict[tuple[str, int], _Endpoint] = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="EncoderClient", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @staticmethod
+    def _resolve(encoder_name: str):
+        info = eu.encoder_config.get(encoder_name)
+        if not info:
+            return None
+        return info.get("host"), int(info.get("port"))
+
+    def _endpoint(self, key) -> _Endpoint:
+        ep = self._endpoints.get(key)
+        if ep is None:
+            ep = _Endpoint(*key)
+            self._endpoints[key] = ep
+        return ep
+
+    async def _connect(self, ep: _Endpoint):
+        ep.reader, ep.writer = await asyncio.wait_for(
+            asyncio.open_connection(ep.host, ep.port), timeout=CONNECT_TIMEOUT_S
+        )
+        ep.buf = b""
+        log(f"✅ 連線成功 ({ep})")
+
+    async def _drop(self, ep: _Endpoint):
+        writer, ep.reader, ep.writer, ep.buf = ep.writer, None, None, b""
+        if writer is None:
+            return
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+    async def _read_reply(self, ep: _Endpoint, timeout: float, lines=None):
+        """回傳 (reply, complete)；complete=False 代表逾時或對方關閉，只拿到部分資料。lines 見 eu.REPLY_LINES。"""
+        deadline = time.monotonic() + timeout
+        while True:
+            reply, rest = eu._split_reply(ep.buf, lines)
+            if reply is not None:
+                ep.buf = rest
+                return reply.decode("utf-8", errors="replace"), True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            quiet = not lines and eu._line_complete(rest)
+            wait = min(remaining, eu.RESPONSE_GRACE_S) if quiet else remaining
+            try:
+                chunk = await asyncio.wait_for(ep.reader.read(4096), timeout=wait)
+            except asyncio.TimeoutError:
+                if quiet:
+                    ep.buf = b""
+                    return rest.strip().decode("utf-8", errors="replace"), True
+                continue
+            if not chunk:
+                if not rest:
+                    raise ConnectionResetError("encoder 已關閉連線")
+                break
+            ep.buf = rest + chunk
+
+        partial, ep.buf = ep.buf.strip(), b""
+        return partial.decode("utf-8", errors="replace"), False
+
+    @staticmethod
+    def _matches(cmd: str, response: str) -> bool:
+        """回覆是否屬於這個指令；只檢查會回傳 encoder 名稱的指令，錯誤回覆一律放行。"""
+        m = _ECHO_NAME_RE.match(cmd)
+        if not m or not response.upper().startswith("OK"):
+            return True
+        return f"{m.group(2)}:" in response
+
+    async def _roundtrip(self, ep: _Endpoint, cmd: str, timeout: float) -> str:
+        ep.writer.write((cmd + "\r\n").encode("utf-8"))
+        await ep.writer.drain()
+        response, complete = await self._read_reply(ep, timeout, eu.reply_lines(cmd))
+        if not complete:
+            # 回覆沒收完整：之後才到的資料會被當成下一個指令的回覆，直接斷線重來
+            log(f"⚠️ {ep} 回覆不完整，重置連線")
+            await self._drop(ep)
+        return response
+
+    async def send(self, encoder_name: str, cmd: str, timeout: float = eu.RESPONSE_TIMEOUT_S, on_start=None) -> str:
+        """
+        送出指令並等待完整回覆；連線失效時會重連並重送一次。
+        on_start()：排到這條連線、真正開始送的那一刻呼叫（在 event loop 執行緒），給呼叫端從這時起算逾時。
+        """
+        key = self._resolve(encoder_name)
+        if key is None:
+            log(f"❌ 無法找到 encoder 設定: {encoder_name}")
+            return "❌ 無法連線"
+
+        ep = self._endpoint(key)
+        verb = cmd.split(" ", 1)[0]
+        ep.depth += 1
+        ep.max_depth = max(ep.max_depth, ep.depth)
+        try:
+            async with ep.lock:
+                if on_start is not None:
+                    on_start()
+                return await self._send_locked(ep, encoder_name, cmd, verb, timeout)
+        finally:
+            ep.depth -= 1
+
+    async def _send_locked(self, ep: _Endpoint, encoder_name: str, cmd: str, verb: str, timeout: float) -> str:
+        for attempt in (1, 2):
+            if not ep.connected:
+                if time.monotonic() < ep.down_until:
+                    return "❌ 無法連線"
+                try:
+                    await self._connect(ep)
+                except Exception as e:
+                    ep.down_until = time.monotonic() + CONNECT_BACKOFF_S
+                    log(f"❌ {encoder_name} 連線失敗 ({ep}): {e}")
+                    return "❌ 無法連線"
+            t0 = time.perf_counter()
+            try:
+                response = await self._roundtrip(ep, cmd, timeout)
+            except asyncio.CancelledError:
+                # ⛑️ 呼叫端逾時取消：指令可能已送出、回覆還沒讀，晚到的回覆會被下一個指令讀到，直接斷線
+                await self._drop(ep)
+                raise
+            except (OSError, ConnectionError) as e:
+                await self._drop(ep)
+                if attempt == 1:
+                    log(f"⚠️ {ep} 連線失效，重連後重送：{e}")
+                    continue
+                log(f"❌ 指令傳送失敗: {e}")
+                return ""
+            if not self._matches(cmd, response):
+                # 收到別人的回覆：連線上的回覆順序已亂，重置後重送
+                ep.mismatches += 1
+                log(f"⚠️ {ep} 回覆與請求不符（{cmd} ➜ {response!r}），重置連線")
+                await self._drop(ep)
+                if attempt == 1:
+                    continue
+                return ""
+            latency_ms = (time.perf_counter() - t0) * 1000
+            eu.last_latency_ms[verb] = latency_ms
+            log("⬅️ Response (%s %.1f ms, q=%d):\n %s", verb, latency_ms, ep.depth, response, level="DEBUG",
+                encoder=encoder_name, command=verb, latency_ms=round(latency_ms, 1))
+            return response.strip()
+        return ""
+
+    def send_sync(self, encoder_name: str, cmd: str, timeout: float = eu.RESPONSE_TIMEOUT_S, on_start=None) -> str:
+        """給一般執行緒（Qt 主線程、QRunnable）呼叫的同步版本。"""
+        fut = asyncio.run_coroutine_threadsafe(self.send(encoder_name, cmd, timeout, on_start), self._loop)
+        try:
+            return fut.result(timeout=timeout + 2 * CONNECT_TIMEOUT_S + 1)
+        except Exception as e:
+            fut.cancel()
+            log(f"❌ {encoder_name} 指令逾時：{e}")
+            return ""
+
+    async def _close(self, key=None):
+        targets = [self._endpoints.get(key)] if key else list(self._endpoints.values())
+        for ep in targets:
+            if ep:
+                async with ep.lock:
+                    await self._drop(ep)
+
+    def close(self, encoder_name: str | None = None):
+        """關閉某台 encoder 所在主機的連線；不指定就全部關閉。"""
+        key = self._resolve(encoder_name) if encoder_name else None
+        if encoder_name and key is None:
+            return
+        fut = asyncio.run_coroutine_threadsafe(self._close(key), self._loop)
+        try:
+            fut.result(timeout=CONNECT_TIMEOUT_S)
+        except Exception:
+            pass
+
+    def endpoint_count(self) -> int:
+        return sum(1 for ep in list(self._endpoints.values()) if ep.connected)
+
+    def queue_depth(self, encoder_name: str) -> int:
+        """某台 encoder 所在連線目前排隊 + 執行中的指令數。"""
+        key = self._resolve(encoder_name)
+        ep = self._endpoints.get(key) if key else None
+        return ep.depth if ep else 0
+
+    def stats(self) -> dict:
+        """{"host:port": {"depth", "max_depth", "mismatches", "connected"}}"""
+        return {
+            str(ep): {
+                "depth": ep.depth,
+                "max_depth": ep.max_depth,
+                "mismatches": ep.mismatches,
+                "connected": ep.connected,
+            }
+            for ep in list(self._endpoints.values())
+        }
+
+
+_client: EncoderClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_encoder_client() -> EncoderClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = EncoderClient()
+        return _client
@@ -18,7 +18,8 @@ class EncoderController:
 
         rel_path = os.path.relpath(full_path, start=self.record_root).replace("\\", "/")
 
-        log(f"[debug] Setfile target: encoder_name='{encoder_name}', rel_path='{rel_path}'")
+        log("Setfile target: encoder_name='%s', rel_path='%s'", encoder_name, rel_path, level="DEBUG",
+            encoder=encoder_name, command="Setfile")
 
 
         # 嘗試三參數格式
@@ -1,21 +1,48 @@
 # encoder_status_manager.py
 from encoder_utils import send_persistent_command  # 👈 改用持久連線
 from utils import log
+import threading
 import time
 import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+STATUS_DEADLINE_S = 3.0   # 每台 encoder 查詢的上限（從排到連線、真正送出算起）；超過就先回報逾時，不拖累其他台
+STATUS_MIN_WORKERS = 8    # 查詢執行緒下限；encoder 比這多時依台數加大，每台都能立刻開始查
+_status_executor = None
+_status_workers = 0
+_executor_lock = threading.Lock()
+
+
+def _executor_for(count: int) -> ThreadPoolExecutor:
+    """至少 count 條執行緒的共用 pool；不夠就換一個更大的（舊的跑完手上的就結束）。"""
+    global _status_executor, _status_workers
+    with _executor_lock:
+        if _status_executor is None or count > _status_workers:
+            old = _status_executor
+            _status_workers = max(STATUS_MIN_WORKERS, count)
+            _status_executor = ThreadPoolExecutor(max_workers=_status_workers, thread_name_prefix="EncStatus")
+            if old is not None:
+                old.shutdown(wait=False)
+        return _status_executor
+
 class EncoderStatusManager:
     def __init__(self, cooldown_ms: int = 800, log_every_s: int = 10):
         self.encoder_last_state = {}     # {name: raw_response}
         self._last_query_ts = {}         # {name: epoch_ms}
         self._last_log_ts = {}           # {name: epoch_s}
-        self._last_good_parsed = {}      # {name: (text, color)}
+        self._name_locks = {}            # {name: Lock}，同一台同時只查一次
+        self._locks_guard = threading.Lock()
+        self._inflight = {}              # {name: Future}；上一輪逾時還沒回來的查詢，不重複排隊
+        self._started_at = {}            # {name: monotonic}；該台這次查詢排到連線、真正送出的時間
         self._cooldown_ms = cooldown_ms
         self._log_every_s = log_every_s
 
     def _parse(self, res: str):
         """把回應字串轉成 (text, color)，永遠保底回傳 tuple"""
-        if not isinstance(res, str):
+        if not isinstance(res, str) or not res.strip():
             return "❌ 無回應", "red"
+        if res.startswith("❌"):
+            return "❌ 無法連線", "red"
 
         # 正規化：去控制字元、trim、轉小寫
         r = re.sub(r'[\x00-\x1f]+', ' ', res).strip().lower()
@@ -40,71 +67,114 @@ class EncoderStatusManager:
         now_s = int(time.time())
         last = self._last_log_ts.get(name, 0)
         if changed or (now_s - last) >= self._log_every_s:
-            log(f"⬅️ EncStatus {name}: {res}")
+            # 狀態有變才用 INFO；定期重複的回應只在 DEBUG 看得到
+            log("⬅️ EncStatus %s: %s", name, res, level="INFO" if changed else "DEBUG", encoder=name, command="EncStatus")
             self._last_log_ts[name] = now_s
 
-    def get_status(self, encoder_name: str):
+    def _name_lock(self, name: str) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._name_locks.get(name)
+            if lock is None:
+                lock = self._name_locks[name] = threading.Lock()
+            return lock
+
+    def get_status(self, encoder_name: str, on_start=None):
         """
         回傳單一 encoder 狀態 (status_text, color)
         - 800ms 內重複查詢直接回快取，避免頻繁阻塞 I/O
-        - 真查詢時使用持久連線，降低卡頓
+        - 多個執行緒同時查同一台時只會送出一次，其餘等結果後讀快取
+        - 回覆由 EncoderClient 保證與請求一一對應，不需再回退舊結果
+        """
+        with self._name_lock(encoder_name):
+            now_ms = int(time.time() * 1000)
+            last_ms = self._last_query_ts.get(encoder_name, 0)
+
+            # 冷卻時間內直接回快取（仍保證有值）
+            if (now_ms - last_ms) < self._cooldown_ms and encoder_name in self.encoder_last_state:
+                return self._parse(self.encoder_last_state[encoder_name])
+
+            # 真正查一次（共用連線）
+            try:
+                res = send_persistent_command(f'EncStatus "{encoder_name}"', encoder_name=encoder_name,
+                                              on_start=on_start)
+            except Exception as e:
+                res = str(e)
+            changed = (self.encoder_last_state.get(encoder_name) != res)
+
+            self._last_query_ts[encoder_name] = int(time.time() * 1000)
+            self.encoder_last_state[encoder_name] = res
+            self._maybe_log(encoder_name, res, changed)
+            return self._parse(res)
+
+    def queue_depth(self, encoder_name: str) -> int:
+        """該 encoder 所在連線目前排隊中的指令數（含執行中）。"""
+        from encoder_client import get_encoder_client
+        return get_encoder_client().queue_depth(encoder_name)
+
+    def _timed_status(self, name: str):
+        def started():
+            self._started_at[name] = time.monotonic()
+        return self.get_status(name, on_start=started)
+
+    def refresh_all(self, encoder_names, on_result=None, deadline_s: float = STATUS_DEADLINE_S):
+        """
+        並行查詢所有 encoder，回傳 {encoder_name: (status_text, color)}
+        - 每台從排到連線、真正送出查詢起算 deadline_s：同一台主機的多個頻道在共用連線上排隊時不算時間，
+          不會有 encoder 還沒查就被判逾時（排隊本身受前面指令各自的逾時限制）；pool 依台數加大
+        - 上一輪逾時、還卡在連線上的那台不再重送，直接接著等同一個查詢
+        - on_result(name, state)：每台一回來就呼叫（逾時的也會以「逾時」回報）
         """
-        now_ms = int(time.time() * 1000)
-        last_ms = self._last_query_ts.get(encoder_name, 0)
-
-        # 冷卻時間內直接回快取（仍保證有值）
-        if (now_ms - last_ms) < self._cooldown_ms and encoder_name in self.encoder_last_state:
-            cached = self.encoder_last_state[encoder_name]
-            return self._parse(cached)
-
-        # 真正查一次（持久連線）
-        try:
-            res = send_persistent_command(f'EncStatus "{encoder_name}"', encoder_name=encoder_name)
-
-        except Exception as e:
-            res = str(e)
-        prev_raw = self.encoder_last_state.get(encoder_name)
-        changed = (prev_raw != res)
-
-        self._last_query_ts[encoder_name] = now_ms
-        self.encoder_last_state[encoder_name] = res
-        self._maybe_log(encoder_name, res, changed)
-
-        # 若 raw 沒變，直接用先前的「解析後」結果（避免重複波動）
-        if not changed and encoder_name in self._last_good_parsed:
-            return self._last_good_parsed[encoder_name]
-
-        parsed = self._parse(res)
-
-        # ❗回退策略：
-        # - 若是未知/無回應，就回退到「最後一次可用解析」
-        # - 否則更新「最後一次可用解析」
-        if parsed[0] in ("❓ 未知", "❌ 無回應"):
-            if encoder_name in self._last_good_parsed:
-                return self._last_good_parsed[encoder_name]
-            # 沒有可回退就維持未知
-            return parsed
-        else:
-            self._last_good_parsed[encoder_name] = parsed
-            return parsed
-
-        # prev = self.encoder_last_state.get(encoder_name)
-        # changed = (prev != res)
-        #  # ✏️ 更新查詢時間與狀態快取
-        # self._last_query_ts[encoder_name] = now_ms
-        # # ✅ 若沒變化，就不重新解析，直接用舊的解析結果
-        # if not changed and prev is not None:
-        #     return self._parse(prev)
-        # self.encoder_last_state[encoder_name] = res
-        # # self._last_query_ts[encoder_name] = now_ms
-        # self._maybe_log(encoder_name, res, changed)
-        # parsed = self._parse(res)
-        #     # ✅ 若回傳未知（❓），保留上一個可解析狀態（但仍更新快取）
-        # if parsed[0] == "❓ 未知" and prev is not None:
-        #     return self._parse(prev)
-
-        # return parsed
-
-    def refresh_all(self, encoder_names):
-        """回傳 {encoder_name: (status_text, color)}"""
-        return {name: self.get_status(name) for name in encoder_names}
+        names = list(dict.fromkeys(n for n in encoder_names if n and isinstance(n, str)))
+        executor = _executor_for(len(names))
+        submitted_at = time.monotonic()
+        pending = {}
+        for name in names:
+            fut = self._inflight.get(name)
+            if fut is None or fut.done():
+                self._started_at.pop(name, None)
+                fut = self._inflight[name] = executor.submit(self._timed_status, name)
+            pending[fut] = name
+        results = {}
+
+        def _report(name, state):
+            results[name] = state
+            if on_result:
+                on_result(name, state)
+
+        while pending:
+            now = time.monotonic()
+            deadlines = {}
+            for fut, name in list(pending.items()):
+                if fut.done():
+                    deadlines[fut] = now  # 已回來，交給下面的 wait 收
+                    continue
+                started = self._started_at.get(name)
+                if started is None and fut.running():
+                    continue  # 在共用連線上排隊，還沒送出
+                deadline = (started if started is not None else submitted_at) + deadline_s
+                if now < deadline:
+                    deadlines[fut] = deadline
+                    continue
+                del pending[fut]
+                if started is None and fut.cancel():
+                    # ⛑️ 排不到執行緒、根本還沒開始：取消，下一輪重新送
+                    self._inflight.pop(name, None)
+                    log(f"⚠️ EncStatus {name} 等待查詢超過 {deadline_s:.1f}s，已取消", level="WARNING")
+                else:
+                    log(f"⚠️ EncStatus {name} 超過 {deadline_s:.1f}s 未回應", level="WARNING")
+                _report(name, ("❌ 逾時", "red"))
+            if not pending:
+                break
+            next_deadline = min(deadlines.values(), default=now + deadline_s)  # 全部在排隊：過一陣子再看
+            done, _ = wait(pending, timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = pending.pop(fut)
+                if self._inflight.get(name) is fut:
+                    del self._inflight[name]
+                try:
+                    state = fut.result()
+                except Exception as e:
+                    log(f"❌ get_status({name}) 發生例外：{e}")
+                    state = ("❌ 無法連線", "red")
+                _report(name, state)
+        return results
@@ -0,0 +1,195 @@
+# encoder_status_service.py
+import bisect
+import time
+from PySide6.QtCore import QDateTime, QObject, QRunnable, QThreadPool, QTimer, Signal
+from shiboken6 import isValid
+from encoder_status_manager import EncoderStatusManager
+from utils import log, block_time_range
+
+POLL_INTERVAL_MS = 2000        # 錄影中或一小時內有排程
+FAST_POLL_MS = 500             # 開始/結束前後 TRANSITION_WINDOW_S 內
+IDLE_POLL_MS = 30000           # 一小時內沒有任何排程
+TICK_MS = 500                  # 排程器本身的節拍（只決定「誰到期」，不做 I/O）
+TRANSITION_WINDOW_S = 30
+LOOKAHEAD_S = 3600
+SCHEDULE_REFRESH_S = 15        # 沒收到通知時，多久重新整理一次排程時間點
+
+
+class _PollWorkerSignals(QObject):
+    result = Signal(str, object)  # 每台回來就發：name, (text, color)
+    done = Signal()               # 這一批結束
+
+
+class _PollWorker(QRunnable):
+    def __init__(self, names, status_manager):
+        super().__init__()
+        self.names = names
+        self.status_manager = status_manager
+        self.signals = _PollWorkerSignals()
+
+    def _emit(self, signal_name: str, *args):
+        try:
+            if self.signals and isValid(self.signals):
+                getattr(self.signals, signal_name).emit(*args)
+        except RuntimeError:
+            pass
+
+    def run(self):
+        try:
+            self.status_manager.refresh_all(
+                self.names,
+                on_result=lambda name, state: self._emit("result", name, state),
+            )
+        except Exception as e:
+            log(f"❌ _PollWorker.run() 整體執行失敗：{e}", level="ERROR")
+        finally:
+            self._emit("done")
+
+
+class EncoderStatusService(QObject):
+    """
+    全程式唯一的 encoder 狀態來源：
+    - 只有這裡會定時查 EncStatus，快取也只有這一份
+    - 狀態有變化才發 statusChanged(name, (text, color))
+    - 左側面板、時間表標題、ScheduleRunner 的按鈕狀態都訂閱這個 signal
+    - 每台的輪詢頻率依排程調整：開始/結束前後加速，整小時沒排程就放慢
+    """
+    statusChanged = Signal(str, object)  # name, (status_text, color)
+
+    def __init__(self, encoder_names=None, interval_ms: int = POLL_INTERVAL_MS, parent=None):
+        super().__init__(parent)
+        self.encoder_names = list(encoder_names or [])
+        self.status_manager = EncoderStatusManager(cooldown_ms=400)  # 低於 FAST_POLL_MS，快速輪詢才不會一直拿到快取
+        self._states = {}            # {name: (text, color)}
+        self._pool = QThreadPool.globalInstance()
+        self._workers = set()        # ✅ 持有 worker，避免 signals 被 GC；可同時有多批在跑
+        self._in_flight = set()      # 查詢中還沒回來的 encoder；只有這幾台不重送，其他台照各自頻率查
+        self._is_closing = False
+        self._interval_ms = interval_ms
+        self._next_due = {}          # {name: monotonic 秒}
+        self._schedule_source = None # callable ➜ block_data（list of dict）
+        self._transitions = {}       # {name: 排序後的開始/結束時間點（epoch 秒）}
+        self._windows = {}           # {name: [(start_ts, end_ts)]}
+        self._schedule_built_at = None
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._tick)
+        self.timer.start(TICK_MS)
+        QTimer.singleShot(0, self.request_refresh)
+
+    def set_encoder_names(self, names):
+        self.encoder_names = list(names or [])
+        for name in list(self._states):
+            if name not in self.encoder_names:
+                self._states.pop(name, None)
+        self._schedule_built_at = None
+        self.request_refresh()
+
+    def set_schedule_source(self, getter):
+        """getter() 回傳目前的 block_data；用來決定每台的輪詢頻率。"""
+        self._schedule_source = getter
+        self.notify_schedule_changed()
+
+    def notify_schedule_changed(self):
+        """排程有增刪改時呼叫；下一個 tick 重新整理時間點。"""
+        self._schedule_built_at = None
+
+    def _rebuild_schedule(self):
+        self._schedule_built_at = time.monotonic()
+        self._transitions = {}
+        self._windows = {}
+        if not self._schedule_source:
+            return
+        now_ts = QDateTime.currentDateTime().toSecsSinceEpoch()
+        names = self.encoder_names
+        for b in list(self._schedule_source() or []):
+            try:
+                name = b.get("encoder_name")
+                if not name:
+                    idx = b.get("track_index")
+                    name = names[idx] if isinstance(idx, int) and 0 <= idx < len(names) else None
+                if not name:
+                    continue
+                start_ts, end_ts = block_time_range(b)
+            except Exception:
+                continue
+            if end_ts < now_ts - TRANSITION_WINDOW_S:
+                continue  # 已經結束的不影響輪詢
+            self._transitions.setdefault(name, []).extend((start_ts, end_ts))
+            self._windows.setdefault(name, []).append((start_ts, end_ts))
+        for ts in self._transitions.values():
+            ts.sort()
+
+    def interval_for(self, name: str, now_ts: int | None = None) -> int:
+        """依排程回傳該台目前應有的輪詢間隔（毫秒）。"""
+        if self._schedule_source is None:
+            return self._interval_ms
+        if now_ts is None:
+            now_ts = QDateTime.currentDateTime().toSecsSinceEpoch()
+
+        ts = self._transitions.get(name, [])
+        i = bisect.bisect_left(ts, now_ts - TRANSITION_WINDOW_S)
+        if i < len(ts) and ts[i] <= now_ts + TRANSITION_WINDOW_S:
+            return FAST_POLL_MS
+        if any(s <= now_ts < e for s, e in self._windows.get(name, [])):
+            return self._interval_ms
+        state = self._states.get(name)
+        if state and "錄影中" in state[0]:
+            return self._interval_ms   # 手動錄影：沒有排程也維持一般頻率
+        if i < len(ts) and ts[i] <= now_ts + LOOKAHEAD_S:
+            return self._interval_ms
+        return IDLE_POLL_MS
+
+    def _tick(self):
+        if self._is_closing or not self.encoder_names:
+            return
+        mono = time.monotonic()
+        if self._schedule_built_at is None or mono - self._schedule_built_at >= SCHEDULE_REFRESH_S:
+            self._rebuild_schedule()
+        # ✅ 每台各自判斷：某台卡住只略過那一台，轉場中的其他台仍照 FAST_POLL_MS 查
+        due = [n for n in self.encoder_names if n not in self._in_flight and self._next_due.get(n, 0.0) <= mono]
+        if due:
+            self._start_worker(due)
+
+    def state(self, name: str):
+        """回傳快取中的 (text, color)；還沒查過就回 None。"""
+        return self._states.get(name)
+
+    def states(self) -> dict:
+        return dict(self._states)
+
+    def replay(self):
+        """重新發送所有已知狀態（給剛重建的 UI 元件用）。"""
+        for name, state in list(self._states.items()):
+            self.statusChanged.emit(name, state)
+
+    def request_refresh(self):
+        """立即重查所有 encoder（例如手動啟動/停止之後）。"""
+        self._next_due.clear()
+        self._tick()
+
+    def _start_worker(self, names):
+        worker = _PollWorker(list(names), self.status_manager)
+        self._workers.add(worker)
+        self._in_flight.update(worker.names)
+        worker.signals.result.connect(self._on_result)
+        worker.signals.done.connect(lambda w=worker: self._on_done(w))
+        self._pool.start(worker)
+
+    def _on_result(self, name: str, state):
+        self._in_flight.discard(name)
+        if self._is_closing or name not in self.encoder_names:
+            return
+        changed = self._states.get(name) != state
+        self._states[name] = state
+        self._next_due[name] = time.monotonic() + self.interval_for(name) / 1000
+        if changed:
+            self.statusChanged.emit(name, state)
+
+    def _on_done(self, worker):
+        self._workers.discard(worker)
+        self._in_flight.difference_update(worker.names)  # ⛑️ 例外中斷、沒回報的那幾台也放行
+
+    def stop(self):
+        self._is_closing = True
+        self.timer.stop()
@@ -2,11 +2,24 @@
 import socket
 import json
 import os
+import time
+import weakref
 
 from utils import resource_path, log
-import threading
-_persistent_socks: dict[str, socket.socket] = {}
-_sock_lock = threading.Lock()
+
+# ➤ 回應框架：依指令決定回覆有幾行，收滿（CRLF / LF 結尾）就完整，不必等逾時
+RESPONSE_TIMEOUT_S = 2.0     # 整體上限（舊版固定等滿這麼久）
+RESPONSE_GRACE_S = 0.15      # 行數不固定的指令：收到整行後這麼久沒有新資料就視為完整
+REPLY_LINES = {              # {指令（小寫）: 回覆行數}；不在表裡的視為行數不固定
+    "encstatus": 1,          # OK: Bak4-1:Runned
+    "setfile": 1,
+    "start": 1,
+    "stop": 1,
+    "snapshot": 1,
+    "setsnapshotfilename": 1,
+}
+_recv_buffers: "weakref.WeakKeyDictionary[socket.socket, bytes]" = weakref.WeakKeyDictionary()
+last_latency_ms: dict[str, float] = {}   # {指令名稱: 最近一次往返毫秒數}
 
 ENCODER_CONFIG_PATH = "encoders.json"
 
@@ -59,102 +72,108 @@ def connect_socket(encoder_name):
         log(f"❌ {encoder_name} 連線失敗: {e}")
         return None
 
+def reply_lines(cmd: str):
+    """指令的回覆行數；行數不固定回 None。"""
+    return REPLY_LINES.get(cmd.split(" ", 1)[0].lower())
+
+
+def _split_reply(buf: bytes, lines=None):
+    """
+    從 buffer 切出一個完整回覆（lines 行，每行以 CRLF / LF 結尾；前一個回覆留下的空白行先略過）。
+    回傳 (reply, rest)：reply 為 None 代表還不完整，rest 是去掉前導空白後剩下的資料。
+    lines=None（行數不固定）永遠回 None，完整與否由呼叫端以 _line_complete + 安靜時間判斷。
+    """
+    body = buf.lstrip(b" \t\r\n")
+    if not body or not lines:
+        return None, body
+    end = 0
+    for _ in range(lines):
+        nl = body.find(b"\n", end)
+        if nl == -1:
+            return None, body
+        end = nl + 1
+    return body[:end].rstrip(b"\r\n"), body[end:]
+
+
+def _line_complete(body: bytes) -> bool:
+    """已收到的資料是否以整行結束（行數不固定的回覆，之後安靜 RESPONSE_GRACE_S 就算完整）"""
+    return body.endswith(b"\n")
+
+
+def _read_reply(sock, timeout: float = RESPONSE_TIMEOUT_S, lines=None) -> str:
+    """
+    讀一個完整回覆就返回，不再等 recv timeout。
+    - lines：回覆行數（見 REPLY_LINES）；收滿就返回，多收到的資料留在 _recv_buffers 給下一次回覆
+    - 行數不固定：收到整行後 RESPONSE_GRACE_S 沒新資料就返回
+    """
+    buf = _recv_buffers.pop(sock, b"")
+    deadline = time.monotonic() + timeout
+    while True:
+        reply, rest = _split_reply(buf, lines)
+        if reply is not None:
+            if rest:
+                _recv_buffers[sock] = rest
+            return reply.decode("utf-8", errors="replace")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        quiet = not lines and _line_complete(rest)
+        sock.settimeout(min(remaining, RESPONSE_GRACE_S) if quiet else remaining)
+        try:
+            chunk = sock.recv(4096)
+        except socket.timeout:
+            if quiet:
+                break
+            continue
+        if not chunk:
+            break
+        buf = rest + chunk
+
+    return buf.strip().decode("utf-8", errors="replace")
+
+
 # ➤ 傳送命令並接收回應
-def send_command(sock, cmd):
+def send_command(sock, cmd, timeout: float = RESPONSE_TIMEOUT_S):
+    verb = cmd.split(" ", 1)[0]
+    t0 = time.perf_counter()
     try:
         encoded = (cmd + "\r\n").encode("utf-8")
         sock.sendall(encoded)
-        sock.settimeout(2)
-        data = b""
-        while True:
-            try:
-                chunk = sock.recv(1024)
-                if not chunk:
-                    break
-                data += chunk
-            except socket.timeout:
-                break
-        response = data.decode("utf-8", errors="replace")
-        log(f"⬅️ Response:\n {response}")
+        response = _read_reply(sock, timeout, reply_lines(cmd))
+        latency_ms = (time.perf_counter() - t0) * 1000
+        last_latency_ms[verb] = latency_ms
+        log("⬅️ Response (%s %.1f ms):\n %s", verb, latency_ms, response, level="DEBUG",
+            command=verb, latency_ms=round(latency_ms, 1))
         return response.strip()
     except Exception as e:
         log(f"❌ 指令傳送失敗: {e}")
         return ""
 
-# ➤ 發送一次性命令（自動連線 ➜ 發送 ➜ 關閉）
-def send_encoder_command(encoder_name, cmd):
-    sock = connect_socket(encoder_name)
-    if not sock:
-        return "❌ 無法連線"
-    response = send_command(sock, cmd)
-    sock.close()
-    return response
-def _get_persistent_sock(encoder_name: str):
-    """取得某台 encoder 的持久連線；若沒有就建立並快取。"""
-    if not encoder_name:
-        # 仍保留相容行為：未指定就拿設定檔中的第一台
-        encoder_name = next(iter(encoder_config), None)
-    if not encoder_name:
-        return None
-
-    with _sock_lock:
-        s = _persistent_socks.get(encoder_name)
-        if s is None:
-            s = connect_socket(encoder_name)
-            if s:
-                # 可選：開啟 TCP keepalive（不同 OS 可再細調）
-                try:
-                    s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                except Exception:
-                    pass
-                _persistent_socks[encoder_name] = s
-        return s
+# ➤ 發送命令（同一台主機共用一條連線，見 encoder_client.EncoderClient）
+def send_encoder_command(encoder_name, cmd, on_start=None):
+    from encoder_client import get_encoder_client
+    return get_encoder_client().send_sync(encoder_name, cmd, on_start=on_start)
 
 def close_socket(encoder_name: str | None = None):
-    """關閉單台或全部 encoder 的持久連線。"""
-    with _sock_lock:
-        if encoder_name:
-            s = _persistent_socks.pop(encoder_name, None)
-            if s:
-                try: s.close()
-                except Exception: pass
-        else:
-            # 關掉所有
-            for name, s in list(_persistent_socks.items()):
-                try: s.close()
-                except Exception: pass
-                _persistent_socks.pop(name, None)
-
-def send_persistent_command(cmd: str, encoder_name: str | None = None) -> str:
+    """關閉單台（所在主機）或全部 encoder 的連線。"""
+    from encoder_client import get_encoder_client
+    get_encoder_client().close(encoder_name)
+
+def send_persistent_command(cmd: str, encoder_name: str | None = None, on_start=None) -> str:
     """
-    用『該台』encoder 的持久 socket 送指令。
-    - 第一次會建立連線並快取
-    - 送失敗會針對『該台』重連一次
+    用 encoder 所在主機的共用連線送指令。
+    - 第一次會建立連線，之後重複使用
+    - 連線失效會自動重連並重送一次
+    - on_start()：在同主機的指令排隊輪到這個指令時呼叫（見 EncoderClient.send）
     """
     target = encoder_name if encoder_name else next(iter(encoder_config), None)
     if not target:
         return "❌ 無可用的 encoder"
-
-    # 第一次（或已存在）的連線
-    sock = _get_persistent_sock(target)
-    if not sock:
+    response = send_encoder_command(target, cmd, on_start=on_start)
+    if response == "❌ 無法連線":
         return f"❌ {target} 無法連線"
-
-    try:
-        return send_command(sock, cmd)
-       
-    except Exception as e:
-        log(f"⚠️ {target} 可能連線失效，嘗試重連：{e}")
-        # 關閉該台，重建連線再送一次
-        close_socket(target)
-        sock = _get_persistent_sock(target)
-        if not sock:
-            return f"❌ {target} 無法重新建立連線"
-        try:
-            return send_command(sock, cmd)
-        except Exception as e2:
-            log(f"❌ {target} 重新送指令仍失敗：{e2}")
-            return f"❌ 指令送出失敗：{e2}"
+    return response
 # ➤ 結束連線：關閉持久 socket
 # def close_socket():
 #     global persistent_sock
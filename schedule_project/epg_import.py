@@ -0,0 +1,212 @@
+# epg_import.py
+"""
+每日節目表（CSV / XMLTV）批次匯入：
+- 頻道對應到 encoders.json 的 encoder：比對 encoder 名稱、display_name，
+  以及 encoder 設定裡選填的 "epg_channels": ["頻道 id 或名稱", ...]
+- 每筆轉成 block 後，用 NumPy 一次檢查「與現有節目」與「同一批彼此」是否重疊
+- 回傳報告；沒衝突的那一批由呼叫端一次寫入
+
+CSV 欄位（第一列為標題，不分大小寫）：
+  channel（或 encoder）、title（或 label）、
+  start：「yyyy-MM-dd HH:MM」，或 date 欄 + start「HH:MM」
+  end：同 start 格式（跨午夜可只寫 HH:MM），或 duration（分鐘）
+"""
+import csv
+import uuid
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+import numpy as np
+from PySide6.QtCore import QDate
+from utils import log, block_time_range
+
+_TRACK_SPAN = 1 << 40   # 每條軌道的時間平移量（遠大於 epoch 秒）：所有軌道放進同一組陣列也不會互相重疊
+_CSV_TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y/%m/%d %H:%M:%S", "%Y/%m/%d %H:%M")
+
+
+def _norm(name):
+    return str(name or "").strip().casefold()
+
+
+def build_channel_map(encoder_config):
+    """encoders.json 內容 ➜ {正規化頻道名: encoder_name}。"""
+    mapping = {}
+    for name, info in encoder_config.items():
+        info = info or {}
+        for key in [name, info.get("display_name")] + list(info.get("epg_channels") or []):
+            if key:
+                mapping.setdefault(_norm(key), name)
+    return mapping
+
+
+# --- 讀檔：每列 ➜ {"channel", "title", "start": datetime, "end": datetime, "line"} ---
+def _parse_csv_time(text, date_text=None):
+    text = (text or "").strip()
+    if date_text and len(text) <= 8:  # 只有時間
+        text = f"{date_text.strip()} {text}"
+    for fmt in _CSV_TIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"無法解析的時間：{text}")
+
+
+def read_csv(path):
+    rows, invalid = [], []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [_norm(h) for h in reader.fieldnames or []]
+        for line, rec in enumerate(reader, start=2):
+            try:
+                date_text = rec.get("date")
+                start = _parse_csv_time(rec.get("start"), date_text)
+                if rec.get("end"):
+                    end = _parse_csv_time(rec["end"], start.strftime("%Y-%m-%d"))
+                    if end <= start:
+                        end += timedelta(days=1)  # 只寫 HH:MM 的跨午夜節目
+                else:
+                    end = start + timedelta(minutes=float(rec["duration"]))
+                rows.append({
+                    "channel": rec.get("channel") or rec.get("encoder"),
+                    "title": rec.get("title") or rec.get("label") or "節目",
+                    "start": start, "end": end, "line": line,
+                })
+            except (KeyError, TypeError, ValueError) as e:
+                invalid.append({"line": line, "reason": str(e) or "缺少欄位"})
+    return rows, invalid
+
+
+def _parse_xmltv_time(text):
+    """XMLTV 時間「20250101060000 +0800」➜ 本機時間（不含時區）；沒有時區就當本機時間。"""
+    text = (text or "").strip()
+    if " " in text:
+        return datetime.strptime(text, "%Y%m%d%H%M%S %z").astimezone().replace(tzinfo=None)
+    return datetime.strptime(text[:14], "%Y%m%d%H%M%S")
+
+
+def read_xmltv(path):
+    rows, invalid = [], []
+    aliases = {}   # {channel id: [display-name]}；對應 encoder 時兩者都試
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "channel":
+            aliases[elem.get("id")] = [d.text for d in elem.findall("display-name") if d.text]
+            elem.clear()
+        elif elem.tag == "programme":
+            channel = elem.get("channel")
+            try:
+                start = _parse_xmltv_time(elem.get("start"))
+                end = _parse_xmltv_time(elem.get("stop"))
+                rows.append({
+                    "channel": channel, "aliases": aliases.get(channel, []),
+                    "title": (elem.findtext("title") or "節目").strip(),
+                    "start": start, "end": end, "line": len(rows) + len(invalid) + 1,
+                })
+            except (TypeError, ValueError) as e:
+                invalid.append({"line": len(rows) + len(invalid) + 1, "reason": f"{channel}：{e}"})
+            elem.clear()  # ✅ 大檔也只佔一筆節目的記憶體
+    return rows, invalid
+
+
+def read_epg(path):
+    return read_xmltv(path) if path.lower().endswith(".xml") else read_csv(path)
+
+
+# --- 轉成 block + 衝突檢查 ---
+def _make_block(row, encoder_name, track_index):
+    start, end = row["start"], row["end"]
+    qdate = QDate(start.year, start.month, start.day)
+    start_hour = round(start.hour + start.minute / 60, 4)
+    duration = round((end - start).total_seconds() / 3600, 4)
+    end_hour = round(start_hour + duration, 4)
+    # 與 ScheduleView.add_time_block 相同的欄位
+    return {
+        "qdate": qdate,
+        "track_index": track_index,
+        "start_hour": start_hour,
+        "duration": duration,
+        "end_hour": end_hour,
+        "end_qdate": qdate.addDays(1) if end_hour >= 24 else qdate,
+        "label": row["title"],
+        "encoder_name": encoder_name,
+        "id": str(uuid.uuid4()),
+        "snapshot_path": "",
+    }
+
+
+def _overlaps_sorted(starts, ends, q_starts, q_ends):
+    """
+    starts 已排序；回傳 bool 陣列：每個 [q_start, q_end) 是否與任一 [start, end) 重疊。
+    開始時間早於 q_end 的區間是 starts[:hi]；其中最晚的結束時間（前綴最大值）> q_start 就是重疊。
+    """
+    if len(starts) == 0:
+        return np.zeros(len(q_starts), dtype=bool)
+    prefix_max_end = np.maximum.accumulate(ends)
+    hi = np.searchsorted(starts, q_ends, side="left")
+    return (hi > 0) & (prefix_max_end[np.maximum(hi - 1, 0)] > q_starts)
+
+
+def _overlaps_within(starts, ends):
+    """同一組區間彼此之間：每個區間是否與其他任一區間重疊（兩邊都標記）。"""
+    n = len(starts)
+    if n < 2:
+        return np.zeros(n, dtype=bool)
+    order = np.argsort(starts, kind="stable")
+    s, e = starts[order], ends[order]
+    prev_max_end = np.concatenate(([np.iinfo(np.int64).min], np.maximum.accumulate(e)[:-1]))
+    next_start = np.concatenate((s[1:], [np.iinfo(np.int64).max]))
+    clash = np.empty(n, dtype=bool)
+    clash[order] = (prev_max_end > s) | (next_start < e)
+    return clash
+
+
+def plan_import(rows, channel_map, encoder_names, existing, find_overlaps=None):
+    """
+    rows：read_epg() 的結果；existing：[(track_index, start_ts, end_ts)] 現有節目（不必排序）
+    find_overlaps(track, start_ts, end_ts) ➜ [block]：只用來替「有衝突」的那幾筆找出是跟誰衝突
+    回傳 {"blocks": 可匯入的 block, "conflicts", "duplicates", "unmapped"}
+    """
+    blocks, sources, unmapped = [], [], []
+    for row in rows:
+        name = None
+        for key in [row.get("channel")] + list(row.get("aliases") or []):
+            name = channel_map.get(_norm(key))
+            if name:
+                break
+        if name not in encoder_names:
+            unmapped.append({"line": row["line"], "channel": row.get("channel"), "title": row["title"]})
+            continue
+        if row["end"] <= row["start"]:
+            unmapped.append({"line": row["line"], "channel": row.get("channel"), "title": row["title"],
+                             "reason": "結束時間不晚於開始時間"})
+            continue
+        blocks.append(_make_block(row, name, encoder_names.index(name)))
+        sources.append(row)
+
+    # ➤ 所有軌道放進同一組陣列：時間加上 track * _TRACK_SPAN，不同軌道自然不會重疊
+    times = np.array([block_time_range(b) for b in blocks], dtype=np.int64).reshape(-1, 2)
+    tracks = np.array([b["track_index"] for b in blocks], dtype=np.int64) * _TRACK_SPAN
+    new_s, new_e = times[:, 0] + tracks, times[:, 1] + tracks
+
+    ex = np.array(existing, dtype=np.int64).reshape(-1, 3)
+    ex_s, ex_e = ex[:, 1] + ex[:, 0] * _TRACK_SPAN, ex[:, 2] + ex[:, 0] * _TRACK_SPAN
+    order = np.argsort(ex_s, kind="stable")
+    hit_existing = _overlaps_sorted(ex_s[order], ex_e[order], new_s, new_e)
+    hit_batch = _overlaps_within(new_s, new_e)
+
+    accepted, conflicts, duplicates = [], [], []
+    for i in np.flatnonzero(~(hit_existing | hit_batch)):
+        accepted.append(blocks[i])
+    for i in np.flatnonzero(hit_existing | hit_batch):
+        b, row = blocks[i], sources[i]
+        start_ts, end_ts = int(times[i, 0]), int(times[i, 1])
+        others = find_overlaps(b["track_index"], start_ts, end_ts) \
+            if find_overlaps is not None and hit_existing[i] else []
+        entry = {"line": row["line"], "encoder_name": b["encoder_name"], "title": b["label"],
+                 "start": row["start"].strftime("%Y-%m-%d %H:%M"),
+                 "with": [o.get("label") for o in others], "in_batch": bool(hit_batch[i])}
+        # 同軌同時間同名稱：重複匯入同一份節目表，不算衝突
+        same = [o for o in others if o.get("label") == b["label"] and block_time_range(o) == (start_ts, end_ts)]
+        (duplicates if same and len(others) == 1 and not hit_batch[i] else conflicts).append(entry)
+    log(f"📥 EPG 比對：{len(rows)} 筆 ➜ 可匯入 {len(accepted)}、衝突 {len(conflicts)}、"
+        f"重複 {len(duplicates)}、無對應頻道 {len(unmapped)}")
+    return {"blocks": accepted, "conflicts": conflicts, "duplicates": duplicates, "unmapped": unmapped}
@@ -1,6 +1,9 @@
-from PySide6.QtWidgets import QGraphicsView, QGraphicsScene
+from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsItem
 from PySide6.QtCore import Qt, QDate
-from PySide6.QtGui import QFont
+from PySide6.QtGui import QFont, QTransform
+from utils import hour_label_step
+
+HOUR_LABEL_MIN_PX = 18   # 小時標籤至少相隔幾像素；更密就改成每 N 小時一個
 
 class HeaderView(QGraphicsView):
     def __init__(self, encoder_names, hour_width=20, days=7):
@@ -11,6 +14,9 @@ class HeaderView(QGraphicsView):
         self.hour_width = hour_width
         self.days = days
         self.day_width = 24 * hour_width
+        self.zoom_scale = 1.0        # 與 ScheduleView 相同的水平縮放倍率
+        self._date_labels = []       # [(x, item)]
+        self._hour_labels = []       # [(hour, x, item)]
         self.setFixedHeight(80)  # header 高度拉高顯示日期
         self.setSceneRect(-120, 0, self.days * self.day_width + 150, 110)  # sceneRect 對應拉高
 
@@ -21,20 +27,45 @@ class HeaderView(QGraphicsView):
 
     def draw_header(self):
         self.scene.clear()
+        self._date_labels = []
+        self._hour_labels = []
         for day in range(self.days):
             x = day * self.day_width
 
             # 日期列（上方）
             date_label = self.scene.addText(self.base_date.addDays(day).toString("MM/dd (ddd)"))
             date_label.setFont(QFont("Arial", 9, QFont.Bold))
-            date_label.setPos(x + 2, 40)  # 微調日期顯示位置
+            date_label.setFlag(QGraphicsItem.ItemIgnoresTransformations, True)
+            self._date_labels.append((x, date_label))
 
             # 小時刻度
             for hour in range(24):
                 xh = day * self.day_width + hour * self.hour_width
                 hour_label = self.scene.addText(f"{hour:02d}")
                 hour_label.setFont(QFont("Arial", 8))
-                hour_label.setPos(xh - hour_label.boundingRect().width() / 2, 25)  # 時間下移對應新高度
+                hour_label.setFlag(QGraphicsItem.ItemIgnoresTransformations, True)
+                self._hour_labels.append((hour, xh, hour_label))
+        self._layout_labels()
+
+    def _layout_labels(self):
+        """標籤不隨縮放變形：位置換算回 scene 單位，太密時只留每 N 小時。"""
+        scale = self.zoom_scale
+        self.setSceneRect(-120 / scale, 0, self.days * self.day_width + 150 / scale, 110)
+        for x, date_label in self._date_labels:
+            date_label.setPos(x + 2 / scale, 40)  # 微調日期顯示位置
+        step = hour_label_step(self.hour_width * scale, HOUR_LABEL_MIN_PX)
+        for hour, xh, hour_label in self._hour_labels:
+            hour_label.setVisible(hour % step == 0)
+            hour_label.setPos(xh - hour_label.boundingRect().width() / 2 / scale, 25)  # 時間下移對應新高度
+
+    def set_zoom(self, hour_px):
+        """與 ScheduleView.set_zoom 相同：只換 transform，不重建標籤。"""
+        scale = hour_px / self.hour_width
+        if scale <= 0 or scale == self.zoom_scale:
+            return
+        self.zoom_scale = scale
+        self.setTransform(QTransform.fromScale(scale, 1.0))
+        self._layout_labels()
 
     def set_base_date(self, qdate):
         self.base_date = qdate
@@ -0,0 +1,234 @@
+# log_view.py
+import logging
+from collections import deque
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer
+from PySide6.QtGui import QColor
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QListView, QComboBox, QLineEdit, QLabel, QAbstractItemView
+
+LOG_VIEW_CAPACITY = 100_000     # 保留幾筆 log（約數天的量）；超過就覆蓋最舊的
+FILTER_DEBOUNCE_MS = 200        # 輸入搜尋字後多久才重新篩選
+
+_LEVEL_CHOICES = [("全部", 0), ("INFO+", logging.INFO),
+                  ("WARNING+", logging.WARNING), ("ERROR", logging.ERROR)]
+_LEVEL_COLORS = {logging.DEBUG: QColor("#6a9955"), logging.WARNING: QColor("#ffcc00"),
+                 logging.ERROR: QColor("#ff5555"), logging.CRITICAL: QColor("#ff5555")}
+_DEFAULT_COLOR = QColor("#00FF00")
+
+
+class LogRingBuffer:
+    """
+    固定容量的環狀陣列：append O(1)，滿了就覆蓋最舊的一筆。
+    每筆有遞增的序號 seq；目前保留的是 [first_seq, next_seq)。
+    entry 為 (created, levelno, module, encoder, text)。
+    """
+    def __init__(self, capacity: int = LOG_VIEW_CAPACITY):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self.first_seq = 0
+        self.next_seq = 0
+
+    def __len__(self):
+        return self.next_seq - self.first_seq
+
+    def append(self, entry):
+        if len(self) >= self.capacity:
+            self.first_seq += 1
+        self._slots[self.next_seq % self.capacity] = entry
+        self.next_seq += 1
+
+    def discard_until(self, seq):
+        """丟掉 seq 之前的舊資料（槽位留給之後覆蓋）。"""
+        self.first_seq = max(self.first_seq, min(seq, self.next_seq))
+
+    def get(self, seq):
+        return self._slots[seq % self.capacity]
+
+
+class LogListModel(QAbstractListModel):
+    """
+    QListView 的資料來源：只有畫面上的列會呼叫 data()。
+    沒有篩選時列號直接換算成 seq；有篩選時只保存符合條件的 seq（不複製 log 內容）。
+    """
+    def __init__(self, buffer: LogRingBuffer, parent=None):
+        super().__init__(parent)
+        self.buffer = buffer
+        self._min_level = 0
+        self._encoder = None
+        self._needle = ""
+        self._matches = None          # deque[seq]；None＝沒有篩選
+
+    # --- 篩選 ---
+    @property
+    def filtering(self) -> bool:
+        return bool(self._min_level or self._encoder or self._needle)
+
+    def _accept(self, entry) -> bool:
+        _, levelno, _, encoder, text = entry
+        if levelno < self._min_level:
+            return False
+        if self._encoder and encoder != self._encoder and self._encoder not in text:
+            return False
+        return not self._needle or self._needle in text.lower()
+
+    def set_filter(self, min_level=0, encoder=None, needle=""):
+        self.beginResetModel()
+        self._min_level = min_level
+        self._encoder = encoder or None
+        self._needle = (needle or "").lower()
+        if self.filtering:
+            buf = self.buffer
+            self._matches = deque(
+                seq for seq in range(buf.first_seq, buf.next_seq) if self._accept(buf.get(seq))
+            )
+        else:
+            self._matches = None
+        self.endResetModel()
+
+    # --- 資料 ---
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._matches) if self._matches is not None else len(self.buffer)
+
+    def _seq_at(self, row):
+        if self._matches is not None:
+            return self._matches[row]
+        return self.buffer.first_seq + row
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self.buffer.get(self._seq_at(index.row()))
+        if role == Qt.DisplayRole:
+            return entry[4]
+        if role == Qt.ForegroundRole:
+            return _LEVEL_COLORS.get(entry[1], _DEFAULT_COLOR)
+        return None
+
+    def append_entries(self, entries):
+        """批次附加（主線程）；超過容量時先移除被覆蓋的最舊列。"""
+        if not entries:
+            return
+        buf = self.buffer
+        entries = entries[-buf.capacity:]
+        overflow = len(buf) + len(entries) - buf.capacity
+        if overflow > 0:
+            self._drop_oldest(buf.first_seq + overflow)
+
+        start_seq = buf.next_seq
+        if self._matches is None:
+            first = len(buf)
+            self.beginInsertRows(QModelIndex(), first, first + len(entries) - 1)
+            for entry in entries:
+                buf.append(entry)
+            self.endInsertRows()
+            return
+
+        for entry in entries:
+            buf.append(entry)
+        new_seqs = [start_seq + i for i, entry in enumerate(entries) if self._accept(entry)]
+        if new_seqs:
+            first = len(self._matches)
+            self.beginInsertRows(QModelIndex(), first, first + len(new_seqs) - 1)
+            self._matches.extend(new_seqs)
+            self.endInsertRows()
+
+    def _drop_oldest(self, new_first_seq):
+        buf = self.buffer
+        if self._matches is None:
+            count = new_first_seq - buf.first_seq
+        else:
+            count = 0
+            while count < len(self._matches) and self._matches[count] < new_first_seq:
+                count += 1
+        if count > 0:
+            self.beginRemoveRows(QModelIndex(), 0, count - 1)
+        if self._matches is not None:
+            for _ in range(count):
+                self._matches.popleft()
+        buf.discard_until(new_first_seq)
+        if count > 0:
+            self.endRemoveRows()
+
+
+class LogViewer(QWidget):
+    """
+    log 視窗：環狀緩衝 + QListView（只畫看得到的列），可依等級、encoder、文字篩選。
+    utils.set_log_box() 會把新 log 以 append_entries() 批次送進來。
+    """
+    def __init__(self, encoder_names=None, capacity: int = LOG_VIEW_CAPACITY, parent=None):
+        super().__init__(parent)
+        self.model = LogListModel(LogRingBuffer(capacity), self)
+
+        self.level_box = QComboBox()
+        for label, levelno in _LEVEL_CHOICES:
+            self.level_box.addItem(label, levelno)
+        self.encoder_box = QComboBox()
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("搜尋 log…")
+        self.search_edit.setClearButtonEnabled(True)
+        self.set_encoder_names(encoder_names or [])
+
+        self.list_view = QListView()
+        self.list_view.setModel(self.model)
+        self.list_view.setUniformItemSizes(True)          # ✅ 不逐列量高度，十萬列也不卡
+        self.list_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.list_view.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
+        self.list_view.setStyleSheet("""
+            QListView {
+                background-color: #111;
+                color: #00FF00;
+                font-family: Consolas, Courier, monospace;
+                font-size: 11px;
+                border: 1px solid #333;
+            }
+        """)
+
+        filter_bar = QHBoxLayout()
+        filter_bar.setContentsMargins(0, 0, 0, 0)
+        filter_bar.addWidget(QLabel("等級："))
+        filter_bar.addWidget(self.level_box)
+        filter_bar.addWidget(QLabel("Encoder："))
+        filter_bar.addWidget(self.encoder_box)
+        filter_bar.addWidget(self.search_edit, 1)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(2)
+        layout.addLayout(filter_bar)
+        layout.addWidget(self.list_view)
+
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(FILTER_DEBOUNCE_MS)
+        self._filter_timer.timeout.connect(self._apply_filter)
+        self.level_box.currentIndexChanged.connect(self._apply_filter)
+        self.encoder_box.currentIndexChanged.connect(self._apply_filter)
+        self.search_edit.textChanged.connect(self._filter_timer.start)
+
+    def set_encoder_names(self, names):
+        current = self.encoder_box.currentData()
+        self.encoder_box.blockSignals(True)
+        self.encoder_box.clear()
+        self.encoder_box.addItem("全部", None)
+        for name in names:
+            self.encoder_box.addItem(name, name)
+        idx = self.encoder_box.findData(current)
+        self.encoder_box.setCurrentIndex(idx if idx >= 0 else 0)
+        self.encoder_box.blockSignals(False)
+
+    def _apply_filter(self):
+        self.model.set_filter(
+            min_level=self.level_box.currentData() or 0,
+            encoder=self.encoder_box.currentData(),
+            needle=self.search_edit.text().strip(),
+        )
+        self.list_view.scrollToBottom()
+
+    def append_entries(self, entries):
+        # 原本就在最底下才自動捲動；往上翻看舊 log 時不打擾
+        bar = self.list_view.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum() - 2
+        self.model.append_entries(entries)
+        if at_bottom:
+            self.list_view.scrollToBottom()
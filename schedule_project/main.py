@@ -4,7 +4,7 @@ import shutil
 import traceback
 from PySide6.QtWidgets import QApplication
 from ui_main_window import MainWindow
-from utils import resource_path, log,log_exception
+from utils import resource_path, log,log_exception, reload_log_config
 
 # 🧯 全域例外處理（會寫入 error.log，避免 silent crash）
 def except_hook(exctype, value, tb):
@@ -36,6 +36,8 @@ if __name__ == "__main__":
     except Exception as e:
         log_exception(f"❌ 建立預設 config.json 失敗：{e}")
 
+    reload_log_config("config.json")  # ✅ 先套用 log 等級，啟動過程的 log 也照設定
+
     # ✅ 確保 QApplication 建立成功
     app = QApplication(sys.argv)
     win = MainWindow()
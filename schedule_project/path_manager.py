@@ -47,7 +47,7 @@ class PathManager:
             with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
                 json.dump(data, f)
         except Exception as e:
-            log("❌ 無法儲存 config:", e)
+            log("❌ 無法儲存 config: %s", e, level="ERROR")
 
     def save_record_root(self, path):
         try:
@@ -59,7 +59,7 @@ class PathManager:
             data.setdefault('preview_root', self.preview_root)
             self._save_config(data)
         except Exception as e:
-            log("❌ 無法儲存 config:", e)
+            log("❌ 無法儲存 config: %s", e, level="ERROR")
 
     def save_preview_root(self, path):
         try:
@@ -71,7 +71,7 @@ class PathManager:
             data.setdefault('record_root', self.record_root)
             self._save_config(data)
         except Exception as e:
-            log("❌ 無法儲存 config:", e)
+            log("❌ 無法儲存 config: %s", e, level="ERROR")
     def load_record_root(self):
         try:
         # 優先使用外部寫入的 config.json
@@ -114,6 +114,18 @@ class PathManager:
     def default_preview_root(self):
         return os.path.join(self.default_record_root(), "preview")
 
+    def thumb_cache_dir(self):
+        """本機縮圖快取資料夾（config.json 的 thumb_cache_dir；預設放在 config.json 旁邊）。"""
+        try:
+            if os.path.exists(CONFIG_FILE):
+                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('thumb_cache_dir'):
+                    return data['thumb_cache_dir']
+        except Exception as e:
+            log(f"❌ 無法讀取 config: {e}")
+        return os.path.join(os.path.dirname(CONFIG_FILE), "thumb_cache")
+
     @property
     def snapshot_root(self):
         return self.preview_root
@@ -0,0 +1,247 @@
+# recurrence.py
+"""
+重複排程規則：每條規則在排程檔 / 資料庫只存一筆（block 欄位 + "recurrence"），
+occurrence 只在需要的範圍（畫面前後幾週、排程器接下來的時段）才展開成 block，
+存檔大小與掃描成本不會隨系列長度增加。
+
+"recurrence": {
+    "freq": "daily" | "weekdays" | "weekly",
+    "days": [1, 3],              # weekly 用：Qt dayOfWeek，1=週一 … 7=週日
+    "until": "yyyy-MM-dd",       # 選填：最後一天（含）
+    "count": 10,                 # 選填：最多幾次（排除日也計次，與 iCalendar 相同）
+    "exdates": ["yyyy-MM-dd"]    # 這幾天不錄
+}
+規則本身的 qdate 是第一次的日期，start_hour / duration 是每次的時段。
+
+展開出來的 occurrence：id 為「規則 id@yyyy-MM-dd」，帶 rule_id 與 virtual=True（不存檔）；
+被使用者修改（拖拉、調整長度、編輯）後拿掉 virtual，當成一般 block 存檔，之後展開就略過那一天。
+開始/停止錄影只改記憶體裡的狀態，不會讓 occurrence 變成一般 block。
+展開時與同軌其他節目重疊的那一次不排程（略過並警告）。
+"""
+import uuid
+from PySide6.QtCore import QDate, QDateTime
+from utils import log, block_time_range
+
+FREQS = {"daily": "每天", "weekdays": "平日（一～五）", "weekly": "每週"}
+_FREQ_DAYS = {"daily": (1, 2, 3, 4, 5, 6, 7), "weekdays": (1, 2, 3, 4, 5)}
+WEEKDAY_NAMES = ("一", "二", "三", "四", "五", "六", "日")   # dayOfWeek 1~7
+
+
+def is_rule(b) -> bool:
+    return bool(b.get("recurrence"))
+
+
+def occurrence_id(rule_id, qdate) -> str:
+    return f"{rule_id}@{qdate.toString('yyyy-MM-dd')}"
+
+
+def normalize_recurrence(rec):
+    """檢查並整理 recurrence 欄位；不合法丟 ValueError。"""
+    if not isinstance(rec, dict):
+        raise ValueError("recurrence 必須是物件")
+    freq = rec.get("freq")
+    if freq not in FREQS:
+        raise ValueError(f"freq 須為 {' / '.join(FREQS)}")
+    try:
+        days = sorted({int(d) for d in rec.get("days") or []}) if freq == "weekly" else []
+        count = int(rec.get("count") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("days / count 必須是整數")
+    if freq == "weekly" and (not days or not all(1 <= d <= 7 for d in days)):
+        raise ValueError("weekly 需要 days（1=週一 … 7=週日）")
+    if count < 0:
+        raise ValueError("count 不能是負數")
+    out = {"freq": freq, "days": days, "exdates": sorted({str(d) for d in rec.get("exdates") or []})}
+    if rec.get("until"):
+        if not QDate.fromString(str(rec["until"]), "yyyy-MM-dd").isValid():
+            raise ValueError("until 格式須為 yyyy-MM-dd")
+        out["until"] = str(rec["until"])
+    if count:
+        out["count"] = count
+    return out
+
+
+def describe(rec) -> str:
+    """給選單 / log 看的一行說明，例如「每週一、三，到 2025-06-30」。"""
+    if rec["freq"] == "weekly":
+        text = "每週" + "、".join(WEEKDAY_NAMES[d - 1] for d in rec["days"])
+    else:
+        text = FREQS[rec["freq"]]
+    if rec.get("until"):
+        text += f"，到 {rec['until']}"
+    if rec.get("count"):
+        text += f"，共 {rec['count']} 次"
+    return text
+
+
+def rule_days(rec):
+    return _FREQ_DAYS.get(rec["freq"]) or tuple(rec.get("days") or ())
+
+
+def last_date(rule):
+    """
+    最後一次的日期；沒有 until / count 回 None（不限期）。
+    第 n 次直接算：第一週符合的日子固定，之後每 7 天重複一輪，不必從頭數。
+    """
+    rec = rule["recurrence"]
+    first = rule["qdate"]
+    last = QDate.fromString(rec["until"], "yyyy-MM-dd") if rec.get("until") else None
+    if rec.get("count"):
+        days = rule_days(rec)
+        offsets = [i for i in range(7) if first.addDays(i).dayOfWeek() in days]
+        if not offsets:
+            return first.addDays(-1)  # 沒有任何一天符合
+        n = rec["count"] - 1
+        nth = first.addDays(n // len(offsets) * 7 + offsets[n % len(offsets)])
+        if last is None or nth < last:
+            last = nth
+    return last
+
+
+def make_occurrence(rule, qdate):
+    """規則在 qdate 那天的 occurrence（欄位與 ScheduleView.add_time_block 相同）。"""
+    end_hour = round(float(rule["start_hour"]) + float(rule["duration"]), 4)
+    return {
+        "qdate": qdate,
+        "track_index": rule["track_index"],
+        "start_hour": rule["start_hour"],
+        "duration": rule["duration"],
+        "end_hour": end_hour,
+        "end_qdate": qdate.addDays(1) if end_hour >= 24 else qdate,
+        "label": rule["label"],
+        "encoder_name": rule.get("encoder_name"),
+        "id": occurrence_id(rule["id"], qdate),
+        "snapshot_path": "",
+        "status": "",
+        "rule_id": rule["id"],
+        "virtual": True,
+    }
+
+
+def expand_rule(rule, start_ts, end_ts):
+    """規則在 [start_ts, end_ts) 內（有重疊）的 occurrence；只走範圍內的那幾天。"""
+    rec = rule["recurrence"]
+    days = rule_days(rec)
+    # ➤ 跨午夜的節目：前一兩天開始的也可能落進範圍
+    span_days = int((float(rule["start_hour"]) + float(rule["duration"])) // 24) + 1
+    day = QDateTime.fromSecsSinceEpoch(start_ts).date().addDays(-span_days)
+    if day < rule["qdate"]:
+        day = rule["qdate"]
+    end_day = QDateTime.fromSecsSinceEpoch(end_ts).date()
+    last = last_date(rule)
+    if last is not None and last < end_day:
+        end_day = last
+    exdates = set(rec.get("exdates") or ())
+    found = []
+    while day <= end_day:
+        if day.dayOfWeek() in days and day.toString("yyyy-MM-dd") not in exdates:
+            occ = make_occurrence(rule, day)
+            occ_start, occ_end = block_time_range(occ)
+            if occ_start < end_ts and occ_end > start_ts:
+                found.append(occ)
+        day = day.addDays(1)
+    return found
+
+
+def exclude_occurrence(rule, occ_id):
+    """
+    刪掉某一次：那天加進 exdates，不再展開。
+    日期取自 occurrence id（不是 block 的 qdate），被拖到別天的那一次也對得上。
+    """
+    rec = rule["recurrence"]
+    text = occ_id.rsplit("@", 1)[-1]
+    if text not in rec.setdefault("exdates", []):
+        rec["exdates"] = sorted(rec["exdates"] + [text])
+
+
+def assign_rule_tracks(rules, encoder_names):
+    """依 encoder_name 設定規則的軌道；encoder 已不存在的規則回傳在 list 裡（不展開，但照樣存檔）。"""
+    missing = []
+    for rule in rules.values():
+        name = rule.get("encoder_name")
+        if name in encoder_names:
+            rule["track_index"] = encoder_names.index(name)
+        else:
+            missing.append(rule)
+    return missing
+
+
+def _clashes(index, occ):
+    start_ts, end_ts = block_time_range(occ)
+    return index.overlaps(occ["track_index"], start_ts, end_ts, exclude_id=occ["id"])
+
+
+def sync_occurrences(block_data, index, rules, ranges, encoder_names):
+    """
+    讓 block_data 裡的 virtual occurrence 剛好是 ranges 內該有的那些：
+    缺的補上、規則改過的跟著改、範圍外或被排除的移除；已另存成一般 block 的日期不動。
+    與同軌其他節目（index 裡的）重疊的那一次不展開，列在 clashes 裡。
+    index（BlockIntervalIndex）同步更新。回傳 (新的 block_data, 新增數, 移除數, clashes)。
+    """
+    missing = {id(r) for r in assign_rule_tracks(rules, encoder_names)}
+    wanted = {}
+    for rule in rules.values():
+        if id(rule) in missing:
+            continue
+        for start_ts, end_ts in ranges:
+            for occ in expand_rule(rule, start_ts, end_ts):
+                wanted[occ["id"]] = occ
+
+    kept, removed, clashes = [], 0, []
+    for b in block_data:
+        if not b.get("virtual"):
+            kept.append(b)
+            continue
+        new = wanted.pop(b["id"], None)
+        if new is not None and _clashes(index, new):
+            clashes.append(new)  # 規則改過後撞到別的節目
+            new = None
+        if new is None:
+            index.remove(b["id"])
+            removed += 1
+            continue
+        new.pop("status")  # ✅ 保留執行中的狀態文字，其餘欄位跟著規則
+        b.update(new)
+        index.upsert(b)
+        kept.append(b)
+
+    added = 0
+    for occ_id, occ in wanted.items():
+        if index.get(occ_id) is not None:
+            continue  # 那一天已另存成一般 block
+        if _clashes(index, occ):
+            clashes.append(occ)
+            continue
+        kept.append(occ)
+        index.upsert(occ)
+        added += 1
+    return kept, added, removed, clashes
+
+
+def report_clashes(clashes, reported):
+    """展開時因重疊而略過的那幾次：每一次只警告一次（reported 為已警告過的 occurrence id）。"""
+    for occ in clashes:
+        if occ["id"] in reported:
+            continue
+        reported.add(occ["id"])
+        log(f"⚠️ 重複排程「{occ['label']}」{occ['qdate'].toString('yyyy-MM-dd')} 那一次與其他節目重疊，不排程",
+            level="WARNING", encoder=occ.get("encoder_name"), block_id=occ["id"])
+
+
+def make_rule(qdate, track_index, start_hour, duration, label, encoder_name, recurrence, rule_id=None):
+    """新的重複規則（block 欄位與 ScheduleView.add_time_block 相同，另帶 recurrence）。"""
+    end_hour = round(start_hour + duration, 4)
+    return {
+        "qdate": qdate,
+        "track_index": track_index,
+        "start_hour": start_hour,
+        "duration": duration,
+        "end_hour": end_hour,
+        "end_qdate": qdate.addDays(1) if end_hour >= 24 else qdate,
+        "label": label,
+        "encoder_name": encoder_name,
+        "id": rule_id or str(uuid.uuid4()),
+        "snapshot_path": "",
+        "status": "",
+        "recurrence": normalize_recurrence(recurrence),
+    }
@@ -1,9 +1,8 @@
 # schedule_runner.py
 
 from encoder_controller import EncoderController 
-from PySide6.QtCore import QObject, QRunnable, QThreadPool, QTimer, QDateTime, QDate, QTime, Signal
-from encoder_utils import connect_socket, send_encoder_command, send_persistent_command
-from encoder_status_manager import EncoderStatusManager
+from PySide6.QtCore import QObject, QTimer, QDateTime, QDate, QTime, Signal
+from encoder_utils import send_encoder_command, send_persistent_command
 import os
 import logging
 import threading
@@ -12,37 +11,6 @@ from shiboken6 import isValid
 # from check_schedule_manager import CheckScheduleManager
 from capture import take_snapshot_from_block 
 from utils import log   
-REFRESH_INTERVAL_MS =10*1000
-class _StatusWorkerSignals(QObject):
-    done = Signal(dict)  # {name: (text, color)}
-
-class _StatusWorker(QRunnable):
-    def __init__(self, names, status_manager):
-        super().__init__()
-        self.names = names
-        self.status_manager = status_manager
-        self.signals = _StatusWorkerSignals()
-    def run(self):
-        from utils import log
-        result = {}
-        try:
-            for name in self.names:
-                if not name or not isinstance(name, str):
-                    log(f"⚠️ 無效 encoder 名稱: {name}", level="WARNING")
-                    continue
-                try:
-                    stat = self.status_manager.get_status(name)
-                    if stat:
-                        result[name] = stat
-                except Exception as e:
-                    log(f"❌ get_status({name}) 發生例外：{e}")
-                    result[name] = ("❌ 無法連線", "red")
-            # ✅ signals 還活著才 emit
-            if self.signals and isValid(self.signals):
-                self.signals.done.emit(result)
-        except Exception as e:
-            log(f"❌ _StatusWorker.run() 整體執行失敗：{e}", level="ERROR")
-        
 def safe_set_label(label, text, style):
     if not label or not isValid(label):
         return
@@ -51,7 +19,7 @@ def safe_set_label(label, text, style):
 class ScheduleRunner(QObject):
     snapshot_result = Signal(str, str)  # block_id, snapshot path
 
-    def __init__(self, schedule_data, encoder_status, record_root, encoder_names, blocks):
+    def __init__(self, schedule_data, encoder_status, record_root, encoder_names, blocks, status_service=None):
         super().__init__()
         self.schedule_data = schedule_data
         self.encoder_status = encoder_status
@@ -66,61 +34,22 @@ class ScheduleRunner(QObject):
         # self.timer.timeout.connect(self.check_schedule)
         self.timer.start(1000)  # 每秒檢查一次
         self.encoder_last_state = {}
-        self.status_timer = QTimer(self)
-        self.status_timer.timeout.connect(self._refresh_status_async)
-
-        self.status_timer.start(REFRESH_INTERVAL_MS)
 
         self.snapshot_result.connect(self._handle_snapshot_result)
-        self.encoder_status_manager = EncoderStatusManager()
-                # ✅ 自動更新 block 顯示狀態
-        self.block_status_timer = QTimer(self)
-        self.block_status_timer.timeout.connect(self._refresh_block_statuses)
-        self.block_status_timer.start(3000)  # 每秒更新一次
-        # ✅ 改為使用 thread pool 異步刷新，避免啟動時卡 UI
-        self._pool = QThreadPool.globalInstance()
-        self._status_workers = []   # ✅ 持有 worker，避免 signals 被 GC
         self._is_closing = False    # ✅ 關閉旗標
-        QTimer.singleShot(0, self._refresh_status_async)
-    def _refresh_block_statuses(self):
-        self._refresh_status_async()
-    def _refresh_status_async(self):
-        log(f"🎯 啟動 StatusWorker：{self.encoder_names}")
-        if self._is_closing or not getattr(self, "encoder_names", None):
-            return
-            # ⛑️ 若上一輪尚未回來，就先不再開新的一輪
-        if getattr(self, "_status_workers", None) and len(self._status_workers) >= 1:
+        # ✅ 狀態由 EncoderStatusService 統一輪詢，這裡只訂閱結果
+        self.status_service = status_service
+        if self.status_service is not None:
+            self.status_service.statusChanged.connect(self._on_status_changed)
+            QTimer.singleShot(0, lambda: self._apply_statuses(self.status_service.states()))
+
+    def _on_status_changed(self, name: str, state):
+        if self._is_closing:
             return
-        worker = _StatusWorker(list(self.encoder_names), self.encoder_status_manager)
-
-        # ✅ 持有，避免 signals 被回收
-        self._status_workers.append(worker)
-
-        def _on_done(result, w=worker):
-            # 視窗關閉或 runner 被收時，不再碰 UI
-            if not hasattr(self, "_is_closing") or self._is_closing:
-                pass
-            else:
-                try:
-                    self._apply_statuses(result)
-                except Exception as e:
-                    log(f"❌ _apply_statuses error: {e}")
-            # ✅ 用完釋放引用
-            try:
-                self._status_workers.remove(w)
-            except ValueError:
-                pass
-
-        worker.signals.done.connect(_on_done)
-        self._pool.start(worker)
-
-    # def _refresh_status_async(self):
-    #     log(f"🎯 啟動 StatusWorker：{self.encoder_names}")
-    #     if not getattr(self, "encoder_names", None):
-    #         return
-    #     worker = _StatusWorker(self.encoder_names, self.encoder_status_manager)
-    #     worker.signals.done.connect(self._apply_statuses)
-    #     self._pool.start(worker)
+        try:
+            self._apply_statuses({name: state})
+        except Exception as e:
+            log(f"❌ _apply_statuses error: {e}")
 
     def _set_opacity(self, widget, value: float):
         if not widget or not isValid(widget):
@@ -155,20 +84,11 @@ class ScheduleRunner(QObject):
                 continue
 
             try:
-                text, color = pair
+                text, _ = pair
             except Exception:
-                text, color = ("❓ 未知", "gray")
-
-            # label
-            label = self._get_widget(getattr(self, "encoder_status", {}), name)
-            if label:
-                try:
-                    label.setText(f"狀態：{text}")
-                    label.setStyleSheet(f"color: {color}")
-                except RuntimeError:
-                    getattr(self, "encoder_status", {}).pop(name, None)
-                    label = None
+                text, _ = ("❓ 未知", "gray")
 
+            # 狀態文字由 MainWindow 左側面板自己訂閱，這裡只管控制項
             is_running = ("錄影中" in text)
 
             # 控制項
@@ -198,11 +118,9 @@ class ScheduleRunner(QObject):
                 getattr(self, "stop_buttons", {}).pop(name, None)
 
     def refresh_encoder_statuses(self):
-        statuses = self.encoder_status_manager.refresh_all(self.encoder_names)
-        for name, (status_text, color) in statuses.items():
-            if name in self.encoder_status:
-                self.encoder_status[name].setText(f"狀態：{status_text}")
-                self.encoder_status[name].setStyleSheet(f"color: {color}")
+        """手動啟動/停止後要求立即重查；結果會經由 statusChanged 回來。"""
+        if self.status_service is not None:
+            self.status_service.request_refresh()
 
     def format_remaining_time(self, seconds):
         h = int(seconds) // 3600
@@ -218,7 +136,7 @@ class ScheduleRunner(QObject):
             block = self.find_block_by_id(block_id)
             if block and snapshot_path:
                 img_dir = os.path.dirname(snapshot_path)
-                block.load_preview_images(img_dir)
+                block.load_preview_images(img_dir, refresh=True)  # 剛拍完照，不用快取
             else:
                 log(f"⚠️ 拍照失敗或找不到 block：{block_id}")
         except Exception as e:
@@ -240,13 +158,11 @@ class ScheduleRunner(QObject):
         full_path = os.path.abspath(os.path.join(self.record_root, date_folder, f"{date_prefix}_{filename}"))
         rel_path = os.path.relpath(full_path, start=self.record_root)
 
-        sock = connect_socket(encoder_name)
-        if not sock:
-            safe_set_label(status_label, "❌ 無法連線", "color: red;")
-        else:
-            sock.close()
         res1 = send_encoder_command(encoder_name, f'Setfile "{encoder_name}" 1 "{rel_path}"')
         # res1 = send_encoder_command(encoder_name, f'Setfile "{encoder_name}" 1 {rel_path}')
+        if res1.startswith("❌"):
+            safe_set_label(status_label, "❌ 無法連線", "color: red;")
+            return
         res2 = send_encoder_command(encoder_name, f'Start "{encoder_name}" 1')
 
         if "OK" in res1 and "OK" in res2:
@@ -259,7 +175,7 @@ class ScheduleRunner(QObject):
         # ✅ 只在第一次啟動時拍照，避免 check_schedule 觸發多次
         if block_id and block_id not in self.already_started:
             self.already_started.add(block_id)
-            log(f"📸 update_all_encoder_snapshots triggered at {QDateTime.currentDateTime().toString('HH:mm:ss.zzz')}")
+            log("📸 啟動後拍照：%s", block_id, level="DEBUG", encoder=encoder_name, block_id=block_id)
             window = QApplication.instance().activeWindow()
             if window and not getattr(window, "is_closing", False) and block:
                 def worker():
@@ -386,10 +302,6 @@ class ScheduleRunner(QObject):
         self._is_closing = True   # ✅ 通知不要再啟新 worker/不要更新 UI
         if hasattr(self, "timer"):
             self.timer.stop()
-        if hasattr(self, "status_timer"):
-            self.status_timer.stop()
-        if hasattr(self, "block_status_timer"):
-            self.block_status_timer.stop()
         if hasattr(self, "runner"):
             self.runner.stop_timers()
     # def stop_timers(self):
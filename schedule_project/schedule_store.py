@@ -0,0 +1,151 @@
+# schedule_store.py
+import json
+import sqlite3
+import threading
+import uuid
+from utils import log, block_time_range
+
+_COLUMNS = (
+    "id", "track_index", "start_ts", "end_ts", "qdate", "start_hour", "duration",
+    "end_hour", "end_qdate", "label", "encoder_name", "snapshot_path", "status", "rule_id",
+)
+_JSON_KEYS = _COLUMNS[:2] + _COLUMNS[4:]   # 與 schedule.json 相同的欄位（不含 start_ts/end_ts）
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    id            TEXT PRIMARY KEY,
+    track_index   INTEGER NOT NULL,
+    start_ts      INTEGER NOT NULL,
+    end_ts        INTEGER NOT NULL,
+    qdate         TEXT NOT NULL,
+    start_hour    REAL NOT NULL,
+    duration      REAL NOT NULL,
+    end_hour      REAL,
+    end_qdate     TEXT,
+    label         TEXT,
+    encoder_name  TEXT,
+    snapshot_path TEXT,
+    status        TEXT,
+    rule_id       TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_blocks_track_start ON blocks (track_index, start_ts);
+CREATE INDEX IF NOT EXISTS idx_blocks_start ON blocks (start_ts);
+CREATE INDEX IF NOT EXISTS idx_blocks_length ON blocks ((end_ts - start_ts));
+CREATE TABLE IF NOT EXISTS rules (
+    id            TEXT PRIMARY KEY,
+    data          TEXT NOT NULL
+);
+"""
+
+
+class ScheduleStore:
+    """
+    SQLite 排程庫（選用，config.json 設定 "schedule_db" 時啟用）：
+    - 只查需要的時間範圍：畫面那幾天、排程器接下來 N 分鐘
+    - 單筆 upsert/delete，WAL 模式，讀寫互不阻塞
+    - import_json() 從既有的 schedule.json（含 journal）一次匯入
+    - 重複規則（帶 recurrence 的 block）另存在 rules 表，整筆 JSON 一列；展開由呼叫端負責
+    block 以 schedule.json 的格式（qdate 等為字串）進出。
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()   # 主線程查詢、背景寫入共用一條連線
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            columns = {r["name"] for r in self._conn.execute("PRAGMA table_info(blocks)")}
+            if "rule_id" not in columns:  # ⛑️ 舊資料庫補欄位
+                self._conn.execute("ALTER TABLE blocks ADD COLUMN rule_id TEXT")
+
+    @staticmethod
+    def _row_values(block: dict):
+        start_ts, end_ts = block_time_range(block)
+        return (
+            block["id"], int(block["track_index"]), start_ts, end_ts, block["qdate"],
+            float(block["start_hour"]), float(block["duration"]), block.get("end_hour"),
+            block.get("end_qdate"), block.get("label"), block.get("encoder_name"),
+            block.get("snapshot_path", ""), block.get("status", ""), block.get("rule_id"),
+        )
+
+    def _max_duration(self) -> int:
+        """最長節目秒數，決定範圍查詢往前看多遠。
+        每次查詢都重新讀（走 idx_blocks_length，O(log n)）：其他行程（daemon、API、EPG）寫入或刪掉長節目後也正確。"""
+        row = self._conn.execute("SELECT MAX(end_ts - start_ts) FROM blocks").fetchone()
+        return int(row[0] or 0)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM blocks) + (SELECT COUNT(*) FROM rules)"
+            ).fetchone()[0]
+
+    def apply(self, puts=(), deletes=()):
+        """一次交易內寫入多筆 upsert / delete（每筆都是單列操作；重複規則寫進 rules 表）。"""
+        rules = [(b["id"], json.dumps(b, ensure_ascii=False)) for b in puts if b.get("recurrence")]
+        rows = [self._row_values(b) for b in puts if not b.get("recurrence")]
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        updates = ", ".join(f"{c}=excluded.{c}" for c in _COLUMNS[1:])
+        with self._lock, self._conn:
+            if rows:
+                self._conn.executemany(
+                    f"INSERT INTO blocks ({', '.join(_COLUMNS)}) VALUES ({placeholders}) "
+                    f"ON CONFLICT(id) DO UPDATE SET {updates}",
+                    rows,
+                )
+            if rules:
+                self._conn.executemany(
+                    "INSERT INTO rules (id, data) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET data=excluded.data",
+                    rules,
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM blocks WHERE id = ?", [(i,) for i in deletes])
+                self._conn.executemany("DELETE FROM rules WHERE id = ?", [(i,) for i in deletes])
+
+    def query_range(self, start_ts: int, end_ts: int, track_index=None, exclude_id=None):
+        """與 [start_ts, end_ts) 重疊的 block；走 start_ts 索引。"""
+        sql = f"SELECT {', '.join(_JSON_KEYS)} FROM blocks WHERE start_ts < ? AND start_ts > ? AND end_ts > ?"
+        with self._lock:
+            args = [end_ts, start_ts - self._max_duration() - 1, start_ts]
+            if track_index is not None:
+                sql += " AND track_index = ?"
+                args.append(int(track_index))
+            if exclude_id:
+                sql += " AND id != ?"
+                args.append(exclude_id)
+            rows = self._conn.execute(sql + " ORDER BY start_ts", args).fetchall()
+        return [dict(r) for r in rows]
+
+    def overlaps(self, track_index, start_ts, end_ts, exclude_id=None):
+        return self.query_range(start_ts, end_ts, track_index=track_index, exclude_id=exclude_id)
+
+    def rules(self):
+        """所有重複規則（JSON 格式）；規則數量與系列長度無關，一次全部讀出。"""
+        with self._lock:
+            return [json.loads(r["data"]) for r in self._conn.execute("SELECT data FROM rules")]
+
+    def import_json(self, filename) -> int:
+        """把 schedule.json（含 journal）整批匯入；沒有 id 的 block 會補上。"""
+        from schedule_writer import read_schedule_file  # 避免循環 import
+        raw = read_schedule_file(filename)
+        puts = []
+        for b in raw:
+            b = dict(b) if b.get("recurrence") else {k: b.get(k) for k in _JSON_KEYS}
+            b["id"] = b["id"] or str(uuid.uuid4())
+            if b.get("end_hour") is None:
+                b["end_hour"] = float(b["start_hour"]) + float(b["duration"])
+            try:
+                self._row_values(b)
+            except Exception as e:
+                log(f"⚠️ 匯入略過無效節目（{b.get('label')}）：{e}")
+                continue
+            puts.append(b)
+        self.apply(puts=puts)
+        log(f"📥 已從 {filename} 匯入 {len(puts)} 筆節目到 {self.db_path}")
+        return len(puts)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,67 +1,99 @@
-from PySide6.QtWidgets import QGraphicsView, QGraphicsScene
-from PySide6.QtCore import Qt, QDate, QTimer,QDateTime, QTime,QObject, Signal, QRunnable, QThreadPool
+from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsItem, QGraphicsLineItem, QGraphicsTextItem
+from PySide6.QtCore import Qt, QDate, QTimer,QDateTime, QTime, Signal, QObject, QRunnable, QThreadPool, QLineF, QPointF
  # 若上面沒 import 到就補上
-from PySide6.QtGui import QPainter, QFont,QPen,QColor
+from PySide6.QtGui import QPainter, QFont,QPen,QColor, QTransform
 from time_block import TimeBlock
 import json
-from encoder_status_manager import EncoderStatusManager
 import os
 import uuid
 from shiboken6 import isValid
 from utils import log,log_exception
 from encoder_utils import get_encoder_display_name
 from path_manager import PathManager 
-class _TrackLabelWorkerSignals(QObject):
-    done = Signal(dict)  # {encoder_name: (status_text, color)}
-
-# class _TrackLabelWorker(QRunnable):
-#     def __init__(self, names, status_manager):
-#         super().__init__()
-#         self.names = names
-#         self.status_manager = status_manager
-#         self.signals = _TrackLabelWorkerSignals()
-
-#     def run(self):
-#         try:
-#             # 這裡會阻塞，但已經在背景執行緒了
-#             result = self.status_manager.refresh_all(self.names)
-#             self.signals.done.emit(result)
-#         except Exception:
-#             self.signals.done.emit({})
-class _TrackLabelWorker(QRunnable):
-    def __init__(self, names, status_manager):
+from block_index import BlockIntervalIndex, block_key
+from schedule_writer import ScheduleWriter, read_schedule_file, serialize_block, block_from_json
+from scheduler_ipc import RemoteScheduleWriter, BATCH_TIMEOUT_MS
+from thumbnail_service import ThumbnailService, ThumbnailDiskCache
+from utils import block_time_range, hour_label_step
+from recurrence import is_rule, expand_rule, sync_occurrences, exclude_occurrence, report_clashes
+
+PREFETCH_DAYS = 7                  # SQLite 模式 / 重複排程：畫面前後各多載（展開）一週，換週時不必等
+SCHEDULER_HORIZON_S = 30 * 60      # SQLite 模式 / 重複排程：排程器需要的「接下來 N 分鐘」一定在記憶體內
+HOUR_TICK_MIN_PX = 8               # 每小時虛線至少相隔幾像素；更密就改成每 N 小時一條
+ZOOM_LOD_DELAY_MS = 150            # 縮放停下後才重排畫面外 block 的文字
+NOW_TICK_SLACK_MS = 5              # 現在時間線在整秒後幾毫秒更新，避免剛好落在上一秒
+
+
+class _PageWorkerSignals(QObject):
+    done = Signal(int, object, object)   # token, ranges, rows
+
+
+class _PageWorker(QRunnable):
+    """背景查詢 ScheduleStore 的指定範圍；不碰任何 Qt 物件。"""
+    def __init__(self, token, store, ranges):
         super().__init__()
-        self.names = names
-        self.status_manager = status_manager
-        self.signals = _TrackLabelWorkerSignals()
+        self.token = token
+        self.store = store
+        self.ranges = ranges
+        self.signals = _PageWorkerSignals()
 
     def run(self):
+        rows = {}
         try:
-            result = self.status_manager.refresh_all(self.names)
-            # ✅ 發射前確認 signal 來源仍有效
-            if self.signals and isValid(self.signals):
-                self.signals.done.emit(result)
-        except Exception:
-            # ✅ 就算失敗也先確保 signal 還活著再 emit
-            try:
-                if self.signals and isValid(self.signals):
-                    self.signals.done.emit({})
-            except Exception:
-                # signals 已不存在就安靜結束
-                pass
+            for start_ts, end_ts in self.ranges:
+                for r in self.store.query_range(start_ts, end_ts):
+                    rows[r["id"]] = r
+        except Exception as e:
+            log(f"❌ 背景載入排程失敗：{e}", level="ERROR")
+            return
+        try:
+            if isValid(self.signals):
+                self.signals.done.emit(self.token, self.ranges, list(rows.values()))
+        except RuntimeError:
+            pass
+
+
 class ScheduleView(QGraphicsView):
+    schedule_changed = Signal()  # block_data 有增刪改（儲存/載入）時發出
+    schedule_reloaded = Signal() # block_data 整份換掉（載入、換頁、軌道重排、重複規則重新展開）
+    blocks_changed = Signal(list)  # [block_id]：touch_block 新增/修改的
+    blocks_removed = Signal(list)  # [block_id]：forget_block 刪除的
+
     def __init__(self):
         super().__init__()
         self.encoder_labels = {}
+        self._track_label_items = []     # 左側軌道標籤（格線本身畫在 drawBackground，不是 item）
         self.blocks = []
         self.block_data = []
+        self.block_index = BlockIntervalIndex()  # 每軌區間索引，給重疊檢查用
+        self._block_items = {}           # {block id: TimeBlock}；draw_blocks 對帳用
+        self._block_sigs = {}            # {block id: _block_item_signature}
+        self._block_layout_sig = None    # (base_date, hour_width)；變了就全部重新定位
+        self.writer = ScheduleWriter(self._serialize_schedule, self._serialize_block_by_id, parent=self)  # write-behind 存檔
+        self.store = None                 # ScheduleStore（選用）；有設定時 block_data 只放需要的範圍
+        self.scheduler = None             # SchedulerClient（選用）；有設定時排程與存檔由 scheduler_daemon 負責
+        self._store_ranges = []           # [(from_ts, to_ts)] block_data 目前涵蓋的範圍
+        self.rules = {}                   # {rule_id: 重複規則}；occurrence 只展開需要的範圍（見 recurrence）
+        self._reported_clashes = set()    # 展開時因重疊略過、已警告過的 occurrence id
+        self._horizon_timer = QTimer(self)
+        self._horizon_timer.timeout.connect(self._extend_store_horizon)
+        self._horizon_timer.timeout.connect(self._expand_occurrences)
+        self._horizon_timer.start(SCHEDULER_HORIZON_S * 1000 // 2)
+        self._page_token = 0              # 只套用最新一次換頁的結果
+        self._page_worker = None          # ✅ 持有 worker，避免 signals 被 GC
+        self._deleted_while_paging = set()
         self.orphan_blocks = []
         self.path_manager = None
         self.scene = QGraphicsScene(self)
         self.setScene(self.scene)
         self.days = 7
-        self.hour_width = 20
+        self.hour_width = 20             # scene 座標的每小時寬度（固定）；縮放改 view transform
         self.day_width = 24 * self.hour_width
+        self.zoom_scale = 1.0            # 目前水平縮放倍率（像素 / scene 單位）
+        self._lod_timer = QTimer(self)
+        self._lod_timer.setSingleShot(True)
+        self._lod_timer.setInterval(ZOOM_LOD_DELAY_MS)
+        self._lod_timer.timeout.connect(lambda: self._apply_block_zoom(visible_only=False))
         self.base_date = QDate.currentDate()
         self.encoder_names = []
         self.encoder_status = {}
@@ -70,15 +102,22 @@ class ScheduleView(QGraphicsView):
         # self.setSceneRect(-120, 0, self.days * self.day_width + 150, 1000)
         
         self.setRenderHint(QPainter.Antialiasing)
+        self.setCacheMode(QGraphicsView.CacheBackground)  # 背景格線只在捲動露出的部分重畫
         # self.schedule_timer = QTimer()
         # self.schedule_timer.start(1000)
         # self.load_schedule()
         self.path_manager = PathManager()
         self.record_root = self.path_manager.record_root  
+        self.thumbnails = ThumbnailService(   # 縮圖在背景讀取 + LRU 快取 + 本機磁碟快取
+            parent=self, disk_cache=ThumbnailDiskCache(self.path_manager.thumb_cache_dir())
+        )
+        self.thumbnails.thumbnailReady.connect(self._on_thumbnail_ready)
 
         self.now_timer = QTimer(self)
-        self.now_timer.timeout.connect(self.update_now_line)
-        self.now_timer.start(1000)  # 每秒更新
+        self.now_timer.setSingleShot(True)
+        self.now_timer.setTimerType(Qt.PreciseTimer)
+        self.now_timer.timeout.connect(self._on_now_tick)
+        self._arm_now_timer()  # 每秒更新（對齊整秒）
         self.now_line_item = None
         self.now_time_label = None
         self.global_timer = QTimer(self)
@@ -89,18 +128,11 @@ class ScheduleView(QGraphicsView):
        
         self.grid_top_offset = 30
         self.setAlignment(Qt.AlignLeft | Qt.AlignTop)
-        self.encoder_status_manager = EncoderStatusManager()
-        self._pool = QThreadPool.globalInstance()
-        
-        self._status_timer = QTimer(self)
-        self._status_timer.timeout.connect(self.refresh_track_labels)  # 只丟 worker，不做 I/O
-        self._status_timer.start(2000)  # 每 2 秒觸發一次背景刷新
+        self.status_service = None   # EncoderStatusService，由 MainWindow 設定
         
         self.block_status_timer = QTimer(self)
         self.block_status_timer.timeout.connect(self.update_all_blocks)  # 見下方新函式
         self.block_status_timer.start(1000)  # 每秒更新一次（可改 2000/5000）
-        self._pool = QThreadPool.globalInstance()
-        self._bg_workers = []      # ✅ 保存背景任務，避免被 GC
     def get_now_x(self) -> int | None:
         now = QDateTime.currentDateTime()
         days = self.base_date.daysTo(now.date())
@@ -111,9 +143,9 @@ class ScheduleView(QGraphicsView):
         return int(days * self.day_width + hours * self.hour_width)
 
     def center_on_x(self, x: int):
-        sb = self.horizontalScrollBar()
-        target = int(x - self.viewport().width() / 2)
-        sb.setValue(max(sb.minimum(), min(sb.maximum(), target)))
+        # x 是 scene 座標；縮放後捲軸單位是像素，交給 centerOn 換算
+        y = self.mapToScene(self.viewport().rect().center()).y()
+        self.centerOn(QPointF(x, y))
 
     def center_on_now(self):
         x = self.get_now_x()
@@ -142,26 +174,49 @@ class ScheduleView(QGraphicsView):
                         img_folder = os.path.join(self.record_root, item.start_date.toString("MM.dd.yyyy"), "img")
                         item.load_preview_images(img_folder)
    
+    def _on_thumbnail_ready(self, block_id, pixmap):
+        if getattr(self, "_is_closing", False) or not isValid(self):
+            return
+        item = self._block_items.get(block_id)
+        if item is not None and isValid(item) and item.scene() is self.scene:
+            item.set_preview_pixmap(pixmap)
+
+    def _arm_now_timer(self):
+        # ➤ 對齊到下一個整秒：時鐘文字與實際秒數同步，一秒只喚醒一次
+        ms = QDateTime.currentMSecsSinceEpoch()
+        self.now_timer.start(1000 - ms % 1000 + NOW_TICK_SLACK_MS)
+
+    def _on_now_tick(self):
+        if getattr(self, "_is_closing", False):
+            return
+        self.update_now_line()
+        self._arm_now_timer()
+
+    def _ensure_now_items(self):
+        """現在時間線與時間文字各只建一次，之後只 setPos / 換文字。"""
+        if self.now_line_item is None or not isValid(self.now_line_item):
+            self.now_line_item = QGraphicsLineItem()
+            self.now_line_item.setPen(QPen(Qt.red, 2))
+            self.now_line_item.setZValue(1000)
+            self.scene.addItem(self.now_line_item)
+        if self.now_time_label is None or not isValid(self.now_time_label):
+            self.now_time_label = QGraphicsTextItem()
+            self.now_time_label.setFont(QFont("Arial", 8, QFont.Bold))
+            self.now_time_label.setDefaultTextColor(Qt.red)
+            self.now_time_label.setFlag(QGraphicsItem.ItemIgnoresTransformations, True)
+            self.now_time_label.setZValue(1000)
+            self.scene.addItem(self.now_time_label)
+
     def update_now_line(self):
         now = QDateTime.currentDateTime()
         days_from_base = self.base_date.daysTo(now.date())
 
-        # 不在可視範圍內時，移除現在時間線
+        # 不在可視範圍內時，隱藏現在時間線（item 保留，回到範圍內再顯示）
         if not (0 <= days_from_base < self.days):
-            try:
-                if self.now_line_item and self.now_line_item.scene():
-                    self.scene.removeItem(self.now_line_item)
-            except RuntimeError:
-                pass
-            self.now_line_item = None
-
-            try:
-                if self.now_time_label and self.now_time_label.scene():
-                    self.scene.removeItem(self.now_time_label)
-            except RuntimeError:
-                pass
-            self.now_time_label = None
-            return      
+            for item in (self.now_line_item, self.now_time_label):
+                if item is not None and isValid(item):
+                    item.setVisible(False)
+            return
 
         # ➤ 計算目前時間對應的 X 座標
         time = now.time()
@@ -169,66 +224,36 @@ class ScheduleView(QGraphicsView):
         x = days_from_base * self.day_width + total_hours * self.hour_width
 
         offset = self.grid_top_offset  # 🔴 新增：向下偏移
+        self._ensure_now_items()
 
-        # ✅ 安全地移除舊紅線
-        try:
-            if self.now_line_item and self.now_line_item.scene():
-                self.scene.removeItem(self.now_line_item)
-        except RuntimeError:
-            self.now_line_item = None
+        # ✅ 只移動既有 item：重繪範圍只有新舊兩個位置
+        height = self.tracks * 100
+        if self.now_line_item.line().y2() != height:
+            self.now_line_item.setLine(0, 0, 0, height)
+        self.now_line_item.setPos(x, offset)
+        self.now_line_item.setVisible(True)
 
-        self.now_line_item = self.scene.addLine(
-            x, offset, x, offset + self.tracks * 100, QPen(Qt.red, 2)
-        )
-        self.now_line_item.setZValue(1000)
+        self.now_time_label.setPlainText(f"TIME {time.toString('HH:mm:ss')}")
+        self.now_time_label.setPos(x - 10 / self.zoom_scale, offset - 18)  # 🔴 新位置跟著 offset
+        self.now_time_label.setVisible(True)
 
-        # ✅ 安全地移除舊時間文字
-        try:
-            if self.now_time_label and self.now_time_label.scene():
-                self.scene.removeItem(self.now_time_label)
-        except RuntimeError:
-            self.now_time_label = None
-
-        # ➤ 新增現在時間文字
-        time_str = now.time().toString("HH:mm:ss")
-        self.now_time_label = self.scene.addText(f"TIME {time_str}")
-        self.now_time_label.setFont(QFont("Arial", 8, QFont.Bold))
-        self.now_time_label.setDefaultTextColor(Qt.red)
-        self.now_time_label.setPos(x - 10, offset - 18)  # 🔴 新位置跟著 offset
-        self.now_time_label.setZValue(1000)
-        
     def update_all_blocks(self):
             # 只更新畫面內的 block，省資源
         visible_scene_rect = self.mapToScene(self.viewport().rect()).boundingRect()
         for item in self.scene.items(visible_scene_rect):
             if isinstance(item, TimeBlock):
                 item.update_status_by_time()
-    # def refresh_track_labels(self):
-    #     # 啟動背景 worker 查詢所有 encoder 狀態
-    #     worker = _TrackLabelWorker(self.encoder_names, self.encoder_status_manager)
-    #     worker.signals.done.connect(self._apply_track_label_statuses)
-    #     self._pool.start(worker)
-    def refresh_track_labels(self):
-        # 啟動背景 worker 查詢所有 encoder 狀態
-        worker = _TrackLabelWorker(list(self.encoder_names), self.encoder_status_manager)
-
-        # ✅ 持有 worker，避免 signals 被回收
-        self._bg_workers.append(worker)
-
-        def _on_done(result, w=worker):
-            # 視圖已關閉或正在關閉就跳過
-            if getattr(self, "_is_closing", False) or not isValid(self):
-                pass
-            else:
-                self._apply_track_label_statuses(result)
-            # ✅ 用完就移除引用
-            try:
-                self._bg_workers.remove(w)
-            except ValueError:
-                pass
+    def set_status_service(self, service):
+        """訂閱共用的 EncoderStatusService，狀態變化時更新左側標題。"""
+        self.status_service = service
+        service.statusChanged.connect(self._on_status_changed)
+        self._apply_track_label_statuses(service.states())
+
+    def _on_status_changed(self, name: str, state):
+        if getattr(self, "_is_closing", False) or not isValid(self):
+            return
+        self._apply_track_label_statuses({name: state})
 
-        worker.signals.done.connect(_on_done)
-        self._pool.start(worker)
     def _apply_track_label_statuses(self, statuses: dict):
         for name, pair in statuses.items():
             if not isinstance(pair, (tuple, list)) or len(pair) < 2:
@@ -245,29 +270,27 @@ class ScheduleView(QGraphicsView):
             label_item.setDefaultTextColor(QColor(color))
 
     def draw_grid(self):
-        log(f"🎯 draw_grid encoder_names:{self.encoder_names}")
+        """
+        重排格線與軌道標籤，再對帳 block。
+        格線/日框/軌道線畫在 drawBackground，這裡不 clear scene，TimeBlock 原地保留。
+        """
+        log("🎯 draw_grid encoder_names:%s", self.encoder_names, level="DEBUG")
 
         offset = self.grid_top_offset
-        self.scene.clear()
         self.tracks = len(self.encoder_names)
         self.update_scene_rect()
+        self.resetCachedContent()   # ✅ hour_width / 軌道數可能變了，背景快取作廢
+        self.viewport().update()
         self.verticalScrollBar().setValue(0)
 
-        # 仍保留原本用 item 畫格線（先不動），只是先解決同步查詢卡頓
-        for day in range(self.days):
-            for hour in range(24):
-                x = day * self.day_width + hour * self.hour_width
-                self.scene.addLine(x, offset, x, offset + self.tracks * 100, Qt.DotLine)
-
-        for day in range(self.days):
-            x = day * self.day_width
-            self.scene.addRect(x, offset, self.day_width, self.tracks * 100)
-
-        # 🔄 每個 track 標籤（改成占位，不同步查 EncStatus）
+        # 🔄 每個 track 標籤（改成占位，不同步查 EncStatus）；只有幾個，整批重建
+        for label_item in self._track_label_items:
+            if isValid(label_item) and label_item.scene() is self.scene:
+                self.scene.removeItem(label_item)
+        self._track_label_items = []
         self.encoder_labels.clear()  # 先清一次，避免殘留舊 mapping
         for track in range(self.tracks):
             y = offset + track * 100
-            self.scene.addLine(0, y, self.days * self.day_width, y)
 
             if track < len(self.encoder_names):
                 encoder_name = self.encoder_names[track]
@@ -282,7 +305,9 @@ class ScheduleView(QGraphicsView):
             label_item = self.scene.addText(full_label)
             label_item.setFont(QFont("Arial", 9))
             label_item.setDefaultTextColor(QColor(color))
-            label_item.setPos(-95, y)
+            label_item.setFlag(QGraphicsItem.ItemIgnoresTransformations, True)  # 縮放時字不變形
+            label_item.setPos(-95 / self.zoom_scale, y)
+            self._track_label_items.append(label_item)
 
             if encoder_name is not None:
                 self.encoder_labels[encoder_name] = label_item  # 之後 refresh 用
@@ -291,69 +316,183 @@ class ScheduleView(QGraphicsView):
         self.update_now_line()
         self.verticalScrollBar().setValue(self.verticalScrollBar().minimum())
 
-        # ✅ 用背景 worker 批次刷新真實狀態（不阻塞 UI）
-        # self.refresh_track_labels()
-        
-  
+        # ✅ 直接套用共用快取的狀態（不做 I/O）
+        if self.status_service is not None:
+            self._apply_track_label_statuses(self.status_service.states())
+
+    def drawBackground(self, painter, rect):
+        """每小時虛線、每日框線、軌道分隔線；只畫 rect（露出的區域）內的部分。"""
+        super().drawBackground(painter, rect)
+        if self.tracks <= 0 or self.days <= 0 or self.hour_width <= 0:
+            return
+
+        top = self.grid_top_offset
+        bottom = top + self.tracks * 100
+        width = self.days * self.day_width
+        left = max(rect.left(), 0)
+        right = min(rect.right(), width)
+        if left > right or rect.bottom() < top or rect.top() > bottom:
+            return
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing, False)
+
+        # ➤ 每小時虛線（與舊版 scene.addLine(..., Qt.DotLine) 相同樣式）；縮很小時只畫每 N 小時
+        step = hour_label_step(self.hour_width * self.zoom_scale, HOUR_TICK_MIN_PX)
+        first = max(0, int(left // self.hour_width))
+        first -= first % step
+        last = min(self.days * 24, int(right // self.hour_width) + 1)
+        painter.setPen(QPen(Qt.DotLine))
+        painter.drawLines([
+            QLineF(h * self.hour_width, top, h * self.hour_width, bottom) for h in range(first, last, step)
+        ])
+
+        # ➤ 每日框線 + 軌道分隔線
+        lines = []
+        first_day = max(0, int(left // self.day_width))
+        last_day = min(self.days, int(right // self.day_width) + 1)
+        for day in range(first_day, last_day + 1):
+            x = day * self.day_width
+            lines.append(QLineF(x, top, x, bottom))
+        for y in [top + track * 100 for track in range(self.tracks)] + [bottom]:
+            if rect.top() <= y <= rect.bottom():
+                lines.append(QLineF(left, y, right, y))
+        painter.setPen(QPen(Qt.black))
+        painter.drawLines(lines)
+        painter.restore()
 
     def update_scene_rect(self):
         self.tracks = len(self.encoder_names)
         # scene_height = self.tracks * 100 + 40
         scene_height = self.tracks * 100 + self.grid_top_offset
-        scene_width = self.days * self.day_width + 150
-        self.setSceneRect(-120, 0, scene_width, scene_height)
-    def draw_blocks(self):
-            # 建立舊 block 映射（label → block）以便繼承狀態
-        old_block_map = {block.label: block for block in self.blocks}
-
-        # 清除舊的 TimeBlock（但不刪除其他 scene 內容）
-        for item in self.scene.items():
-            if isinstance(item, TimeBlock):
-                item.safe_delete()
-
-        self.blocks = []
-
-        start_range = self.base_date
-        end_range = self.base_date.addDays(self.days)
-
-        for data in self.block_data:
-            block_start = data["qdate"]
-            total_hours = data["start_hour"] + data["duration"]
-            extra_days = int(total_hours // 24)
-            block_end = block_start.addDays(extra_days)
-
-            if block_end >= start_range and block_start <= end_range:
-                block = TimeBlock(
-                    data["qdate"],
-                    data["track_index"],
-                    data["start_hour"],
-                    data["duration"],
-                    data["label"],
-                    block_id=data.get("id")
-                )
-                block.path_manager = self.path_manager
-                # 先加到 scene 才能安全操作 scene() 相關功能
-                self.scene.addItem(block)
-                block.update_geometry(self.base_date)
-                block.encoder_names = self.encoder_names
-                # block.status = data.get("status") or "狀態：⏳ 等待中"
-
-                block.update_text_position()
-                # ✅ 立刻依現在時間套狀態（等待中／已結束）
-                block.update_status_by_time()
-                # 從舊 block 繼承狀態與圖片
-                old_block = old_block_map.get(data["label"])
-                if old_block:
-                    block.status = old_block.status
-                    if hasattr(old_block, "status_text") and old_block.status_text:
-                        block.status_text.setText(old_block.status)
-                if block.block_id and hasattr(self, "record_root"):
-                    img_folder = os.path.join(self.record_root, block.start_date.toString("MM.dd.yyyy"), "img")
-                    block.load_preview_images(img_folder)
-
-            
+        # 左側軌道標籤區以像素為準：縮放時換算回 scene 單位，寬度維持不變
+        scene_width = self.days * self.day_width + 150 / self.zoom_scale
+        self.setSceneRect(-120 / self.zoom_scale, 0, scene_width, scene_height)
+
+    def set_zoom(self, hour_px):
+        """
+        水平縮放：只換 view transform，scene 座標（hour_width）不變，
+        block 不必重算位置；文字/縮圖/標籤忽略 transform，只調整省略與間距。
+        """
+        scale = hour_px / self.hour_width
+        if scale <= 0 or scale == self.zoom_scale:
+            return
+        self.zoom_scale = scale
+        self.setTransform(QTransform.fromScale(scale, 1.0))
+        self.update_scene_rect()
+        for label_item in self._track_label_items:
+            if isValid(label_item):
+                label_item.setPos(-95 / scale, label_item.pos().y())
+        self.resetCachedContent()
+        self.update_now_line()
+        # ✅ 畫面內的 block 立刻跟上；其餘等滑桿停下再一起處理
+        self._apply_block_zoom(visible_only=True)
+        self._lod_timer.start()
+
+    def _apply_block_zoom(self, visible_only):
+        if visible_only:
+            rect = self.mapToScene(self.viewport().rect()).boundingRect()
+            items = [i for i in self.scene.items(rect) if isinstance(i, TimeBlock)]
+        else:
+            items = list(self._block_items.values())
+        for item in items:
+            if isValid(item) and item.scene() is self.scene:
+                item.apply_zoom()
+    @staticmethod
+    def _block_item_signature(data):
+        """影響 TimeBlock 外觀的欄位；沒變就不動那個 item。"""
+        qdate = data["qdate"]
+        return (qdate.toJulianDay() if isinstance(qdate, QDate) else qdate,
+                data["track_index"], data["start_hour"], data["duration"], data["label"])
+
+    def _create_block_item(self, data, inherit=None):
+        block = TimeBlock(
+            data["qdate"],
+            data["track_index"],
+            data["start_hour"],
+            data["duration"],
+            data["label"],
+            block_id=data.get("id")
+        )
+        block.path_manager = self.path_manager
+        # 先加到 scene 才能安全操作 scene() 相關功能
+        self.scene.addItem(block)
+        block.update_geometry(self.base_date)
+        block.encoder_names = self.encoder_names
+        # block.status = data.get("status") or "狀態：⏳ 等待中"
+
+        block.update_text_position()
+        # ✅ 立刻依現在時間套狀態（等待中／已結束）
+        block.update_status_by_time()
+        # 從舊 block 繼承狀態與圖片
+        if inherit is not None:
+            block.status = inherit.status
+            if block.status_text:
+                block.status_text.setText(inherit.status)
+        self._load_block_preview(block)
+        return block
+
+    def _load_block_preview(self, block):
+        if block.block_id and hasattr(self, "record_root"):
+            img_folder = os.path.join(self.record_root, block.start_date.toString("MM.dd.yyyy"), "img")
+            block.load_preview_images(img_folder)
 
-                self.blocks.append(block)
+    def draw_blocks(self):
+        """
+        以 block id 對帳：只新增/移除/重新定位有變動的 TimeBlock，
+        沒變的 item（和它的縮圖）原封不動。
+        """
+        # ⛑️ 外部 removeItem 過的 item 已失效；保留 Python 端的 status 供新 item 繼承
+        stale = {}
+        for key, item in list(self._block_items.items()):
+            if not isValid(item) or item.scene() is not self.scene:
+                stale[key] = self._block_items.pop(key)
+                self._block_sigs.pop(key, None)
+
+        # ✅ 只取畫面範圍內的節目（每軌區間索引），不必掃過全部 block_data
+        start_ts = QDateTime(self.base_date, QTime(0, 0)).toSecsSinceEpoch()
+        end_ts = QDateTime(self.base_date.addDays(self.days + 1), QTime(0, 0)).toSecsSinceEpoch()
+        wanted = {block_key(data): data for data in self.block_index.in_range(start_ts, end_ts)}
+
+        layout_sig = (self.base_date.toJulianDay(), self.hour_width)
+        relayout = layout_sig != self._block_layout_sig
+        self._block_layout_sig = layout_sig
+
+        removed = created = moved = 0
+        for key in [k for k in self._block_items if k not in wanted]:
+            self._block_items.pop(key).safe_delete()
+            self._block_sigs.pop(key, None)
+            removed += 1
+
+        for key, data in wanted.items():
+            sig = self._block_item_signature(data)
+            item = self._block_items.get(key)
+            if item is None:
+                self._block_items[key] = self._create_block_item(data, inherit=stale.get(key))
+                created += 1
+            elif self._block_sigs.get(key) != sig:
+                date_changed = item.start_date != data["qdate"]
+                item.start_date = data["qdate"]
+                item.track_index = data["track_index"]
+                item.start_hour = data["start_hour"]
+                item.duration_hours = data["duration"]
+                item.label = data["label"]
+                item.update_geometry(self.base_date)
+                item.update_text_position()
+                item.update_preview_position()  # 文字寬度可能變了
+                item.update_status_by_time()
+                if date_changed:
+                    self._load_block_preview(item)  # 縮圖資料夾依日期
+                moved += 1
+            elif relayout:
+                item.update_geometry(self.base_date)
+                moved += 1
+            self._block_sigs[key] = sig
+
+        self.blocks = list(self._block_items.values())
+        if created or removed or moved:
+            log("🧩 draw_blocks：新增 %d、移除 %d、更新 %d（畫面內 %d）", created, removed, moved, len(self.blocks),
+                level="DEBUG")
 
         # 更新 ScheduleRunner 的 block 清單
         if hasattr(self, "runner"):
@@ -365,34 +504,48 @@ class ScheduleView(QGraphicsView):
 
 
     def is_overlap(self, qdate, track_index, start_hour, duration, exclude_label=None):
-        new_start_dt = QDateTime(qdate, QTime(int(start_hour), int((start_hour % 1) * 60)))
-        end_hour = start_hour + duration
-        end_qdate = qdate.addDays(1) if end_hour >= 24 else qdate
-        new_end_dt = QDateTime(end_qdate, QTime(int(end_hour % 24), int(((end_hour % 1) * 60))))
-
-        for block in self.block_data:
-            if block["track_index"] != track_index:
-                continue
-
-            # ✅ 用 exclude_label 當作 exclude_id（只要確定你傳的是 block["id"]）
-            if exclude_label and block.get("id") == exclude_label:
-                continue  
-
-            b_start_hour = float(block["start_hour"])
-            b_end_hour = float(block.get("end_hour", b_start_hour + block["duration"]))
-            b_qdate = block["qdate"]
-            if isinstance(b_qdate, str):
-                b_qdate = QDate.fromString(b_qdate, "yyyy-MM-dd")
-            b_end_qdate = block.get("end_qdate", b_qdate.addDays(1) if b_end_hour >= 24 else b_qdate)
-
-            b_start_dt = QDateTime(b_qdate, QTime(int(b_start_hour), int((b_start_hour % 1) * 60)))
-            b_end_dt = QDateTime(b_end_qdate, QTime(int(b_end_hour % 24), int((b_end_hour % 1) * 60)))
-
-            if new_start_dt < b_end_dt and new_end_dt > b_start_dt:
-                log(f"🔴 重疊偵測：與 {block['label']} 發生重疊")
-                return True
+        new_start_ts, new_end_ts = block_time_range({"qdate": qdate, "start_hour": start_hour, "duration": duration})
+        # ✅ 用 exclude_label 當作 exclude_id（只要確定你傳的是 block["id"]）
+        hits = self.find_overlaps(track_index, new_start_ts, new_end_ts, exclude_id=exclude_label)
+        if hits:
+            log(f"🔴 重疊偵測：與 {hits[0]['label']} 發生重疊")
+            return True
 
         return False
+
+    def find_overlaps(self, track_index, start_ts, end_ts, exclude_id=None):
+        """與 [start_ts, end_ts) 重疊的 block；超出已載入範圍時查資料庫。"""
+        hits = self.block_index.overlaps(track_index, start_ts, end_ts, exclude_id=exclude_id)
+        if not hits and self.store is not None and not self._store_covers(start_ts, end_ts):
+            # ➤ 超出已載入範圍（例如新增到很遠的日期）：直接查資料庫
+            self.writer.flush()
+            hits = self.store.overlaps(track_index, start_ts, end_ts, exclude_id=exclude_id)
+        if not hits:
+            # ➤ 重複排程在展開範圍外的那幾次
+            hits = [o for o in self._unexpanded_occurrences(start_ts, end_ts, track_index) if o["id"] != exclude_id]
+        return hits
+
+    def intervals_between(self, start_ts, end_ts):
+        """批次比對用的 [(track, start_ts, end_ts)]：已載入的全部，資料庫模式再補上範圍內未載入的。"""
+        intervals = self.block_index.intervals()
+        if self.store is not None and not self._store_covers(start_ts, end_ts):
+            self.writer.flush()
+            intervals += [(int(r["track_index"]), *block_time_range(r))
+                          for r in self.store.query_range(start_ts, end_ts)
+                          if self.block_index.get(r["id"]) is None]
+        intervals += [(o["track_index"], *block_time_range(o)) for o in self._unexpanded_occurrences(start_ts, end_ts)]
+        return intervals
+
+    def _unexpanded_occurrences(self, start_ts, end_ts, track_index=None):
+        """重複規則在 [start_ts, end_ts) 內、還沒展開進 block_data 的 occurrence。"""
+        found = []
+        for rule in self.rules.values():
+            if rule.get("encoder_name") not in self.encoder_names:
+                continue
+            if track_index is not None and self.encoder_names.index(rule["encoder_name"]) != track_index:
+                continue
+            found.extend(o for o in expand_rule(rule, start_ts, end_ts) if self.block_index.get(o["id"]) is None)
+        return found
     
 
     def add_time_block(self, qdate: QDate, track_index, start_hour, duration=4, label="節目", encoder_name=None, block_id=None):
@@ -423,7 +576,31 @@ class ScheduleView(QGraphicsView):
             block["id"] = block_id
 
         self.block_data.append(block)
+        self.touch_block(block)
+        self.draw_blocks()
+    def add_blocks(self, blocks):
+        """
+        整批新增（EPG 匯入）：只重畫、存檔一次；
+        JSON 模式改寫完整主檔（原子替換），不會只存進一半。
+        接 scheduler_daemon 時改送 batch：本機這份排程可能過時，由 daemon 以最新排程再檢查一次重疊，
+        通過的由 daemon 廣播 put 回來再畫。
+        回傳被拒絕的 [{"id", "label", "reason", "conflicts"}]；daemon 沒回應丟 RuntimeError。
+        """
+        if self.scheduler is not None:
+            self.writer.flush()  # ⛑️ 本機還沒送出的編輯先到 daemon，重疊檢查才看得到
+            reply = self.scheduler.call("batch", timeout_ms=BATCH_TIMEOUT_MS,
+                                        add=[serialize_block(b) for b in blocks], atomic=False)
+            if reply is None or "error" in reply:
+                raise RuntimeError((reply or {}).get("error") or "排程 daemon 沒有回應")
+            return reply.get("rejected") or []
+        for block in blocks:
+            self.block_data.append(block)
+            self.touch_block(block)
+        self.writer.request_full()
+        self.save_schedule(immediate=True)
         self.draw_blocks()
+        return []
+
     def can_delete_block(self, block):
         now = QDateTime.currentDateTime()
         start_dt = QDateTime(block["qdate"], QTime(int(block["start_hour"]), int((block["start_hour"] % 1) * 60)))
@@ -444,21 +621,30 @@ class ScheduleView(QGraphicsView):
         # ✅ 找出場景中的 block item 並刪除
         for item in self.blocks:
             if item.label == label:
-                self.scene.removeItem(item)
+                item.safe_delete()  # 連同縮圖一起移除（不再有 scene.clear() 幫忙清）
                 self.blocks.remove(item)
                 break
 
         # ✅ 從 block_data 移除
+        for b in self.block_data:
+            if b["label"] == label:
+                self.forget_block(b.get("id"))
         self.block_data = [b for b in self.block_data if b["label"] != label]
         self.save_schedule()
 
     def set_start_date(self, qdate):
         self.base_date = qdate
-        self.draw_grid()
+        self._expand_occurrences()  # 重複排程改展開新的範圍
+        self.draw_grid()  # 先用記憶體內已預載的資料畫
+        if self.store is not None and not self._store_covers(*self._store_window()):
+            self._page_store_async()  # ✅ 預載範圍不夠：背景換頁，回來再補畫
    
 
     
-    def save_schedule(self, filename=None):
+    def save_schedule(self, filename=None, immediate=False):
+        """
+        標記排程已變更：預設合併到下一次 debounce 寫入；immediate=True 時立即在背景寫出。
+        """
         try:
             # ✅ 如果使用者選過排程檔，優先使用該路徑
             if filename is None and hasattr(self, "schedule_file"):
@@ -470,39 +656,278 @@ class ScheduleView(QGraphicsView):
                 os.makedirs(documents_dir, exist_ok=True)
                 filename = os.path.join(documents_dir, "schedule.json")
 
-            block_map = {b["id"]: b for b in self.block_data if b.get("id")}
-            now = QDateTime.currentDateTime()
-
-            for item in self.scene.items():
-                if isinstance(item, TimeBlock) and item.block_id in block_map:
-                    start_dt = QDateTime(item.start_date, QTime(int(item.start_hour), int((item.start_hour % 1) * 60)))
-                    if start_dt >= now:
-                        block_map[item.block_id]["status"] = item.status
-
-            with open(filename, "w", encoding="utf-8") as f:
-                json.dump([
-                    {
-                        "qdate": b["qdate"].toString("yyyy-MM-dd"),
-                        "track_index": b["track_index"],
-                        "start_hour": b["start_hour"],
-                        "duration": b["duration"],
-                        "end_hour": b["end_hour"],
-                        "end_qdate": (
-                            b["end_qdate"].toString("yyyy-MM-dd") if isinstance(b["end_qdate"], QDate)
-                            else b["end_qdate"]
-                        ),
-                        "label": b["label"],
-                        "id": b.get("id"),
-                        "encoder_name": b.get("encoder_name"),
-                        "snapshot_path": b.get("snapshot_path", ""),
-                        "status": b.get("status", "")
-                    } for b in self.block_data
-                ], f, ensure_ascii=False, indent=2)
-
-            log(f"✅ 已儲存節目排程：{filename}")
+            if immediate:
+                self.writer.write_soon(filename)
+            else:
+                self.writer.mark_dirty(filename)
+            self.schedule_changed.emit()
         except Exception as e:
             log_exception(f"❌ 儲存失敗: {e}")
 
+    def flush_schedule(self):
+        """同步寫完尚未落地的排程（關閉程式前呼叫）。"""
+        self.writer.flush()
+
+    def _serialize_schedule(self):
+        """主線程：把 block_data 轉成 JSON 可序列化的 list（背景執行緒只負責寫檔）。"""
+        block_map = {b["id"]: b for b in self.block_data if b.get("id")}
+        now = QDateTime.currentDateTime()
+
+        for item in self.scene.items():
+            if isinstance(item, TimeBlock) and item.block_id in block_map:
+                start_dt = QDateTime(item.start_date, QTime(int(item.start_hour), int((item.start_hour % 1) * 60)))
+                if start_dt >= now:
+                    block_map[item.block_id]["status"] = item.status
+
+        # ✅ 重複規則只存規則本身；未修改過的 occurrence（virtual）不存
+        return [self._serialize_block(b) for b in self.block_data if not b.get("virtual")] + \
+            [self._serialize_block(r) for r in self.rules.values()]
+
+    def _serialize_block_by_id(self, block_id):
+        b = self.block_index.get(block_id)
+        if b is None:
+            b = self.rules.get(block_id)
+        return self._serialize_block(b) if b is not None else None
+
+    _serialize_block = staticmethod(serialize_block)
+    _block_from_json = staticmethod(block_from_json)
+
+    # --- scheduler_daemon 模式 ---
+    def attach_scheduler(self, client):
+        """改由 scheduler_daemon 排程與存檔：本地變更送給 daemon，daemon 的變更套回畫面。"""
+        self.writer.flush()
+        self.scheduler = client
+        self.writer = RemoteScheduleWriter(client, self._serialize_schedule, self._serialize_block_by_id, parent=self)
+        self.writer.set_store(self.store)
+        client.blocksPut.connect(self._on_remote_put)
+        client.blocksDeleted.connect(self._on_remote_delete)
+        client.scheduleReplaced.connect(self._apply_remote_schedule)
+        client.statusChanged.connect(self._on_remote_status)
+        client.snapshotReady.connect(self._on_remote_snapshot)
+
+    def _apply_remote_schedule(self, rows):
+        self._set_schedule_rows(rows)
+        self.remap_block_tracks()
+        self.writer.set_base(None)
+        self.draw_grid()
+        self.schedule_reloaded.emit()
+        self.schedule_changed.emit()
+
+    def _on_remote_put(self, rows):
+        rules_changed = False
+        for r in rows:
+            b = self._block_from_json(r)
+            if is_rule(b):
+                self.rules[b["id"]] = b
+                rules_changed = True
+                continue
+            old = self.block_index.get(b.get("id")) if b.get("id") else None
+            if old is not None:
+                old.update(b)  # ✅ 保留同一個 dict，其他地方持有的參考仍有效
+                old.pop("virtual", None)  # 別的 GUI / daemon 已把這一次另存
+                b = old
+            else:
+                self.block_data.append(b)
+            name = b.get("encoder_name")
+            if name in self.encoder_names:
+                b["track_index"] = self.encoder_names.index(name)
+            self.block_index.upsert(b)
+            self.blocks_changed.emit([b.get("id")])
+        if rules_changed:
+            self._expand_occurrences()
+        self.draw_blocks()
+        self.schedule_changed.emit()
+
+    def _on_remote_delete(self, ids):
+        ids = set(ids)
+        self.block_data = [b for b in self.block_data if b.get("id") not in ids]
+        for block_id in ids:
+            self.block_index.remove(block_id)
+        self.blocks_removed.emit(list(ids))
+        if any(self.rules.pop(block_id, None) is not None for block_id in list(ids)):
+            self._expand_occurrences()
+        self.draw_blocks()
+        self.schedule_changed.emit()
+
+    def _on_remote_status(self, block_id, status):
+        b = self.block_index.get(block_id)
+        if b is not None:
+            b["status"] = status
+        item = self._block_items.get(block_id)
+        if item is not None and isValid(item):
+            item.status = status
+            item.update_text_position()
+
+    def _on_remote_snapshot(self, block_id, path):
+        item = self._block_items.get(block_id)
+        if path and item is not None and isValid(item):
+            item.load_preview_images(os.path.dirname(path), refresh=True)  # 剛拍完照，不用快取
+
+    # --- SQLite 模式 ---
+    def set_store(self, store):
+        """改用 ScheduleStore：只載入畫面範圍 + 排程器接下來 SCHEDULER_HORIZON_S。"""
+        self.store = store
+        self.writer.set_store(store)
+
+    def _store_window(self):
+        start_ts = QDateTime(self.base_date.addDays(-PREFETCH_DAYS), QTime(0, 0)).toSecsSinceEpoch()
+        end_ts = QDateTime(self.base_date.addDays(self.days + PREFETCH_DAYS), QTime(0, 0)).toSecsSinceEpoch()
+        return start_ts, end_ts
+
+    def _horizon_window(self):
+        # 從今天 0 點開始：今天已結束的節目排程器仍會補送停止
+        today_ts = QDateTime(QDate.currentDate(), QTime(0, 0)).toSecsSinceEpoch()
+        return today_ts, QDateTime.currentDateTime().toSecsSinceEpoch() + SCHEDULER_HORIZON_S
+
+    def _load_from_store(self):
+        self.writer.flush()  # ⛑️ 待寫的先進資料庫，查出來的才是最新
+        ranges = [self._store_window(), self._horizon_window()]
+        rows = {}
+        for start_ts, end_ts in ranges:
+            for r in self.store.query_range(start_ts, end_ts):
+                rows[r["id"]] = r
+        self.block_data = [self._block_from_json(r) for r in rows.values()]
+        self.rules = {r["id"]: self._block_from_json(r) for r in self.store.rules() if r.get("id")}
+        self._store_ranges = ranges
+        self.orphan_blocks = []
+        self.remap_block_tracks()
+        self.draw_grid()
+        self.schedule_reloaded.emit()
+        self.schedule_changed.emit()
+        log(f"🗄️ 已從資料庫載入 {len(self.block_data)} 筆節目")
+
+    def _page_store_async(self):
+        """換週：背景查新的預載範圍，主線程只做合併與補畫。"""
+        self.writer.flush()  # ⛑️ 待寫的先進資料庫，查出來的才是最新
+        self._page_token += 1
+        self._deleted_while_paging.clear()
+        worker = _PageWorker(self._page_token, self.store, [self._store_window(), self._horizon_window()])
+        self._page_worker = worker
+        worker.signals.done.connect(self._on_page_loaded)
+        QThreadPool.globalInstance().start(worker)
+
+    def _on_page_loaded(self, token, ranges, rows):
+        if token != self._page_token or getattr(self, "_is_closing", False) or not isValid(self):
+            return
+        self._page_worker = None
+        self.writer.flush()  # 換出去的節目若還有未寫的變更，先寫進資料庫
+
+        def in_ranges(b):
+            try:
+                start_ts, end_ts = block_time_range(b)
+            except Exception:
+                return False
+            return any(start_ts < e and end_ts > s for s, e in ranges)
+
+        # ➤ 記憶體內的版本最新：保留仍在範圍內的，新範圍的才從查詢結果補進來
+        kept = [b for b in self.block_data if in_ranges(b)]
+        known = {b.get("id") for b in kept}
+        added = [
+            self._block_from_json(r) for r in rows
+            if r["id"] not in known and r["id"] not in self._deleted_while_paging
+        ]
+        evicted = len(self.block_data) - len(kept)
+        self.block_data = kept + added
+        self._store_ranges = list(ranges)
+        self.orphan_blocks = []
+        self.remap_block_tracks()
+        self.draw_blocks()
+        self.schedule_reloaded.emit()
+        self.schedule_changed.emit()
+        log(f"🗄️ 換頁：載入 {len(added)} 筆、釋放 {evicted} 筆（記憶體內 {len(self.block_data)} 筆）")
+
+    def _store_covers(self, start_ts, end_ts) -> bool:
+        return any(s <= start_ts and end_ts <= e for s, e in self._store_ranges)
+
+    def _extend_store_horizon(self):
+        """定時把排程器範圍往後延；只補進還沒載入的節目，不重建畫面。"""
+        if self.store is None or not self._store_ranges:
+            return
+        start_ts, end_ts = self._horizon_window()
+        covered_until = max(e for _, e in self._store_ranges)
+        if end_ts <= covered_until:
+            return
+        self.writer.flush()
+        added = []
+        for r in self.store.query_range(covered_until, end_ts):
+            if self.block_index.get(r["id"]) is None:
+                block = self._block_from_json(r)
+                self.block_data.append(block)
+                self.block_index.upsert(block)
+                added.append(r["id"])
+        self._store_ranges.append((covered_until, end_ts))
+        if added:
+            self.blocks_changed.emit(added)
+            self.schedule_changed.emit()
+
+    def touch_block(self, b, materialize=True):
+        """
+        單一 block 有新增/修改：更新重疊索引，並記下來讓存檔只追加這一筆。
+        materialize=False：只是執行狀態變了（開始/停止錄影）；重複排程的某一次仍不存檔，狀態只留在記憶體。
+        """
+        if materialize:
+            b.pop("virtual", None)  # 重複排程的某一次被使用者修改：從此當一般 block 存檔
+        self.block_index.upsert(b)
+        if not b.get("virtual"):
+            self.writer.touch(b.get("id"))
+        self.blocks_changed.emit([b.get("id")])
+
+    def forget_block(self, block_id):
+        b = self.block_index.get(block_id)
+        rule = self.rules.get(b.get("rule_id")) if b is not None else None
+        if rule is not None:
+            exclude_occurrence(rule, block_id)  # ✅ 刪掉重複排程的某一次：那天不再展開
+            self.writer.touch(rule["id"])
+        self.block_index.remove(block_id)
+        self.writer.forget(block_id)
+        self._deleted_while_paging.add(block_id)
+        self.blocks_removed.emit([block_id])
+
+    # --- 重複排程 ---
+    def _set_schedule_rows(self, rows):
+        """排程檔 / daemon 的 JSON list ➜ block_data（一般 block）＋ rules（重複規則）。"""
+        self.block_data = [self._block_from_json(r) for r in rows if not is_rule(r)]
+        self.rules = {r["id"]: self._block_from_json(r) for r in rows if is_rule(r) and r.get("id")}
+
+    def _occurrence_ranges(self):
+        return [self._store_window(), self._horizon_window()]
+
+    def _expand_occurrences(self):
+        """重複規則只展開畫面前後 PREFETCH_DAYS 與排程器接下來 SCHEDULER_HORIZON_S 內的那幾次。"""
+        if getattr(self, "_is_closing", False):
+            return
+        data, added, removed, clashes = sync_occurrences(
+            self.block_data, self.block_index, self.rules, self._occurrence_ranges(), self.encoder_names
+        )
+        self.block_data[:] = data  # ✅ 原地替換：runner / 排程器持有的是同一個 list
+        report_clashes(clashes, self._reported_clashes)
+        if added or removed:
+            log(f"🔁 重複排程展開：新增 {added}、移除 {removed}（規則 {len(self.rules)} 條）", level="DEBUG")
+            self.schedule_changed.emit()
+        if added or removed or self.rules:
+            self.schedule_reloaded.emit()  # 規則改過的那幾次是原地更新（不算新增/移除），排程器一樣要重算
+
+    def add_rule(self, rule):
+        """新增或修改重複規則：只存規則這一筆，occurrence 依目前範圍重新展開。"""
+        self.rules[rule["id"]] = rule
+        self.writer.touch(rule["id"])
+        self._expand_occurrences()
+        self.save_schedule(immediate=True)
+        self.draw_blocks()
+
+    def remove_rule(self, rule_id):
+        """刪除整個系列：規則與尚未開始、已另存的那幾次一起刪；已開始/結束的保留為一般節目。"""
+        if self.rules.pop(rule_id, None) is None:
+            return
+        self.writer.forget(rule_id)
+        for b in [b for b in self.block_data if b.get("rule_id") == rule_id and not b.get("virtual")]:
+            if self.can_delete_block(b):
+                self.forget_block(b["id"])
+                self.block_data.remove(b)
+        self._expand_occurrences()  # 剩下的 virtual occurrence 跟著移除
+        self.save_schedule(immediate=True)
+        self.draw_blocks()
+
 
 
     def load_schedule(self, filename=None):
@@ -519,26 +944,28 @@ class ScheduleView(QGraphicsView):
             else:
                 filename = "schedule.json"
 
+        if self.store is not None:
+            log(f"🗄️ 使用排程資料庫 {self.store.db_path}，略過 {filename}")
+            self._load_from_store()
+            return
+
+        # ⛑️ 先把上一份排程還沒寫出的變更落地，避免寫進剛載入的檔案
+        self.writer.flush()
+        if self.scheduler is not None:
+            reply = self.scheduler.call("load", filename=filename)
+            if reply is not None and "blocks" in reply:
+                self._apply_remote_schedule(reply["blocks"])
+                log(f"📂 已從排程 daemon 載入 {reply.get('source')}")
+                return
+            log("⚠️ 排程 daemon 沒有回應，改直接讀檔（變更仍會送給 daemon）", level="WARNING")
         try:
-            with open(filename, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-                self.block_data = [
-                    {
-                        "qdate": QDate.fromString(b["qdate"], "yyyy-MM-dd"),
-                        "track_index": b["track_index"],
-                        "start_hour": b["start_hour"],
-                        "duration": b["duration"],
-                        "end_hour": b.get("end_hour", b["start_hour"] + b["duration"]),
-                        "end_qdate": QDate.fromString(b.get("end_qdate"), "yyyy-MM-dd") if b.get("end_qdate") else None,
-                        "label": b["label"],
-                        "id": b.get("id"),
-                        "encoder_name": b.get("encoder_name"),
-                        # "snapshot_path": b.get("snapshot_path", ""),
-                        "status": b.get("status", "")
-                    } for b in raw
-                ]
+            raw = read_schedule_file(filename)  # ✅ 主檔 + journal
+            self._set_schedule_rows(raw)
             self.remap_block_tracks()
+            self.writer.set_base(filename)
             self.draw_grid()
+            self.schedule_reloaded.emit()
+            self.schedule_changed.emit()
             log(f"📂 已載入節目排程 {filename}")
         except FileNotFoundError:
             log(f"🕘 無 {filename} 檔案，自動跳過載入。")
@@ -554,10 +981,10 @@ class ScheduleView(QGraphicsView):
             self.now_timer.stop()
         if hasattr(self, "global_timer"):
             self.global_timer.stop()
-        if hasattr(self, "_status_timer"):
-            self._status_timer.stop()
         if hasattr(self, "block_status_timer"):
             self.block_status_timer.stop()
+        self._horizon_timer.stop()
+        self.thumbnails.close()
         self._is_closing = True  # ✅ 告知背景回來時別再碰 UI
     def set_encoder_names(self, names):
         self.encoder_names = names
@@ -576,6 +1003,8 @@ class ScheduleView(QGraphicsView):
             name = block.get("encoder_name")
             track = block.get("track_index")
 
+            if block.get("virtual") and name not in self.encoder_names:
+                continue  # 規則展開出來的：encoder 回來後會重新展開，不必當孤兒
             if name:  # ➤ 若有 encoder_name
                 if name in self.encoder_names:
                     # ✅ encoder_name 合法，依名稱設定 track_index
@@ -596,6 +1025,8 @@ class ScheduleView(QGraphicsView):
 
         self.block_data = valid_blocks
         self.orphan_blocks = orphans
+        self.block_index.rebuild(self.block_data)
+        self._expand_occurrences()  # 軌道可能變了：重複排程依 encoder 名稱重新展開
     def restore_orphan_blocks(self):
         """Try to reattach orphan blocks to block_data when encoder returns."""
         if not self.orphan_blocks:
@@ -606,6 +1037,7 @@ class ScheduleView(QGraphicsView):
             if name in self.encoder_names:
                 block["track_index"] = self.encoder_names.index(name)
                 self.block_data.append(block)
+                self.touch_block(block)
                 log(f"🔄 恢復孤兒節目：{block['label']}")
             else:
                 remaining.append(block)
@@ -0,0 +1,302 @@
+# schedule_writer.py
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PySide6.QtCore import QDate, QObject, QTimer
+from utils import log, log_exception
+
+SAVE_DEBOUNCE_MS = 500   # 拖拉時最多每 500ms 寫一次檔
+FLUSH_TIMEOUT_S = 10
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_COMPACT_BYTES = 256 * 1024   # journal 超過這個大小就在背景合併回主檔
+
+# 單一執行緒：寫檔依送出順序完成，舊內容不會蓋掉新內容
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ScheduleWriter")
+
+
+def journal_path(filename):
+    return filename + JOURNAL_SUFFIX
+
+
+def write_json_atomic(filename, payload):
+    """先寫到同資料夾的暫存檔再 os.replace；寫到一半失敗（網路磁碟斷線）也不會留下半個檔。"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    tmp_path = os.path.join(directory, f".{os.path.basename(filename)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def serialize_block(b):
+    """block dict（QDate）➜ 可寫進 JSON 的 dict。"""
+    out = {
+        "qdate": b["qdate"].toString("yyyy-MM-dd"),
+        "track_index": b["track_index"],
+        "start_hour": b["start_hour"],
+        "duration": b["duration"],
+        "end_hour": b["end_hour"],
+        "end_qdate": (
+            b["end_qdate"].toString("yyyy-MM-dd") if isinstance(b["end_qdate"], QDate)
+            else b["end_qdate"]
+        ),
+        "label": b["label"],
+        "id": b.get("id"),
+        "encoder_name": b.get("encoder_name"),
+        "snapshot_path": b.get("snapshot_path", ""),
+        "status": b.get("status", "")
+    }
+    # 重複規則本身 / 由規則展開後另存的那一次（見 recurrence）
+    if b.get("recurrence"):
+        out["recurrence"] = b["recurrence"]
+    if b.get("rule_id"):
+        out["rule_id"] = b["rule_id"]
+    return out
+
+
+def block_from_json(b):
+    """serialize_block() 的反向：JSON dict ➜ block dict（QDate）。"""
+    block = {
+        "qdate": QDate.fromString(b["qdate"], "yyyy-MM-dd"),
+        "track_index": b["track_index"],
+        "start_hour": b["start_hour"],
+        "duration": b["duration"],
+        "end_hour": b.get("end_hour", b["start_hour"] + b["duration"]),
+        "end_qdate": QDate.fromString(b.get("end_qdate"), "yyyy-MM-dd") if b.get("end_qdate") else None,
+        "label": b["label"],
+        "id": b.get("id"),
+        "encoder_name": b.get("encoder_name"),
+        # "snapshot_path": b.get("snapshot_path", ""),
+        "status": b.get("status", "")
+    }
+    if b.get("recurrence"):
+        block["recurrence"] = b["recurrence"]
+    if b.get("rule_id"):
+        block["rule_id"] = b["rule_id"]
+    return block
+
+
+def read_schedule_file(filename):
+    """
+    讀主檔（JSON list）並依序重播 journal：
+    {"op": "put", "block": {...}} 新增/覆蓋，{"op": "del", "id": "..."} 刪除。
+    主檔不存在時丟 FileNotFoundError（與直接 open 相同）。
+    """
+    with open(filename, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    path = journal_path(filename)
+    if not os.path.exists(path):
+        return raw
+
+    order = [b.get("id") for b in raw]
+    by_id = {b.get("id"): b for b in raw if b.get("id")}
+    applied = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                log(f"⚠️ journal 有一筆不完整（寫入中途結束），已略過：{path}")
+                continue
+            if rec.get("op") == "put":
+                block = rec["block"]
+                if block.get("id") not in by_id:
+                    order.append(block.get("id"))
+                by_id[block.get("id")] = block
+            elif rec.get("op") == "del":
+                by_id.pop(rec.get("id"), None)
+            applied += 1
+
+    if applied:
+        log(f"📜 已套用 journal {applied} 筆：{path}")
+    no_id = [b for b in raw if not b.get("id")]
+    return no_id + [by_id[i] for i in order if i and i in by_id]
+
+
+class ScheduleWriter(QObject):
+    """
+    write-behind 存檔：
+    - mark_dirty() 只做標記，SAVE_DEBOUNCE_MS 內的多次變更合併成一次寫入
+    - touch()/forget() 記下哪些 block 改了，寫入時只在 journal 追加這幾筆（與排程大小無關）
+    - 不知道改了哪些（或換了檔案）時才寫完整主檔；journal 太大時在背景合併
+    - 主線程只負責整理資料，寫檔在背景執行緒
+    - flush() 同步寫完所有待寫內容（關閉程式、切換排程檔前呼叫）
+    - set_store() 後改寫進 ScheduleStore（SQLite），每筆變更就是一列 upsert/delete
+    """
+    def __init__(self, serialize_all, serialize_block, parent=None):
+        super().__init__(parent)
+        self._serialize_all = serialize_all        # () ➜ list（整份主檔）
+        self._serialize_block = serialize_block    # (block_id) ➜ dict；已不存在回 None
+        self._filename = None
+        self._base_filename = None   # 主檔 + journal 與記憶體內容一致的檔案
+        self._journal_bytes = 0
+        self._dirty = False
+        self._touched = {}           # {block_id: "put" | "del"}（保留順序）
+        self._needs_full = False     # 背景寫入失敗過：下次改寫完整主檔，避免漏掉那幾筆
+        self._pending = None         # 最近一次送出的 Future
+        self._store = None           # ScheduleStore；有設定就不寫 JSON
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(SAVE_DEBOUNCE_MS)
+        self._timer.timeout.connect(self._write_now)
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty
+
+    def set_store(self, store):
+        self.flush()
+        self._store = store
+
+    def set_base(self, filename):
+        """剛從 filename 載入：之後的變更可以直接追加到它的 journal。"""
+        self._base_filename = filename
+        self._touched.clear()
+        self._journal_bytes = 0
+        try:
+            with open(journal_path(filename), "rb") as f:
+                f.seek(0, os.SEEK_END)
+                self._journal_bytes = f.tell()
+                if self._journal_bytes:
+                    f.seek(-1, os.SEEK_END)
+                    # ⛑️ 最後一行沒寫完：再追加會黏在壞行後面，下次改寫完整主檔
+                    self._needs_full = f.read(1) != b"\n"
+        except OSError:
+            pass
+
+    def touch(self, block_id):
+        if block_id:
+            self._touched.pop(block_id, None)
+            self._touched[block_id] = "put"
+
+    def forget(self, block_id):
+        if block_id:
+            self._touched.pop(block_id, None)
+            self._touched[block_id] = "del"
+
+    def request_full(self):
+        """下次寫入改寫完整主檔（原子替換）：大批新增不會只寫進一半的 journal。資料庫本來就是單一交易。"""
+        if self._store is None:
+            self._needs_full = True
+
+    def mark_dirty(self, filename):
+        """排程有變更；計時器已在跑就不重設，確保拖拉中也會定期落地。"""
+        self._filename = filename
+        self._dirty = True
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def write_soon(self, filename):
+        """立即送出寫入（放開滑鼠、按下儲存），不等 debounce。"""
+        self._filename = filename
+        self._dirty = True
+        self._timer.stop()
+        self._write_now()
+
+    def _write_now(self):
+        if not self._dirty or not self._filename:
+            return
+        self._dirty = False
+        filename = self._filename
+        touched, self._touched = self._touched, {}
+        if self._store is not None:
+            self._submit_store(touched)
+            return
+        try:
+            if not touched or filename != self._base_filename or self._needs_full:
+                self._submit_full(filename)
+                return
+            records = []
+            for block_id, op in touched.items():
+                block = self._serialize_block(block_id) if op == "put" else None
+                if block is not None:
+                    records.append({"op": "put", "block": block})
+                else:
+                    records.append({"op": "del", "id": block_id})
+        except Exception as e:
+            log_exception(f"❌ 儲存失敗（整理排程資料）: {e}")
+            return
+
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        self._journal_bytes += len(data.encode("utf-8"))
+        self._pending = _write_executor.submit(self._append, filename, data, len(records))
+        if self._journal_bytes > JOURNAL_COMPACT_BYTES:
+            self._submit_full(filename)
+
+    def _submit_store(self, touched):
+        try:
+            if not touched or self._needs_full:
+                # 不知道改了哪些：把目前載入的範圍整批 upsert（刪除一定經過 forget()）
+                puts = self._serialize_all()
+            else:
+                puts = [b for b in (self._serialize_block(i) for i, op in touched.items() if op == "put") if b]
+            deletes = [i for i, op in touched.items() if op == "del"]
+        except Exception as e:
+            log_exception(f"❌ 儲存失敗（整理排程資料）: {e}")
+            return
+        self._needs_full = False
+        self._pending = _write_executor.submit(self._write_store, puts, deletes)
+
+    def _write_store(self, puts, deletes):
+        try:
+            self._store.apply(puts=puts, deletes=deletes)
+            log(f"✅ 已儲存節目排程：{self._store.db_path}（{len(puts)} 筆更新、{len(deletes)} 筆刪除）")
+        except Exception as e:
+            self._needs_full = True
+            log(f"❌ 儲存失敗: {e}", level="ERROR")
+
+    def _submit_full(self, filename):
+        """寫完整主檔並清空 journal（也就是合併）；整理資料在主線程，寫檔在背景。"""
+        payload = self._serialize_all()
+        self._needs_full = False
+        self._base_filename = filename
+        self._journal_bytes = 0
+        self._pending = _write_executor.submit(self._write_full, filename, payload)
+
+    def _append(self, filename, data, count):
+        try:
+            with open(journal_path(filename), "a", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+            log(f"✅ 已儲存節目排程：{filename}（journal +{count}）")
+        except Exception as e:
+            self._needs_full = True
+            log(f"❌ 儲存失敗: {e}", level="ERROR")
+
+    def _write_full(self, filename, payload):
+        try:
+            write_json_atomic(filename, payload)
+            # ✅ 主檔已包含所有變更，舊 journal 不再需要
+            try:
+                os.remove(journal_path(filename))
+            except FileNotFoundError:
+                pass
+            log(f"✅ 已儲存節目排程：{filename}")
+        except Exception as e:
+            self._needs_full = True
+            log(f"❌ 儲存失敗: {e}", level="ERROR")
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT_S):
+        """把尚未寫出的變更寫完並等待背景寫入結束。"""
+        self._timer.stop()
+        self._write_now()
+        fut = self._pending
+        if fut is None:
+            return
+        try:
+            fut.result(timeout=timeout)
+        except Exception as e:
+            log(f"⚠️ 等待排程寫入逾時：{e}", level="WARNING")
@@ -0,0 +1,796 @@
+# scheduler_daemon.py
+"""
+無介面的排程服務（python scheduler_daemon.py，工作目錄與 GUI 相同）：
+錄影開始/停止只由這個行程的計時器決定，不受 GUI 對話框、重繪或 processEvents 影響。
+GUI 在 config.json 設定 scheduler_socket 後，改以 scheduler_ipc.SchedulerClient 讀取排程、送出編輯。
+"""
+import json
+import os
+import signal
+import sys
+import types
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from PySide6.QtCore import QCoreApplication, QObject, QDate, QDateTime, QTime, QTimer, Signal
+from PySide6.QtNetwork import QLocalServer, QLocalSocket
+from block_index import BlockIntervalIndex
+from capture import take_snapshot_from_block
+from check_schedule_manager import CheckScheduleManager
+from encoder_status_service import EncoderStatusService
+from encoder_utils import send_encoder_command, list_encoders_with_alias, reload_encoder_config
+from path_manager import PathManager
+from schedule_store import ScheduleStore
+from schedule_writer import ScheduleWriter, read_schedule_file, serialize_block, block_from_json
+from scheduler_ipc import DEFAULT_SOCKET_NAME, IPC_VERSION, encode_message, read_messages
+from recurrence import is_rule, expand_rule, sync_occurrences, exclude_occurrence, report_clashes
+from utils import log, log_exception, reload_log_config, block_time_range
+
+CONFIG_FILE = "config.json"
+STORE_HORIZON_DAYS = 7            # SQLite 模式 / 重複排程：daemon 只載入（展開）今天起幾天內的節目
+STORE_REFRESH_MS = 60 * 60 * 1000 # SQLite 模式 / 重複排程：每小時把範圍往後延
+LOG_CONFIG_POLL_MS = 5000         # config.json 的 log 等級多久確認一次
+STOPPED_STATUS = "⏹ 停止中"
+
+
+def _conflict_summary(b):
+    """衝突報告裡的一筆（block dict 或資料庫列都可以）。"""
+    qdate = b.get("qdate")
+    if isinstance(qdate, QDate):
+        qdate = qdate.toString("yyyy-MM-dd")
+    return {"id": b.get("id"), "label": b.get("label"), "qdate": qdate, "start_hour": b.get("start_hour"),
+            "duration": b.get("duration"), "encoder_name": b.get("encoder_name")}
+
+
+class HeadlessRunner(QObject):
+    """
+    CheckScheduleManager 用的 runner（沒有 UI）：
+    - 與 ScheduleRunner 相同的 start_encoder()/stop_encoder() 介面，但送出後立即返回
+    - encoder 指令在背景執行；每台 encoder 一條執行緒，同一台的「先停再開」照順序送
+    - 結果經 finished(dict) 回到主線程
+    """
+    finished = Signal(dict)          # {"action", "encoder_name", "block_id", "ok"}
+    snapshotReady = Signal(str, str)  # block_id, 圖檔路徑（失敗為 ""）
+
+    def __init__(self, record_root, encoder_names, block_lookup, parent=None):
+        super().__init__(parent)
+        self.record_root = record_root
+        self.encoder_names = encoder_names
+        self.block_lookup = block_lookup   # (block_id) ➜ block dict 或 None
+        self.already_started = set()
+        self.already_stopped = set()
+        self._executors = {}               # {encoder_name: ThreadPoolExecutor(1)}
+        self._is_closing = False
+
+    def _executor(self, encoder_name):
+        executor = self._executors.get(encoder_name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"Encoder-{encoder_name}")
+            self._executors[encoder_name] = executor
+        return executor
+
+    def start_encoder(self, encoder_name, filename, status_label=None, block_id=None):
+        block = self.block_lookup(block_id) if block_id else None
+        # 用 block 的日期，避免跨日不一致（與 ScheduleRunner 相同）
+        base_date = block["qdate"] if block else QDate.currentDate()
+        date_folder = base_date.toString("MM.dd.yyyy")
+        date_prefix = base_date.toString("MMdd")
+        full_path = os.path.abspath(os.path.join(self.record_root, date_folder, f"{date_prefix}_{filename}"))
+        rel_path = os.path.relpath(full_path, start=self.record_root)
+
+        # ✅ 只在第一次啟動時拍照；capture 只需要這幾個屬性
+        snapshot_block = None
+        if block is not None and block_id not in self.already_started:
+            self.already_started.add(block_id)
+            snapshot_block = types.SimpleNamespace(
+                block_id=block_id, label=block["label"], start_date=base_date, track_index=block["track_index"]
+            )
+        self._executor(encoder_name).submit(
+            self._start, encoder_name, rel_path, block_id, snapshot_block, list(self.encoder_names)
+        )
+
+    def stop_encoder(self, encoder_name, status_label=None):
+        self._executor(encoder_name).submit(self._stop, encoder_name)
+
+    # --- 背景執行緒 ---
+    def _start(self, encoder_name, rel_path, block_id, snapshot_block, encoder_names):
+        ok = False
+        try:
+            res1 = send_encoder_command(encoder_name, f'Setfile "{encoder_name}" 1 "{rel_path}"')
+            if not res1.startswith("❌"):
+                res2 = send_encoder_command(encoder_name, f'Start "{encoder_name}" 1')
+                ok = "OK" in res1 and "OK" in res2
+        except Exception as e:
+            log_exception(f"❌ 啟動錄影失敗（{encoder_name}）：{e}")
+        self._emit_finished("start", encoder_name, block_id, ok)
+        if ok and snapshot_block is not None:
+            self._snapshot(snapshot_block, encoder_names)
+
+    def _stop(self, encoder_name):
+        ok = False
+        try:
+            ok = "OK" in send_encoder_command(encoder_name, f'Stop "{encoder_name}" 1')
+        except Exception as e:
+            log_exception(f"❌ 停止錄影失敗（{encoder_name}）：{e}")
+        self._emit_finished("stop", encoder_name, None, ok)
+
+    def _snapshot(self, block, encoder_names):
+        # ➤ 拍照指令在這條 encoder 執行緒送；等檔案出現在 capture 的執行緒，不擋住下一個指令
+        try:
+            future = take_snapshot_from_block(block, encoder_names, snapshot_root=self.record_root)
+        except Exception as e:
+            log(f"❌ snapshot error：{e}")
+            future = None
+        if future is None:
+            return
+
+        def done(fut, block_id=block.block_id):
+            try:
+                path = fut.result() or ""
+            except Exception as e:
+                log(f"⚠️ snapshot future error：{e}")
+                path = ""
+            if not self._is_closing:
+                try:
+                    self.snapshotReady.emit(block_id, path)
+                except RuntimeError:
+                    pass
+        future.add_done_callback(done)
+
+    def _emit_finished(self, action, encoder_name, block_id, ok):
+        if self._is_closing:
+            return
+        try:
+            self.finished.emit({"action": action, "encoder_name": encoder_name, "block_id": block_id, "ok": ok})
+        except RuntimeError:
+            pass
+
+    def close(self):
+        self._is_closing = True
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SchedulerDaemon(QObject):
+    """
+    scheduler 行程本體：
+    - 擁有排程資料（JSON 主檔 + journal，或 ScheduleStore），經 ScheduleWriter 寫回
+    - CheckScheduleManager 以精準計時器觸發開始/停止；本物件充當它的 parent_view
+      （提供 block_data / block_index / touch_block / save_schedule / update）
+    - QLocalServer 接受 GUI 連線，協定見 scheduler_ipc
+    - config.json 有 api_port 時另開本機 HTTP/WebSocket 控制 API（control_api；api_token 為共用金鑰）
+    """
+    eventBroadcast = Signal(dict)   # 送給 GUI 的每個事件（控制 API 的串流也轉送）
+
+    def __init__(self, config_file=CONFIG_FILE, parent=None):
+        super().__init__(parent)
+        self.config_file = config_file
+        config = self._read_config()
+        self.socket_name = config.get("scheduler_socket") or DEFAULT_SOCKET_NAME
+        self.path_manager = PathManager()
+        self.encoder_names = [name for name, _ in list_encoders_with_alias()]
+        self.block_data = []
+        self.orphan_blocks = []            # encoder 已不存在的節目：不排程，但存檔時保留
+        self.rules = {}                    # {rule_id: 重複規則}；occurrence 只展開 STORE_HORIZON_DAYS 內
+        self._reported_clashes = set()     # 展開時因重疊略過、已警告過的 occurrence id
+        self.block_index = BlockIntervalIndex()
+        self.schedule_file = None
+        self.store = None
+        self._store_until = None           # SQLite 模式：已載入到哪個時間點
+        self.writer = ScheduleWriter(self._serialize_all, self._serialize_block_by_id, parent=self)
+
+        self.runner = HeadlessRunner(self.path_manager.record_root, self.encoder_names, self.block_index.get, parent=self)
+        self.runner.finished.connect(self._on_runner_finished)
+        self.runner.snapshotReady.connect(self._on_snapshot_ready)
+        self.manager = CheckScheduleManager(
+            encoder_names=self.encoder_names,
+            encoder_status_dict={},
+            runner=self.runner,
+            parent_view_getter=lambda: self,
+        )
+
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self._on_new_connection)
+        self._clients = {}                 # {QLocalSocket: bytearray}（未完整的輸入）
+        self.status_service = None         # EncoderStatusService；開控制 API 時才輪詢 encoder 狀態
+        self.api = None
+
+        self._store_timer = QTimer(self)
+        self._store_timer.timeout.connect(self._extend_store_horizon)
+        self._store_timer.timeout.connect(self._expand_occurrences)
+        self._store_timer.start(STORE_REFRESH_MS)
+        self._config_timer = QTimer(self)
+        self._config_timer.timeout.connect(lambda: reload_log_config(self.config_file))
+        self._config_timer.start(LOG_CONFIG_POLL_MS)
+
+    def _read_config(self):
+        try:
+            with open(self.config_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            log(f"⚠️ config.json 載入失敗：{e}", level="WARNING")
+            return {}
+
+    # --- 排程資料 ---
+    def load(self, filename=None):
+        config = self._read_config()
+        db_path = config.get("schedule_db")
+        if db_path:
+            if self.store is None:
+                self.store = ScheduleStore(db_path)
+                if self.store.count() == 0:
+                    source = config.get("schedule_file") or "schedule.json"
+                    if os.path.exists(source):
+                        self.store.import_json(source)
+                self.writer.set_store(self.store)
+            self._load_from_store()
+        else:
+            filename = filename or config.get("schedule_file") or "schedule.json"
+            self.writer.flush()  # ⛑️ 上一份排程還沒寫出的先落地
+            try:
+                raw = read_schedule_file(filename)
+            except FileNotFoundError:
+                log(f"🕘 無 {filename} 檔案，從空排程開始。")
+                raw = []
+            self.schedule_file = filename
+            self.block_data = [block_from_json(b) for b in raw if not is_rule(b)]
+            self.rules = {b["id"]: block_from_json(b) for b in raw if is_rule(b) and b.get("id")}
+            self.orphan_blocks = []
+            self.writer.set_base(filename)
+            log(f"📂 已載入節目排程 {filename}（{len(self.block_data)} 筆、重複規則 {len(self.rules)} 條）")
+        self._remap_tracks()
+        self.manager.notify_schedule_changed()
+
+    def _load_from_store(self):
+        today_ts = QDateTime(QDate.currentDate(), QTime(0, 0)).toSecsSinceEpoch()
+        self._store_until = today_ts + STORE_HORIZON_DAYS * 86400
+        self.block_data = [block_from_json(r) for r in self.store.query_range(today_ts, self._store_until)]
+        self.rules = {r["id"]: block_from_json(r) for r in self.store.rules() if r.get("id")}
+        self.orphan_blocks = []
+        log(f"🗄️ 已從排程資料庫載入 {len(self.block_data)} 筆：{self.store.db_path}")
+
+    def _extend_store_horizon(self):
+        """SQLite 模式：把載入範圍延到「現在 + STORE_HORIZON_DAYS」，只加入記憶體裡還沒有的節目。"""
+        if self.store is None or self._store_until is None:
+            return
+        end_ts = QDateTime.currentSecsSinceEpoch() + STORE_HORIZON_DAYS * 86400
+        if end_ts <= self._store_until:
+            return
+        self.writer.flush()
+        added = 0
+        for r in self.store.query_range(self._store_until, end_ts):
+            if r.get("id") and self.block_index.get(r["id"]) is None:
+                self._add_block(block_from_json(r))
+                added += 1
+        self._store_until = end_ts  # 補進來的由 _add_block 逐筆通知排程器
+
+    def _remap_tracks(self):
+        """依 encoder_name 對應軌道（與 ScheduleView.remap_block_tracks 相同規則）；找不到的先當孤兒。"""
+        valid, orphans = [], []
+        for b in self.block_data + self.orphan_blocks:
+            if self._assign_track(b):
+                valid.append(b)
+            elif not b.get("virtual"):  # 規則展開的不當孤兒：encoder 回來後重新展開
+                orphans.append(b)
+        if orphans:
+            log(f"⚠️ {len(orphans)} 筆節目的 encoder 不存在，暫不排程", level="WARNING")
+        self.block_data = valid
+        self.orphan_blocks = orphans
+        self.block_index.rebuild(self.block_data)
+        self._expand_occurrences()
+
+    def _occurrence_ranges(self):
+        today_ts = QDateTime(QDate.currentDate(), QTime(0, 0)).toSecsSinceEpoch()
+        return [(today_ts, QDateTime.currentSecsSinceEpoch() + STORE_HORIZON_DAYS * 86400)]
+
+    def _expand_occurrences(self):
+        """重複規則只展開今天起 STORE_HORIZON_DAYS 天（排程器需要的範圍）。"""
+        data, added, removed, clashes = sync_occurrences(
+            self.block_data, self.block_index, self.rules, self._occurrence_ranges(), self.encoder_names
+        )
+        self.block_data[:] = data
+        report_clashes(clashes, self._reported_clashes)
+        if added or removed:
+            log(f"🔁 重複排程展開：新增 {added}、移除 {removed}（規則 {len(self.rules)} 條）", level="DEBUG")
+            if self.status_service is not None:
+                self.status_service.notify_schedule_changed()
+        if added or removed or self.rules:
+            self.manager.notify_schedule_changed()  # 規則改過的那幾次是原地更新（不算新增/移除），一樣要重算
+
+    def _rule_occurrences(self, start_ts, end_ts, track_index=None):
+        """重複規則在 [start_ts, end_ts) 內的所有 occurrence（不論是否已展開）。"""
+        found = []
+        for rule in self.rules.values():
+            name = rule.get("encoder_name")
+            if name not in self.encoder_names:
+                continue
+            if track_index is not None and self.encoder_names.index(name) != track_index:
+                continue
+            found.extend(expand_rule(rule, start_ts, end_ts))
+        return found
+
+    def _assign_track(self, b) -> bool:
+        name = b.get("encoder_name")
+        if name:
+            if name not in self.encoder_names:
+                return False
+            b["track_index"] = self.encoder_names.index(name)
+            return True
+        track = b.get("track_index")
+        if isinstance(track, int) and 0 <= track < len(self.encoder_names):
+            b["encoder_name"] = self.encoder_names[track]
+            return True
+        return False
+
+    def _add_block(self, b):
+        if self._assign_track(b):
+            self.block_data.append(b)
+            self.block_index.upsert(b)
+            self.manager.notify_changed([b.get("id")])
+        else:
+            self.orphan_blocks.append(b)
+
+    def _upsert_json(self, raw) -> bool:
+        """套用一筆 block JSON；是重複規則時回 True（呼叫端要重新展開）。"""
+        if is_rule(raw):
+            if raw.get("id"):
+                self.rules[raw["id"]] = block_from_json(raw)
+                self.writer.touch(raw["id"])
+            return True
+        self._apply_block(block_from_json(raw))
+        return False
+
+    def _apply_block(self, b):
+        block_id = b.get("id")
+        if not block_id:
+            return
+        old = self.block_index.get(block_id)
+        if old is None:
+            self.orphan_blocks = [o for o in self.orphan_blocks if o.get("id") != block_id]
+            self._add_block(b)
+        else:
+            old.update(b)
+            old.pop("virtual", None)  # 重複排程的某一次被修改：從此當一般 block 存檔
+            if not self._assign_track(old):
+                self.block_data.remove(old)
+                self.block_index.remove(block_id)
+                self.orphan_blocks.append(old)
+                self.manager.notify_removed([block_id])
+                return
+            self.block_index.upsert(old)
+            self.manager.notify_changed([block_id])
+        self.writer.touch(block_id)
+
+    def _delete(self, block_id):
+        """
+        刪除一筆；回傳因此改變的重複規則 id（刪整條規則，或刪掉其中一次而加了 exdate），否則 None。
+        """
+        if self.rules.pop(block_id, None) is not None:
+            self.writer.forget(block_id)
+            return block_id
+        b = self.block_index.get(block_id)
+        rule = self.rules.get(b.get("rule_id")) if b is not None else None
+        if rule is not None:
+            exclude_occurrence(rule, block_id)  # ✅ 那天不再展開
+            self.writer.touch(rule["id"])
+        self.block_data = [b for b in self.block_data if b.get("id") != block_id]
+        self.orphan_blocks = [b for b in self.orphan_blocks if b.get("id") != block_id]
+        self.block_index.remove(block_id)
+        self.writer.forget(block_id)
+        self.manager.notify_removed([block_id])
+        return rule["id"] if rule is not None else None
+
+    def _serialize_all(self):
+        # ✅ 重複規則只存規則本身；未修改過的 occurrence（virtual）不存
+        return [serialize_block(b) for b in self.block_data + self.orphan_blocks if not b.get("virtual")] + \
+            [serialize_block(r) for r in self.rules.values()]
+
+    def _serialize_block_by_id(self, block_id):
+        b = self.block_index.get(block_id)
+        if b is None:
+            b = self.rules.get(block_id)
+        if b is None:
+            b = next((o for o in self.orphan_blocks if o.get("id") == block_id), None)
+        return serialize_block(b) if b is not None else None
+
+    # --- 批次操作（控制 API、EPG 匯入共用） ---
+    def _normalize_input(self, raw, base=None):
+        """
+        外部傳入的 block JSON ➜ 完整的 block dict；更新時 raw 可只含要改的欄位（base 為原本的 block）。
+        欄位不合法丟 ValueError。
+        """
+        if not isinstance(raw, dict):
+            raise ValueError("block 必須是 JSON 物件")
+        merged = {**(serialize_block(base) if base is not None else {}), **raw}
+        if "track_index" in raw and "encoder_name" not in raw:
+            merged["encoder_name"] = None  # 只改軌道：以 track_index 為準
+        try:
+            qdate = QDate.fromString(str(merged["qdate"]), "yyyy-MM-dd")
+            start_hour = float(merged["start_hour"])
+            duration = float(merged["duration"])
+        except KeyError as e:
+            raise ValueError(f"缺少欄位 {e.args[0]}")
+        except (TypeError, ValueError):
+            raise ValueError("start_hour / duration 必須是數字")
+        if not qdate.isValid():
+            raise ValueError("qdate 格式須為 yyyy-MM-dd")
+        if not 0 <= start_hour < 24:
+            raise ValueError("start_hour 須介於 0~24")
+        if duration <= 0:
+            raise ValueError("duration 必須大於 0")
+
+        name, track = merged.get("encoder_name"), merged.get("track_index")
+        if name:
+            if name not in self.encoder_names:
+                raise ValueError(f"沒有這台 encoder：{name}")
+            track = self.encoder_names.index(name)
+        elif isinstance(track, int) and 0 <= track < len(self.encoder_names):
+            name = self.encoder_names[track]
+        else:
+            raise ValueError("需要有效的 encoder_name 或 track_index")
+
+        # 與 ScheduleView.add_time_block 相同的欄位
+        end_hour = round(start_hour + duration, 4)
+        return {
+            "qdate": qdate,
+            "track_index": track,
+            "start_hour": start_hour,
+            "duration": duration,
+            "end_hour": end_hour,
+            "end_qdate": qdate.addDays(1) if end_hour >= 24 else qdate,
+            "label": str(merged.get("label") or "節目"),
+            "id": str(merged.get("id") or uuid.uuid4()),
+            "encoder_name": name,
+            "snapshot_path": merged.get("snapshot_path") or "",
+            "status": merged.get("status") or "",
+        }
+
+    def _batch_conflicts(self, scratch, b, touched_ids):
+        """b 在 scratch（套用本批前面幾筆後的索引）裡與哪些節目重疊；SQLite 模式下載入範圍外的也查資料庫。"""
+        start_ts, end_ts = block_time_range(b)
+        hits = scratch.overlaps(b["track_index"], start_ts, end_ts, exclude_id=b["id"])
+        if self.store is not None:
+            for r in self.store.overlaps(b["track_index"], start_ts, end_ts, exclude_id=b["id"]):
+                # 記憶體裡有的（或本批改過/刪掉的）以 scratch 為準
+                if r["id"] not in touched_ids and self.block_index.get(r["id"]) is None:
+                    hits.append(r)
+        # ➤ 重複排程在展開範圍外的那幾次
+        for o in self._rule_occurrences(start_ts, end_ts, b["track_index"]):
+            if o["id"] != b["id"] and o["id"] not in touched_ids and self.block_index.get(o["id"]) is None:
+                hits.append(o)
+        return [_conflict_summary(h) for h in hits]
+
+    def apply_batch(self, add=(), update=(), delete=(), atomic=True, dry_run=False):
+        """
+        批次新增/修改/刪除，先整批檢查再套用：
+        - 順序為刪除 ➜ 修改 ➜ 新增，所以同一批可以「刪掉整天再重排」
+        - 每筆檢查欄位與同軌重疊（現有節目與同一批前面的節目都算）
+        - atomic=True：有任何一筆被拒絕就整批不套用；False：只套用通過的
+        - dry_run=True：只回報告不套用
+        回傳 {"applied", "added", "updated", "deleted", "rejected": [{"op", "index", "id", "label", "reason", "conflicts"}]}
+        """
+        if self.store is not None:
+            self.writer.flush()  # ⛑️ 待寫的先進資料庫，重疊檢查才看得到
+        scratch = BlockIntervalIndex()
+        scratch.rebuild(self.block_data)
+        touched_ids = set()
+        plan, rejected = [], []
+
+        def reject(op, index, raw, reason, conflicts=(), base=None):
+            raw = raw if isinstance(raw, dict) else {"id": raw}
+            label = raw.get("label") or (base or {}).get("label")
+            rejected.append({"op": op, "index": index, "id": raw.get("id"), "label": label,
+                             "reason": reason, "conflicts": list(conflicts)})
+
+        for i, block_id in enumerate(delete):
+            if scratch.get(block_id) is None:
+                reject("delete", i, block_id, "找不到節目")
+                continue
+            scratch.remove(block_id)
+            touched_ids.add(block_id)
+            plan.append(("delete", block_id))
+
+        for op, items in (("update", update), ("add", add)):
+            for i, raw in enumerate(items):
+                block_id = raw.get("id") if isinstance(raw, dict) else None
+                base = scratch.get(block_id) if block_id else None
+                if op == "update" and base is None:
+                    reject(op, i, raw, "找不到節目（或不在 daemon 載入範圍內）")
+                    continue
+                if op == "add" and base is not None:
+                    reject(op, i, raw, "id 已存在")
+                    continue
+                try:
+                    b = self._normalize_input(raw, base)
+                except ValueError as e:
+                    reject(op, i, raw, str(e), base=base)
+                    continue
+                conflicts = self._batch_conflicts(scratch, b, touched_ids)
+                if conflicts:
+                    reject(op, i, raw, "與其他節目重疊", conflicts, base=base)
+                    continue
+                scratch.upsert(b)
+                touched_ids.add(b["id"])
+                plan.append((op, b))
+
+        counts = {"add": 0, "update": 0, "delete": 0}
+        applied = not dry_run and not (atomic and rejected)
+        if applied and plan:
+            deleted, put, rules_changed = [], [], set()
+            for op, item in plan:
+                if op == "delete":
+                    rule_id = self._delete(item)
+                    if rule_id is not None:
+                        rules_changed.add(rule_id)
+                    deleted.append(item)
+                else:
+                    self._apply_block(item)
+                    put.append(item["id"])
+                counts[op] += 1
+            if rules_changed:
+                self._expand_occurrences()
+                put.extend(i for i in rules_changed if i in self.rules)  # GUI 也要拿到新的 exdates
+            self.save_schedule()  # 排程器已由 _apply_block / _delete 逐筆通知
+            if self.status_service is not None:
+                self.status_service.notify_schedule_changed()
+            if deleted:
+                self._broadcast({"event": "delete", "ids": deleted})
+            if put:
+                self._broadcast({"event": "put", "blocks": [self._serialize_block_by_id(i) for i in put]})
+            log(f"📦 批次排程：新增 {counts['add']}、修改 {counts['update']}、刪除 {counts['delete']}、拒絕 {len(rejected)}")
+        elif rejected:
+            log(f"⚠️ 批次排程未套用：{len(rejected)} 筆被拒絕", level="WARNING")
+        return {"applied": applied, "dry_run": dry_run, "added": counts["add"], "updated": counts["update"],
+                "deleted": counts["delete"], "planned": len(plan), "rejected": rejected}
+
+    def query_range(self, start_ts, end_ts, track_index=None):
+        """與 [start_ts, end_ts) 重疊的節目（JSON 格式，依開始時間排序）。"""
+        if self.store is not None:
+            self.writer.flush()
+            rows = self.store.query_range(start_ts, end_ts, track_index=track_index)
+        else:
+            if track_index is not None:
+                blocks = self.block_index.overlaps(track_index, start_ts, end_ts)
+            else:
+                blocks = self.block_index.in_range(start_ts, end_ts)
+            rows = [serialize_block(b) for b in blocks]
+        # ➤ 重複排程：範圍內還沒展開（或 SQLite 模式不在資料庫裡）的那幾次也列出來
+        ids = {r["id"] for r in rows}
+        for o in self._rule_occurrences(start_ts, end_ts, track_index):
+            known = self.block_index.get(o["id"])
+            if o["id"] not in ids and (known is None or known.get("virtual")):
+                rows.append(serialize_block(o))
+        rows.sort(key=lambda r: (block_time_range(r)[0], r["track_index"]))
+        return rows
+
+    # --- CheckScheduleManager 的 parent_view 介面 ---
+    def touch_block(self, b, materialize=True):
+        """同 ScheduleView.touch_block：materialize=False 只是執行狀態變了，重複排程的某一次仍不存檔。"""
+        if materialize:
+            b.pop("virtual", None)
+        self.block_index.upsert(b)
+        if not b.get("virtual"):
+            self.writer.touch(b.get("id"))
+        self.manager.notify_changed([b.get("id")])
+
+    def save_schedule(self):
+        self.writer.mark_dirty(self.schedule_file or "schedule.json")
+
+    def update(self):
+        """動作套用後的重繪：daemon 沒有畫面，狀態改由 _on_runner_finished 推給 GUI。"""
+
+    # --- runner 結果 ---
+    def _on_runner_finished(self, result):
+        action, encoder_name, ok = result["action"], result["encoder_name"], result["ok"]
+        if not ok:
+            log(f"❌ 自動{'開始' if action == 'start' else '停止'}錄影失敗：{encoder_name}",
+                level="ERROR", encoder=encoder_name, block_id=result.get("block_id"), command=action)
+        self._broadcast({"event": "fired", **result})
+        if action != "stop" or not ok or encoder_name not in self.encoder_names:
+            return
+
+        # ✅ 與 ScheduleRunner.stop_encoder 相同：這條軌道上正在進行的節目標記為停止
+        track = self.encoder_names.index(encoder_name)
+        now_ts = QDateTime.currentSecsSinceEpoch()
+        for b in self.block_index.overlaps(track, now_ts - 1, now_ts + 1):
+            start_ts, _ = block_time_range(b)
+            if start_ts >= now_ts:
+                continue  # 接檔、正要開始的下一檔
+            b["status"] = STOPPED_STATUS
+            self.runner.already_stopped.add(b.get("id"))
+            self.touch_block(b, materialize=False)
+            self._broadcast({"event": "status", "id": b.get("id"), "status": STOPPED_STATUS})
+        self.save_schedule()
+
+    def _on_snapshot_ready(self, block_id, path):
+        self._broadcast({"event": "snapshot", "id": block_id, "path": path})
+
+    def reload_config(self):
+        """GUI 改了 encoder 清單或錄影路徑後呼叫：重新讀設定並重新對應軌道。"""
+        reload_log_config(self.config_file)
+        reload_encoder_config()
+        self.encoder_names[:] = [name for name, _ in list_encoders_with_alias()]  # ✅ runner / manager 共用同一個 list
+        self.path_manager = PathManager()
+        self.runner.record_root = self.path_manager.record_root
+        self._remap_tracks()
+        self.manager.notify_schedule_changed()
+        if self.status_service is not None:
+            self.status_service.set_encoder_names(self.encoder_names)
+        self._broadcast({"event": "config", "encoders": list(self.encoder_names)})
+        log(f"🔁 已重新載入設定：{len(self.encoder_names)} 台 encoder，錄影路徑 {self.runner.record_root}")
+
+    # --- IPC ---
+    def start(self) -> bool:
+        probe = QLocalSocket()
+        probe.connectToServer(self.socket_name)
+        if probe.waitForConnected(200):
+            probe.abort()
+            log(f"❌ 已有排程 daemon 在執行：{self.socket_name}", level="ERROR")
+            return False
+        QLocalServer.removeServer(self.socket_name)  # ⛑️ 上次異常結束留下的 socket 檔
+        if not self.server.listen(self.socket_name):
+            log(f"❌ 無法建立 IPC：{self.server.errorString()}", level="ERROR")
+            return False
+        log(f"🛰️ 排程 daemon 已啟動：{self.socket_name}（{len(self.block_data)} 筆節目）")
+        return True
+
+    def start_api(self, port) -> bool:
+        """開本機 HTTP/WebSocket 控制 API；同時開始輪詢 encoder 狀態供串流。"""
+        from control_api import ControlApiServer  # 沒開 API 時不需要 QtWebSockets
+        self.status_service = EncoderStatusService(self.encoder_names, parent=self)
+        self.status_service.set_schedule_source(lambda: self.block_data)
+        token = self._read_config().get("api_token")
+        self.api = ControlApiServer(self, token=str(token) if token else None, parent=self)
+        return self.api.listen(port)
+
+    @property
+    def client_count(self) -> int:
+        return len(self._clients)
+
+    def _on_new_connection(self):
+        while self.server.hasPendingConnections():
+            sock = self.server.nextPendingConnection()
+            self._clients[sock] = bytearray()
+            sock.readyRead.connect(lambda s=sock: self._on_client_ready(s))
+            sock.disconnected.connect(lambda s=sock: self._on_client_gone(s))
+            log("🔌 GUI 已連線（共 %d 個）", len(self._clients), level="DEBUG")
+
+    def _on_client_gone(self, sock):
+        self._clients.pop(sock, None)
+        sock.deleteLater()
+        log("🔌 GUI 已斷線（剩 %d 個）", len(self._clients), level="DEBUG")
+
+    def _on_client_ready(self, sock):
+        buffer = self._clients.get(sock)
+        if buffer is None:
+            return
+        for msg in read_messages(sock, buffer):
+            op = msg.get("op")
+            try:
+                reply = self._handle(sock, op, msg) or {}
+            except Exception as e:
+                log_exception(f"❌ 處理 IPC 指令失敗（{op}）：{e}")
+                reply = {"error": str(e)}
+            if "req" in msg:
+                sock.write(encode_message({"reply": op, "req": msg["req"], **reply}))
+
+    def _handle(self, sock, op, msg):
+        if op == "hello":
+            return {"version": IPC_VERSION, "pid": os.getpid()}
+        if op == "load":
+            filename = msg.get("filename")
+            if self.store is None and filename and filename != self.schedule_file:
+                self.load(filename)
+                self._broadcast({"event": "schedule", "blocks": self._serialize_all()}, exclude=sock)
+            source = self.store.db_path if self.store is not None else self.schedule_file
+            return {"blocks": self._serialize_all(), "source": source}
+        if op == "put":
+            # ⛑️ 每筆各自 try：一筆格式錯誤不影響其他筆，已套用的照樣存檔、通知排程器與其他 GUI
+            ids, errors, rules_changed = [], [], False
+            for raw in msg.get("blocks") or []:
+                try:
+                    rules_changed = self._upsert_json(raw) or rules_changed
+                    ids.append(raw.get("id"))
+                except Exception as e:
+                    errors.append(self._entry_error(op, raw, e))
+            if rules_changed:
+                self._expand_occurrences()
+            stored = [b for b in (self._serialize_block_by_id(i) for i in ids if i) if b]
+            self._after_edit(sock, {"event": "put", "blocks": stored})
+            return {"count": len(ids), "errors": errors}
+        if op == "delete":
+            ids, errors, rules_changed = [], [], False
+            for block_id in msg.get("ids") or []:
+                try:
+                    rules_changed = self._delete(block_id) is not None or rules_changed
+                    ids.append(block_id)
+                except Exception as e:
+                    errors.append(self._entry_error(op, block_id, e))
+            if rules_changed:
+                self._expand_occurrences()
+            self._after_edit(sock, {"event": "delete", "ids": ids})
+            return {"count": len(ids), "errors": errors}
+        if op == "batch":
+            # ✅ EPG 匯入：以 daemon 這份（最新的）排程檢查重疊；套用的由 apply_batch 廣播 put 給所有 GUI
+            return self.apply_batch(
+                add=msg.get("add") or [], update=msg.get("update") or [], delete=msg.get("delete") or [],
+                atomic=bool(msg.get("atomic", True)), dry_run=bool(msg.get("dry_run", False)),
+            )
+        if op == "flush":
+            # ⛑️ GUI 要直接讀資料庫：同一條連線上先前的 put/delete 已套用，這裡把 debounce 中的寫完再回覆
+            self.writer.flush()
+            return {}
+        if op == "mark_started":
+            # GUI 手動開始：排程器到點時不再重送開始
+            self.manager.already_started.add(msg.get("id"))
+            self.runner.already_started.add(msg.get("id"))
+            return {}
+        if op == "reload_config":
+            self.reload_config()
+            return {}
+        raise ValueError(f"未知的 IPC 指令：{op}")
+
+    @staticmethod
+    def _entry_error(op, raw, e):
+        block_id = raw.get("id") if isinstance(raw, dict) else raw
+        log(f"⚠️ IPC {op} 略過一筆：{e}", level="WARNING", block_id=block_id)
+        return {"id": block_id, "reason": str(e)}
+
+    def _after_edit(self, sock, event):
+        self.save_schedule()  # 排程器已由 _apply_block / _delete 逐筆通知；重複規則改了的由 _expand_occurrences 完整比對
+        if self.status_service is not None:
+            self.status_service.notify_schedule_changed()
+        self._broadcast(event, exclude=sock)  # ✅ 其他 GUI 也看到變更；送出者自己已經有了
+
+    def _broadcast(self, msg, exclude=None):
+        self.eventBroadcast.emit(msg)
+        if not self._clients:
+            return
+        data = encode_message(msg)
+        for sock in list(self._clients):
+            if sock is not exclude and sock.state() == QLocalSocket.ConnectedState:
+                sock.write(data)
+
+    def shutdown(self):
+        self.manager.stop()
+        if self.status_service is not None:
+            self.status_service.stop()
+        if self.api is not None:
+            self.api.close()
+        self._store_timer.stop()
+        self._config_timer.stop()
+        self.writer.flush()  # ✅ 把 debounce 中的排程寫完再結束
+        self.runner.close()
+        self.server.close()
+        if self.store is not None:
+            self.store.close()
+        log("👋 排程 daemon 已結束")
+
+
+def main():
+    app = QCoreApplication(sys.argv)
+    reload_log_config(CONFIG_FILE)
+    daemon = SchedulerDaemon()
+    try:
+        daemon.load()
+    except Exception as e:
+        log_exception(f"❌ 載入排程失敗：{e}")
+        return 1
+    if not daemon.start():
+        return 1
+    api_port = daemon._read_config().get("api_port")
+    if api_port and not daemon.start_api(int(api_port)):
+        log("⚠️ 控制 API 未啟動，排程照常執行", level="WARNING")
+    app.aboutToQuit.connect(daemon.shutdown)
+
+    # ✅ Ctrl+C / 服務停止時正常結束（先寫完排程）
+    signal.signal(signal.SIGINT, lambda *_: app.quit())
+    signal.signal(signal.SIGTERM, lambda *_: app.quit())
+    # Python 的 signal handler 只在執行 Python 程式碼時才會跑：定期回到直譯器一下
+    wakeup = QTimer()
+    wakeup.timeout.connect(lambda: None)
+    wakeup.start(500)
+    return app.exec()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+# scheduler_ipc.py
+import itertools
+import json
+from PySide6.QtCore import QObject, QTimer, QElapsedTimer, Signal
+from PySide6.QtNetwork import QLocalSocket
+from schedule_writer import SAVE_DEBOUNCE_MS
+from utils import log, log_exception
+
+DEFAULT_SOCKET_NAME = "recorder-scheduler"   # config.json 沒有 scheduler_socket 時 daemon 用的名稱
+IPC_VERSION = 1
+CONNECT_TIMEOUT_MS = 1000
+CALL_TIMEOUT_MS = 5000       # 同步請求（載入排程）最多等多久
+BATCH_TIMEOUT_MS = 60000     # 批次新增（EPG 匯入）：daemon 逐筆檢查重疊，等久一點
+RECONNECT_MS = 5000          # 斷線後多久重連一次
+
+# ➤ 協定：一行一個 UTF-8 JSON
+#   請求 {"op": ..., "req": n, ...}（有 req 才回覆 {"reply": op, "req": n, ...}）
+#     hello / load(filename) / put(blocks) / delete(ids) / mark_started(id) / reload_config
+#     batch(add, update, delete, atomic, dry_run)：同 SchedulerDaemon.apply_batch，回覆其報告
+#     flush：daemon 把 debounce 中的排程寫進檔案/資料庫後才回覆（GUI 直接讀資料庫前用）
+#   事件（daemon ➜ GUI）{"event": ...}
+#     put(blocks) / delete(ids) / schedule(blocks) / status(id, status) / fired(...) / snapshot(id, path)
+
+
+def encode_message(msg) -> bytes:
+    return (json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def read_messages(sock, buffer: bytearray):
+    """把 sock 目前可讀的資料接到 buffer 後，切出所有完整的訊息；不完整的留在 buffer。"""
+    buffer += bytes(sock.readAll().data())
+    messages = []
+    while True:
+        end = buffer.find(b"\n")
+        if end < 0:
+            break
+        line = bytes(buffer[:end])
+        del buffer[:end + 1]
+        if not line.strip():
+            continue
+        try:
+            messages.append(json.loads(line))
+        except ValueError:
+            log("⚠️ IPC 收到無法解析的訊息：%r", line[:200], level="WARNING")
+    return messages
+
+
+class SchedulerClient(QObject):
+    """
+    GUI 端連到 scheduler_daemon 的本機 IPC（QLocalSocket）：
+    - call() 同步等回覆（只在啟動、切換排程檔時用）；send() 不等
+    - daemon 推來的事件轉成 signal
+    - 斷線後每 RECONNECT_MS 重連一次
+    """
+    blocksPut = Signal(list)            # [block JSON]
+    blocksDeleted = Signal(list)        # [block_id]
+    scheduleReplaced = Signal(list)     # daemon 換了排程檔：整份 block JSON
+    statusChanged = Signal(str, str)    # block_id, status
+    actionFired = Signal(dict)          # {"action", "encoder_name", "block_id", "ok"}
+    snapshotReady = Signal(str, str)    # block_id, 圖檔路徑（失敗為 ""）
+    connectionChanged = Signal(bool)
+
+    def __init__(self, name=DEFAULT_SOCKET_NAME, parent=None):
+        super().__init__(parent)
+        self.name = name
+        self._socket = QLocalSocket(self)
+        self._socket.readyRead.connect(self._on_ready_read)
+        self._socket.disconnected.connect(self._on_disconnected)
+        self._buffer = bytearray()
+        self._req = itertools.count(1)
+        self._replies = {}           # {req: reply}
+        self._connected = False
+        self._is_closing = False
+
+        self._reconnect_timer = QTimer(self)
+        self._reconnect_timer.setSingleShot(True)
+        self._reconnect_timer.setInterval(RECONNECT_MS)
+        self._reconnect_timer.timeout.connect(self._reconnect)
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    def connect_to_daemon(self, timeout_ms: int = CONNECT_TIMEOUT_MS) -> bool:
+        self._socket.abort()
+        self._buffer.clear()
+        self._socket.connectToServer(self.name)
+        if not self._socket.waitForConnected(timeout_ms):
+            return False
+        reply = self.call("hello", version=IPC_VERSION)
+        if reply is None or reply.get("version") != IPC_VERSION:
+            log(f"⚠️ 排程 daemon 版本不符或沒有回應：{reply}", level="WARNING")
+            self._socket.abort()
+            return False
+        self._connected = True
+        self.connectionChanged.emit(True)
+        return True
+
+    def call(self, op, timeout_ms: int = CALL_TIMEOUT_MS, **payload):
+        """送出請求並等回覆；逾時或斷線回 None。期間收到的事件照常發 signal。"""
+        req = next(self._req)
+        if not self._write({"op": op, "req": req, **payload}):
+            return None
+        clock = QElapsedTimer()
+        clock.start()
+        while req not in self._replies:
+            remaining = timeout_ms - clock.elapsed()
+            if remaining <= 0 or self._socket.state() != QLocalSocket.ConnectedState:
+                break
+            if self._socket.waitForReadyRead(int(remaining)):
+                self._on_ready_read()
+        return self._replies.pop(req, None)
+
+    def send(self, op, **payload) -> bool:
+        """不等回覆；沒有連線時回 False。"""
+        return self._connected and self._write({"op": op, **payload})
+
+    def _write(self, msg) -> bool:
+        if self._socket.state() != QLocalSocket.ConnectedState:
+            return False
+        self._socket.write(encode_message(msg))
+        return True
+
+    def flush(self, timeout_ms: int = CALL_TIMEOUT_MS):
+        """等已送出的資料寫進 socket（關閉程式前呼叫）。"""
+        if self._socket.state() == QLocalSocket.ConnectedState and self._socket.bytesToWrite():
+            self._socket.waitForBytesWritten(timeout_ms)
+
+    def _on_ready_read(self):
+        for msg in read_messages(self._socket, self._buffer):
+            if "reply" in msg:
+                self._replies[msg.get("req")] = msg
+                continue
+            try:
+                self._dispatch(msg)
+            except Exception as e:
+                log_exception(f"❌ 處理 daemon 事件失敗（{msg.get('event')}）：{e}")
+
+    def _dispatch(self, msg):
+        event = msg.get("event")
+        if event == "put":
+            self.blocksPut.emit(msg.get("blocks") or [])
+        elif event == "delete":
+            self.blocksDeleted.emit(msg.get("ids") or [])
+        elif event == "schedule":
+            self.scheduleReplaced.emit(msg.get("blocks") or [])
+        elif event == "status":
+            self.statusChanged.emit(msg.get("id") or "", msg.get("status") or "")
+        elif event == "fired":
+            self.actionFired.emit(msg)
+        elif event == "snapshot":
+            self.snapshotReady.emit(msg.get("id") or "", msg.get("path") or "")
+
+    def _on_disconnected(self):
+        if not self._connected:
+            return
+        self._connected = False
+        self.connectionChanged.emit(False)
+        if not self._is_closing:
+            log(f"❌ 與排程 daemon（{self.name}）斷線，{RECONNECT_MS // 1000} 秒後重連", level="ERROR")
+            self._reconnect_timer.start()
+
+    def _reconnect(self):
+        if self._is_closing:
+            return
+        if self.connect_to_daemon():
+            log(f"🔌 已重新連上排程 daemon：{self.name}")
+        else:
+            self._reconnect_timer.start()
+
+    def close(self):
+        self._is_closing = True
+        self._reconnect_timer.stop()
+        self.flush()
+        self._connected = False
+        self._socket.disconnectFromServer()
+
+
+class RemoteScheduleWriter(QObject):
+    """
+    與 ScheduleWriter 相同介面，但變更送給 scheduler_daemon（由 daemon 寫檔/資料庫並排程）：
+    - touch()/forget() 記下改了哪些；SAVE_DEBOUNCE_MS 後只送這幾筆
+    - 不知道改了哪些時送出目前載入的全部（upsert；刪除一定經過 forget()）
+    - 斷線時保留待送內容，重連後補送
+    """
+    def __init__(self, client, serialize_all, serialize_block, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self._serialize_all = serialize_all
+        self._serialize_block = serialize_block
+        self._dirty = False
+        self._touched = {}           # {block_id: "put" | "del"}（保留順序）
+        self._store = None           # GUI 也直接讀的 ScheduleStore；有的話 flush() 要等 daemon 寫完
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(SAVE_DEBOUNCE_MS)
+        self._timer.timeout.connect(self._write_now)
+        client.connectionChanged.connect(self._on_connection_changed)
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty
+
+    def set_store(self, store):
+        """資料庫由 daemon 寫；GUI 只讀（記下來，flush() 才知道要等 daemon 落地）。"""
+        self._store = store
+
+    def set_base(self, filename):
+        self._touched.clear()
+
+    def touch(self, block_id):
+        if block_id:
+            self._touched.pop(block_id, None)
+            self._touched[block_id] = "put"
+
+    def forget(self, block_id):
+        if block_id:
+            self._touched.pop(block_id, None)
+            self._touched[block_id] = "del"
+
+    def request_full(self):
+        """一批變更本來就是一則 put 訊息，由 daemon 一次套用。"""
+
+    def mark_dirty(self, filename):
+        self._dirty = True
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def write_soon(self, filename):
+        self._dirty = True
+        self._timer.stop()
+        self._write_now()
+
+    def _write_now(self):
+        if not self._dirty or not self.client.connected:
+            return  # ➤ 斷線中：重連後 _on_connection_changed 補送
+        touched = self._touched
+        try:
+            if touched:
+                puts = [b for b in (self._serialize_block(i) for i, op in touched.items() if op == "put") if b]
+            else:
+                puts = self._serialize_all()
+            deletes = [i for i, op in touched.items() if op == "del"]
+        except Exception as e:
+            log_exception(f"❌ 儲存失敗（整理排程資料）: {e}")
+            return
+        if (puts and not self.client.send("put", blocks=puts)) or \
+                (deletes and not self.client.send("delete", ids=deletes)):
+            return  # 送到一半斷線：整批留到重連再送（put 重送無妨）
+        self._dirty = False
+        self._touched = {}
+
+    def _on_connection_changed(self, connected):
+        if connected and self._dirty:
+            self._write_now()
+
+    def flush(self, timeout: float = CALL_TIMEOUT_MS / 1000):
+        """
+        送出待送的變更；GUI 直接讀資料庫時再同步等 daemon 寫完（daemon 自己也有 debounce），
+        之後的查詢才看得到剛才的編輯與其他 GUI/API 的變更。
+        """
+        self._timer.stop()
+        self._write_now()
+        if self._store is not None and self.client.connected:
+            if self.client.call("flush", timeout_ms=int(timeout * 1000)) is None:
+                log("⚠️ 排程 daemon 沒有回應 flush，資料庫內容可能不是最新", level="WARNING")
+            return
+        self.client.flush(int(timeout * 1000))
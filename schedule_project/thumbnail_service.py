@@ -0,0 +1,278 @@
+# thumbnail_service.py
+import glob
+import os
+import threading
+import time
+from collections import OrderedDict
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Qt
+from PySide6.QtGui import QImageReader, QPixmap
+from shiboken6 import isValid
+from utils import log
+
+THUMB_WIDTH = 60                        # block 上的縮圖寬度（px）
+THUMB_CACHE_BYTES = 16 * 1024 * 1024    # LRU 縮圖快取上限（以像素資料估算）
+THUMB_REVALIDATE_S = 30                 # 快取命中後多久才再去磁碟確認 mtime
+THUMB_WORKERS = 2                       # 同時讀網路磁碟的執行緒數
+THUMB_DISK_BYTES = 200 * 1024 * 1024    # 本機縮圖快取上限；超過就刪最久沒用的
+THUMB_JPEG_QUALITY = 85
+
+
+def decode_thumbnail(path, width=THUMB_WIDTH):
+    """背景執行緒用：讀檔並縮成 width 寬的 QImage（QImage 可跨執行緒，QPixmap 不行）。讀不到回 None。"""
+    reader = QImageReader(path)
+    image = reader.read()
+    if image.isNull():
+        return None
+    if image.width() > width:
+        image = image.scaledToWidth(width, Qt.SmoothTransformation)
+    return image
+
+
+class ThumbnailDiskCache:
+    """
+    本機（SSD）縮圖快取：網路磁碟上的原圖只在第一次（或檔案更新後）讀一次。
+    - 檔名含 block_id、原圖 mtime、原圖大小與寬度：原圖一改就自然失效
+    - 總大小超過 max_bytes 時刪掉最久沒用的（命中時更新檔案 mtime 當作 LRU）
+    只在背景 worker 呼叫；多個 worker 共用時以 lock 保護大小統計。
+    """
+    def __init__(self, directory, max_bytes: int = THUMB_DISK_BYTES, width: int = THUMB_WIDTH):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.width = width
+        self._lock = threading.Lock()
+        self._total = None   # 目前總大小；第一次寫入時才掃描資料夾
+
+    def _prefix(self, block_id):
+        return "".join(c if c.isalnum() or c in "-_" else "_" for c in str(block_id)) + "_"
+
+    def _path(self, block_id, mtime, size):
+        return os.path.join(self.directory, f"{self._prefix(block_id)}{mtime}_{size}_{self.width}.jpg")
+
+    def load(self, block_id, mtime, size):
+        path = self._path(block_id, mtime, size)
+        if not os.path.isfile(path):
+            return None
+        image = QImageReader(path).read()
+        if image.isNull():
+            return None
+        try:
+            os.utime(path)  # ➤ LRU：最近用過的最後才淘汰
+        except OSError:
+            pass
+        return image
+
+    def store(self, block_id, mtime, size, image):
+        path = self._path(block_id, mtime, size)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if not image.save(tmp_path, "JPG", THUMB_JPEG_QUALITY):
+                raise OSError(f"無法寫入 {tmp_path}")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log(f"⚠️ 縮圖快取寫入失敗：{e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            # 同一個 block 的舊版本（原圖已更新）直接刪掉
+            for old in glob.glob(os.path.join(self.directory, f"{self._prefix(block_id)}*_{self.width}.jpg")):
+                if old != path:
+                    self._remove(old)
+            if self._total is None:
+                self._total = sum(n for _, n, _ in self._scan())
+            else:
+                self._total += os.path.getsize(path)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith(".jpg"):
+                        st = entry.stat()
+                        entries.append((entry.path, st.st_size, st.st_mtime))
+        except OSError:
+            pass
+        return entries
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        if self._total is not None:
+            self._total -= size
+
+    def _evict(self):
+        # 刪到上限的九成，避免每寫一張就掃一次資料夾
+        entries = sorted(self._scan(), key=lambda e: e[2])
+        self._total = sum(n for _, n, _ in entries)
+        target = self.max_bytes * 9 // 10
+        removed = 0
+        for path, _, _ in entries:
+            if self._total <= target:
+                break
+            self._remove(path)
+            removed += 1
+        log(f"🧹 縮圖快取淘汰 {removed} 張（剩 {self._total // 1024} KB）")
+
+
+class _ThumbWorkerSignals(QObject):
+    done = Signal(str, object, object, object)   # block_id, path, mtime, QImage（mtime 沒變時為 None）
+
+
+class _ThumbWorker(QRunnable):
+    """在背景 stat + 解碼；known=(path, mtime) 與磁碟相同時不重新解碼，本機快取有就不讀原圖。"""
+    def __init__(self, block_id, paths, known, disk_cache=None):
+        super().__init__()
+        self.block_id = block_id
+        self.paths = paths
+        self.known = known
+        self.disk_cache = disk_cache
+        self.signals = _ThumbWorkerSignals()
+
+    def run(self):
+        path = mtime = image = None
+        try:
+            for candidate in self.paths:
+                try:
+                    st = os.stat(candidate)
+                except OSError:
+                    continue
+                if st.st_size <= 0:
+                    continue  # 還在寫入的 0 bytes 檔
+                path, mtime, size = candidate, st.st_mtime_ns, st.st_size
+                break
+            if path is not None and self.known != (path, mtime):
+                disk = self.disk_cache
+                image = disk.load(self.block_id, mtime, size) if disk else None
+                if image is None:
+                    image = decode_thumbnail(path)
+                    if image is None:
+                        path = mtime = None  # 壞圖當作沒圖
+                    elif disk:
+                        disk.store(self.block_id, mtime, size, image)
+        except Exception as e:
+            log(f"❌ 縮圖讀取失敗（{self.block_id}）：{e}")
+            path = mtime = image = None
+        try:
+            if isValid(self.signals):
+                self.signals.done.emit(self.block_id, path, mtime, image)
+        except RuntimeError:
+            pass
+
+
+class ThumbnailService(QObject):
+    """
+    block 縮圖服務：
+    - 檔案 stat / 解碼 / 縮圖都在背景執行緒，主線程只把 QImage 轉成 QPixmap
+    - LRU 快取 key 為 (block_id, mtime)，總量超過 THUMB_CACHE_BYTES 就淘汰最久沒用的
+    - 有 disk_cache（ThumbnailDiskCache）時，縮好的圖也存到本機；重開程式不必再讀網路磁碟的原圖
+    - 快取命中時直接回傳；超過 THUMB_REVALIDATE_S 才在背景重新確認檔案有沒有更新
+    - 結果經 thumbnailReady(block_id, QPixmap | None) 回來（None＝沒有縮圖）
+    """
+    thumbnailReady = Signal(str, object)
+
+    def __init__(self, parent=None, max_bytes: int = THUMB_CACHE_BYTES, disk_cache=None):
+        super().__init__(parent)
+        self.max_bytes = max_bytes
+        self.disk_cache = disk_cache
+        self._cache = OrderedDict()   # {(block_id, mtime): QPixmap}
+        self._bytes = 0
+        self._latest = {}             # {block_id: (path, mtime, 確認時間)}；path 為 None＝沒圖
+        self._inflight = {}           # {block_id: _ThumbWorker}；✅ 持有 worker，避免 signals 被 GC
+        self._rerun = {}              # {block_id: paths}；進行中又被要求 refresh
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(THUMB_WORKERS)
+        self._is_closing = False
+
+    def request(self, block_id, paths, refresh=False):
+        """
+        回傳 (hit, pixmap)：hit 為 True 表示現在就知道答案（pixmap 可能是 None＝沒圖）。
+        需要時在背景確認/載入，完成後發 thumbnailReady。
+        """
+        if self._is_closing or not block_id:
+            return False, None
+        latest = self._latest.get(block_id)
+        pixmap = self._get((block_id, latest[1])) if latest and latest[0] else None
+        known = latest is not None and (latest[0] is None or pixmap is not None)
+        fresh = known and time.monotonic() - latest[2] < THUMB_REVALIDATE_S
+        if refresh or not fresh:
+            self._submit(block_id, list(paths), refresh)
+        return known, pixmap
+
+    def _submit(self, block_id, paths, refresh):
+        if block_id in self._inflight:
+            if refresh:
+                self._rerun[block_id] = paths
+            return
+        latest = self._latest.get(block_id)
+        known = None
+        if latest and latest[0] and (block_id, latest[1]) in self._cache:
+            known = (latest[0], latest[1])
+        worker = _ThumbWorker(block_id, paths, known, self.disk_cache)
+        worker.signals.done.connect(self._on_done)
+        self._inflight[block_id] = worker
+        self._pool.start(worker)
+
+    def _on_done(self, block_id, path, mtime, image):
+        worker = self._inflight.pop(block_id, None)
+        if self._is_closing:
+            return
+        old = self._latest.get(block_id)
+        if old and old[1] != mtime:
+            self._drop((block_id, old[1]))  # 檔案換了，舊版本不必留著
+
+        pixmap = None
+        if path is not None:
+            if image is not None:
+                pixmap = QPixmap.fromImage(image)
+                self._put((block_id, mtime), pixmap)
+            else:
+                pixmap = self._get((block_id, mtime))
+                if pixmap is None and worker is not None:
+                    # ⛑️ 確認期間被淘汰：重新解碼一次
+                    self._latest.pop(block_id, None)
+                    self._submit(block_id, worker.paths, False)
+                    return
+        self._latest[block_id] = (path, mtime, time.monotonic())
+        self.thumbnailReady.emit(block_id, pixmap)
+
+        paths = self._rerun.pop(block_id, None)
+        if paths is not None:
+            self._submit(block_id, paths, False)
+
+    # --- LRU ---
+    @staticmethod
+    def _cost(pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def _get(self, key):
+        pixmap = self._cache.get(key)
+        if pixmap is not None:
+            self._cache.move_to_end(key)
+        return pixmap
+
+    def _put(self, key, pixmap):
+        self._drop(key)
+        self._cache[key] = pixmap
+        self._bytes += self._cost(pixmap)
+        while self._bytes > self.max_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._bytes -= self._cost(evicted)
+
+    def _drop(self, key):
+        pixmap = self._cache.pop(key, None)
+        if pixmap is not None:
+            self._bytes -= self._cost(pixmap)
+
+    def close(self):
+        self._is_closing = True
+        self._pool.clear()
+        self._rerun.clear()
@@ -1,12 +1,13 @@
-from PySide6.QtWidgets import QGraphicsRectItem, QGraphicsSimpleTextItem, QGraphicsPixmapItem, QDialog, QVBoxLayout, QLabel
+from PySide6.QtWidgets import QGraphicsItem, QGraphicsRectItem, QGraphicsSimpleTextItem, QGraphicsPixmapItem, QDialog, QVBoxLayout, QLabel
 from PySide6.QtCore import Qt, QTimer, QDate,QDateTime,QTime,QEvent
-from PySide6.QtGui import QBrush, QColor, QFont,QPixmap
+from PySide6.QtGui import QBrush, QColor, QFont,QPixmap, QFontMetrics
 from edit_block_dialog import EditBlockDialog
 import logging
 from path_manager import PathManager
 import os
 from utils import log
 logging.basicConfig(level=logging.INFO)
+LABEL_MIN_PX = 16   # block 縮到比這還窄（像素）就不顯示文字
 def _safe_pixmap_from_file(path: str) -> QPixmap | None:
     try:
         if not path or not os.path.isfile(path):
@@ -97,6 +98,9 @@ class TimeBlock(QGraphicsRectItem):
         # self.status_text.setPos(10, 45)
         self.status_text.setFont(QFont("Arial", 8)) 
         self.status_text.setPos(4, self.rect().height() - 18)
+        # ✅ 水平縮放是 view transform：文字保持原本大小，改用省略號配合寬度
+        self.text.setFlag(QGraphicsItem.ItemIgnoresTransformations, True)
+        self.status_text.setFlag(QGraphicsItem.ItemIgnoresTransformations, True)
         QTimer.singleShot(0, self.update_text_position)
 
         self.left_handle = QGraphicsRectItem(0, 0, self.HANDLE_WIDTH, self.BLOCK_HEIGHT, self)
@@ -135,8 +139,14 @@ class TimeBlock(QGraphicsRectItem):
             if self.status_text is None or self.status_text.scene() is None:
                 return
 
+            # ➤ 可用寬度（像素）；太窄就整個隱藏，否則逐行省略
+            avail_px = self.rect().width() * self._zoom_scale() - 8
+            show = avail_px >= LABEL_MIN_PX
+            self.text.setVisible(show)
+            self.status_text.setVisible(show)
+
             # ✅ 主文字：節目名稱 + 時間
-            self.text.setText(self.format_text())
+            self.text.setText(self._elide_lines(self.format_text(), self.text.font(), avail_px))
             self.text.setPos(4, 2)
 
             # ✅ 狀態文字：status + live_status（不寫入 JSON）
@@ -144,6 +154,7 @@ class TimeBlock(QGraphicsRectItem):
             if getattr(self, "live_status", ""):
                 combined_status += "\n" + self.live_status
 
+            combined_status = self._elide_lines(combined_status, self.status_text.font(), avail_px)
             if self.status_text.text() != combined_status:
                 self.status_text.setText(combined_status)
 
@@ -156,6 +167,30 @@ class TimeBlock(QGraphicsRectItem):
 
 
 
+    def _zoom_scale(self):
+        scene = self.scene()
+        parent_view = scene.parent() if scene else None
+        return getattr(parent_view, "zoom_scale", 1.0) or 1.0
+
+    @staticmethod
+    def _elide_lines(text, font, avail_px):
+        metrics = QFontMetrics(font)
+        width = max(int(avail_px), 0)
+        return "\n".join(metrics.elidedText(line, Qt.ElideRight, width) for line in text.split("\n"))
+
+    def apply_zoom(self):
+        """view 縮放倍率改變：位置不用重算，只調整 handle 寬度、文字省略與縮圖位置。"""
+        self._update_handles()
+        self.update_text_position()
+        self.update_preview_position()
+
+    def _update_handles(self):
+        # handle 維持固定像素寬，但不超過 block 的三分之一
+        block_width = self.rect().width()
+        handle_w = min(self.HANDLE_WIDTH / self._zoom_scale(), block_width / 3)
+        self.left_handle.setRect(0, 0, handle_w, self.BLOCK_HEIGHT)
+        self.right_handle.setRect(block_width - handle_w, 0, handle_w, self.BLOCK_HEIGHT)
+
     def format_text(self):
         
 
@@ -199,7 +234,8 @@ class TimeBlock(QGraphicsRectItem):
         self.setPos(block_x, self.track_index * self.BLOCK_HEIGHT + parent_view.grid_top_offset)
 
         # 移動右側 handle
-        self.right_handle.setRect(block_width - self.HANDLE_WIDTH, 0, self.HANDLE_WIDTH, self.BLOCK_HEIGHT)
+        self._update_handles()
+        self.update_preview_position()
 
         QTimer.singleShot(0, self.update_text_position)
 
@@ -252,16 +288,18 @@ class TimeBlock(QGraphicsRectItem):
 
     def update_block_data(self, updates: dict):
             parent_view = self.scene().parent()
-            for b in parent_view.block_data:
-                if b.get("id") == self.block_id:
-                    has_changed = False
-                    for k, v in updates.items():
-                        if b.get(k) != v:
-                            b[k] = v
-                            has_changed = True
-                    if has_changed:
-                        parent_view.save_schedule()
-                    break
+            b = parent_view.block_index.get(self.block_id)
+            if b is None:
+                b = next((d for d in parent_view.block_data if d.get("id") == self.block_id), None)
+            if b is not None:
+                has_changed = False
+                for k, v in updates.items():
+                    if b.get(k) != v:
+                        b[k] = v
+                        has_changed = True
+                if has_changed:
+                    parent_view.touch_block(b)
+                    parent_view.save_schedule()
 
     def mouseMoveEvent(self, event):
         if getattr(self, "prevent_drag", False):
@@ -349,34 +387,10 @@ class TimeBlock(QGraphicsRectItem):
                 self.flash_red()
                 return
 
-            # === 跨日安全的重疊檢查（用時間區間比對）===
-            def _dt(qd: QDate, hourf: float) -> QDateTime:
-                return QDateTime(qd, QTime(int(hourf) % 24, int((hourf % 1) * 60)))
-
-            cand_start_dt = _dt(cand_qdate, cand_start_hour)
-            cand_end_hour = cand_start_hour + cand_duration
-            cand_end_qd   = cand_qdate.addDays(1) if cand_end_hour >= 24 else cand_qdate
-            cand_end_dt   = _dt(cand_end_qd, cand_end_hour % 24)
-
-            has_overlap = False
-            for b in parent_view.block_data:
-                if b.get("id") == self.block_id or b["track_index"] != self.track_index:
-                    continue
-
-                qd = b["qdate"] if isinstance(b["qdate"], QDate) else QDate.fromString(b["qdate"], "yyyy-MM-dd")
-                b_start = float(b["start_hour"])
-                b_end   = float(b.get("end_hour", b["start_hour"] + b["duration"]))
-                end_qd  = b.get("end_qdate", qd.addDays(1) if b_end >= 24 else qd)
-                if isinstance(end_qd, str):
-                    end_qd = QDate.fromString(end_qd, "yyyy-MM-dd")
-
-                b_start_dt = _dt(qd, b_start)
-                b_end_dt   = _dt(end_qd if b_end < 24 else qd.addDays(1), b_end % 24)
-
-                # 區間 [s1,e1) 與 [s2,e2) 是否交集
-                if (cand_start_dt < b_end_dt) and (b_start_dt < cand_end_dt):
-                    has_overlap = True
-                    break
+            # === 跨日安全的重疊檢查（每軌區間索引）===
+            has_overlap = parent_view.is_overlap(
+                cand_qdate, self.track_index, cand_start_hour, cand_duration, exclude_label=self.block_id
+            )
 
             if has_overlap:
                 self.flash_red()
@@ -439,8 +453,9 @@ class TimeBlock(QGraphicsRectItem):
                         "id": self.block_id,
                         "encoder_name": parent_view.encoder_names[self.track_index]
                     })
+                    parent_view.touch_block(b)
                     break
-            parent_view.save_schedule()
+            parent_view.save_schedule(immediate=True)
             self.setFlag(QGraphicsRectItem.ItemIsMovable, False)
             return
 
@@ -514,11 +529,12 @@ class TimeBlock(QGraphicsRectItem):
                     "id": self.block_id,
                     "encoder_name": parent_view.encoder_names[self.track_index]  # 對應 encoder
                 })
+                parent_view.touch_block(b)
                 break
 
         
         super().mouseReleaseEvent(event)
-        parent_view.save_schedule()
+        parent_view.save_schedule(immediate=True)
         self.setFlag(QGraphicsRectItem.ItemIsMovable, False)  
     def update_status_by_time(self):
         now = QDateTime.currentDateTime()
@@ -613,6 +629,7 @@ class TimeBlock(QGraphicsRectItem):
                 "label": self.label,
                 "encoder_name": updated["encoder_name"]
             })
+            parent_view.touch_block(block_data)
             parent_view.save_schedule()
 
         # event.accept()
@@ -624,43 +641,47 @@ class TimeBlock(QGraphicsRectItem):
         self.setBrush(flash_color)
         QTimer.singleShot(300, lambda: self.setBrush(QBrush(original_color)))
 
-    def load_preview_images(self, image_folder):
-        """安全載入 block 的縮圖；檔案不存在/壞掉就略過且隱藏舊縮圖。"""
+    def load_preview_images(self, image_folder, refresh=False):
+        """
+        向 ThumbnailService 要縮圖：stat / 解碼 / 縮圖都在背景，不會卡在網路磁碟。
+        快取裡有就立刻套用，其餘由 ScheduleView 收到 thumbnailReady 後呼叫 set_preview_pixmap。
+        refresh=True：檔案剛更新（例如剛拍完照），不管快取多新都重新確認。
+        """
         try:
-            # 優先用呼叫端給的資料夾；若沒給，改用 PathManager 求精確路徑
-            image_path = None
-
+            # 優先用呼叫端給的資料夾；再用 PathManager 求精確路徑（只組路徑，不碰磁碟）
+            paths = []
             if image_folder:
-                candidate = os.path.join(image_folder, f"{self.block_id}.png")
-                if os.path.isfile(candidate):
-                    image_path = candidate
-            if not image_path:
-                # fallback：用 path_manager 直接算路徑
-                pm = getattr(self, "path_manager", None)
-                if pm is None:
-                    # 從 parent view 拿
-                    parent_view = self.scene().parent() if self.scene() else None
-                    pm = getattr(parent_view, "path_manager", None)
-                if pm:
-                    try:
-                        candidate = pm.get_image_path(self.block_id, self.start_date)
-                        if os.path.isfile(candidate):
-                            image_path = candidate
-                    except Exception:
-                        image_path = None
-
-            pmx = _safe_pixmap_from_file(image_path) if image_path else None
-            if pmx is None:
-                # 找不到圖或讀不到 → 把舊的縮圖藏起來（避免殘影），不崩不報錯
+                paths.append(os.path.join(image_folder, f"{self.block_id}.png"))
+
+            scene = self.scene()
+            parent_view = scene.parent() if scene else None
+            pm = getattr(self, "path_manager", None) or getattr(parent_view, "path_manager", None)
+            if pm:
+                try:
+                    candidate = pm.get_image_path(self.block_id, self.start_date)
+                    if candidate not in paths:
+                        paths.append(candidate)
+                except Exception:
+                    pass
+
+            service = getattr(parent_view, "thumbnails", None)
+            if service is None or not paths:
+                return
+            hit, pixmap = service.request(self.block_id, paths, refresh=refresh)
+            if hit:
+                self.set_preview_pixmap(pixmap)
+        except Exception as e:
+            log(f"❌ load_preview_images 例外：{e}")
+            # 任何錯誤都吞掉，不讓 UI 崩
+
+    def set_preview_pixmap(self, scaled):
+        """套用已縮好的縮圖；None＝找不到圖或讀不到 → 把舊的縮圖藏起來（避免殘影）。"""
+        try:
+            if scaled is None:
                 if getattr(self, "preview_item", None):
                     self.preview_item.setVisible(False)
-                # log(f"ℹ️ 找不到縮圖或無法讀取：block_id={self.block_id}")
                 return
 
-            # 生成縮圖
-            width = 60
-            scaled = pmx.scaledToWidth(width, Qt.SmoothTransformation)
-
             scene = self.scene()
             if not scene:
                 log("⚠️ 無法取得 scene，取消縮圖建立")
@@ -678,27 +699,32 @@ class TimeBlock(QGraphicsRectItem):
                 self.preview_item.setZValue(10)
                 self.preview_item.setAcceptedMouseButtons(Qt.LeftButton)
                 self.preview_item.setFlag(QGraphicsPixmapItem.ItemIsMovable, True)
+                self.preview_item.setFlag(QGraphicsItem.ItemIgnoresTransformations, True)
                 scene.addItem(self.preview_item)
 
             self.preview_item.setPixmap(scaled)
             self.preview_item.setVisible(True)
-
-            # 放在文字右側
-            block_pos = self.scenePos()
-            text_rect = self.text.boundingRect() if self.text else None
-            x_offset = block_pos.x() + (text_rect.width() + 8 if text_rect else 8)
-            y_offset = block_pos.y() + 2
-            self.preview_item.setPos(x_offset, y_offset)
+            self.update_preview_position()
 
             # 標記 block_id
             self.preview_item.block_id = self.block_id
-
-            # log(f"🖼️ 縮圖就緒：{image_path}")
+            self.preview_item.start_date = self.start_date
         except Exception as e:
-            log(f"❌ load_preview_images 例外：{e}")
-            # 任何錯誤都吞掉，不讓 UI 崩
+            log(f"❌ set_preview_pixmap 例外：{e}")
 
 
+    def update_preview_position(self):
+        """縮圖是獨立的 scene item，block 移動後要跟著放回文字右側。"""
+        preview = getattr(self, "preview_item", None)
+        if preview is None or preview.scene() is None:
+            return
+        block_pos = self.scenePos()
+        text_rect = self.text.boundingRect() if self.text and self.text.isVisible() else None
+        # 文字寬是像素（忽略 transform），換算回 scene 單位
+        x_offset = block_pos.x() + ((text_rect.width() if text_rect else 0) + 8) / self._zoom_scale()
+        y_offset = block_pos.y() + 2
+        preview.setPos(x_offset, y_offset)
+
     def safe_delete(self):
         if self.scene():
             self.scene().removeItem(self)
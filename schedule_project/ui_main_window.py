@@ -1,13 +1,13 @@
 from header_view import HeaderView  
 from PySide6.QtCore import Qt
 from PySide6.QtWidgets import (
-    QMainWindow, QWidget, QPushButton, QLabel, QDateEdit, QSlider,QDialog,QFrame,QScrollArea,QSplitter,QTextEdit,
+    QMainWindow, QWidget, QPushButton, QLabel, QDateEdit, QSlider,QDialog,QFrame,QScrollArea,QSplitter,
     QVBoxLayout, QHBoxLayout, QLineEdit, QApplication, QSizePolicy, QMessageBox, QMenu, QFileDialog
 )
 from shiboken6 import isValid
 from time_block import PreviewImageItem
 from PySide6.QtGui import QPixmap,QBrush ,QColor   
-from PySide6.QtCore import QDate, Qt,QDateTime,QTime,QTimer,QThreadPool
+from PySide6.QtCore import QDate, Qt,QDateTime,QTime,QTimer
 from schedule_view import ScheduleView
 from encoder_utils import list_encoders_with_alias
 from capture import take_snapshot_by_encoder
@@ -25,13 +25,16 @@ from capture import take_snapshot_from_block
 from check_schedule_manager import CheckScheduleManager
 CONFIG_FILE = "config.json"
 from uuid import uuid4
-from utils import set_log_box ,log,log_exception
+from utils import set_log_box ,log,log_exception, reload_log_config
+from log_view import LogViewer
 from capture import start_cleanup_timer, stop_cleanup_timer
 from snapshot_worker import SnapshotWorker
 from EncoderManagerDialog import EncoderManagerDialog
-from encoder_utils import save_encoder_config, reload_encoder_config
-from encoder_status_manager import EncoderStatusManager
-from schedule_view import _TrackLabelWorker
+from encoder_utils import save_encoder_config, reload_encoder_config, load_encoder_config
+from encoder_status_service import EncoderStatusService
+from schedule_store import ScheduleStore
+from scheduler_ipc import SchedulerClient
+from recurrence import describe, make_rule
 def find_latest_snapshot_by_prefix(preview_dir, encoder_name):
     pattern = os.path.join(preview_dir,"preview", f"{encoder_name}*.png") 
     log(f"🔍 查找最新快照：{pattern}")
@@ -89,7 +92,10 @@ class MainWindow(QMainWindow):
         self.encoder_pixmaps = {}
         self.encoder_entries = {}
         self.encoder_status = {}
-        self.encoder_status_manager = EncoderStatusManager()
+        # ✅ 全程式共用的狀態輪詢（左側面板 / 時間表標題 / runner 都訂閱它）
+        self.status_service = EncoderStatusService(self.encoder_names, parent=self)
+        self.encoder_status_manager = self.status_service.status_manager
+        self.status_service.statusChanged.connect(self._on_left_status_changed)
         
         os.makedirs(self.preview_root, exist_ok=True)
         self.start_buttons = {}
@@ -181,9 +187,11 @@ class MainWindow(QMainWindow):
         self.preview_root_button = QPushButton("📁 設定預覽儲存路徑")
         self.preview_root_button.clicked.connect(self.select_preview_root)
         self.save_button = QPushButton("💾 儲存")
-        self.save_button.clicked.connect(lambda: self.view.save_schedule())
+        self.save_button.clicked.connect(lambda: self.view.save_schedule(immediate=True))
         self.load_button = QPushButton("📂 載入")
         self.load_button.clicked.connect(lambda: (self.view.load_schedule(), self.sync_runner_data()))
+        self.import_epg_button = QPushButton("📥 匯入 EPG")
+        self.import_epg_button.clicked.connect(self.import_epg)
         self.prev_button = QPushButton("⬅️ 前一週")
         self.prev_button.clicked.connect(lambda: self.shift_date(-7))
         self.next_button = QPushButton("➡️ 下一週")
@@ -208,34 +216,30 @@ class MainWindow(QMainWindow):
         toolbar_layout.addWidget(self.add_button)
         toolbar_layout.addWidget(self.save_button)
         toolbar_layout.addWidget(self.load_button)
+        toolbar_layout.addWidget(self.import_epg_button)
         toolbar_layout.addWidget(undo_button)
 
         # --- Log box ---
-        self.log_box = QTextEdit()
-        self.log_box.setReadOnly(True)
-        self.log_box.setLineWrapMode(QTextEdit.NoWrap)
-        self.log_box.setFixedHeight(150)
-        self.log_box.setStyleSheet("""
-            QTextEdit {
-                background-color: #111;
-                color: #00FF00;
-                font-family: Consolas, Courier, monospace;
-                font-size: 11px;
-                border: 1px solid #333;
-            }
-        """)
+        self.log_box = LogViewer(self.encoder_names)   # 環狀緩衝 + QListView，可篩選
+        self.log_box.setFixedHeight(180)
 
         set_log_box(self.log_box)
 
         # --- Header & ScheduleView ---
         self.header = HeaderView(self.encoder_names)
         self.view = ScheduleView()
-        self.view.encoder_status_manager = self.encoder_status_manager  # ✅ 傳入狀態管理器
+        self.view.set_status_service(self.status_service)  # ✅ 訂閱共用狀態
+        self.status_service.set_schedule_source(lambda: self.view.block_data)  # ✅ 依排程調整輪詢頻率
+        self.view.schedule_changed.connect(self.status_service.notify_schedule_changed)
 
         self.view.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.view.encoder_names = self.encoder_names
         self.view.encoder_status = self.encoder_status
         self.view.record_root = self.record_root
+        self._init_schedule_store()
+        self.scheduler_client = self._connect_scheduler_daemon()
+        if self.scheduler_client is not None:
+            self.view.attach_scheduler(self.scheduler_client)
         self.view.load_schedule()
         self.view.draw_grid()
         # self.track_status_timer = QTimer()
@@ -265,25 +269,29 @@ class MainWindow(QMainWindow):
             encoder_status=self.encoder_status,
             record_root=self.record_root,
             encoder_names=self.encoder_names,
-            blocks=self.view.blocks
+            blocks=self.view.blocks,
+            status_service=self.status_service
         )# ✅ 加這裡！建立 schedule_manager
                 # ✅ 建立完 runner 後，再把控制權交給 runner（移到這裡）
         self.runner.start_buttons   = self.start_buttons
         self.runner.stop_buttons    = self.stop_buttons
         self.runner.filename_inputs = self.encoder_entries
-        self.schedule_manager = CheckScheduleManager(
-            encoder_names=self.encoder_names,
-            encoder_status_dict=self.encoder_status,
-            runner=self.runner,
-            parent_view_getter=lambda: self.view
-        )
-        self.schedule_manager.schedule_data = self.view.block_data
-        self.schedule_manager.blocks = self.view.blocks
-        self.check_timer = QTimer(self)
-        self.check_timer.timeout.connect(self.safe_check_schedule)
-        self.check_timer.start(1000)
-        self.schedule_manager.schedule_data = self.view.block_data
-        self.schedule_manager.blocks = self.view.blocks
+        # ✅ 有 scheduler_daemon 時由 daemon 負責開始/停止，GUI 不再自己排程
+        self.schedule_manager = None
+        if self.scheduler_client is None:
+            self.schedule_manager = CheckScheduleManager(
+                encoder_names=self.encoder_names,
+                encoder_status_dict=self.encoder_status,
+                runner=self.runner,
+                parent_view_getter=lambda: self.view
+            )
+            self.schedule_manager.schedule_data = self.view.block_data
+            self.schedule_manager.blocks = self.view.blocks
+            # ✅ 事件驅動：單筆增刪改只重算那幾筆；整份換掉才完整比對
+            self.view.blocks_changed.connect(self.schedule_manager.notify_changed)
+            self.view.blocks_removed.connect(self.schedule_manager.notify_removed)
+            self.view.schedule_reloaded.connect(self.schedule_manager.notify_schedule_changed)
+            self.schedule_manager.sync_blocks()
         self.view.runner = self.runner
 
         # --- Header + View Layout ---
@@ -321,16 +329,16 @@ class MainWindow(QMainWindow):
         # self.encoder_status_timer = QTimer(self)
         # self.encoder_status_timer.timeout.connect(self.update_encoder_status_labels)
         # self.encoder_status_timer.start(2000)
-        self._left_workers = []
-        self._left_status_timer = QTimer(self)
-        self._left_status_timer.timeout.connect(self.refresh_left_status_async)
-        self._left_status_timer.start(2000)  # 跟右側一樣節奏
-
         
         self.snapshot_timer = QTimer(self)
         self.snapshot_timer.timeout.connect(self.update_all_encoder_snapshots)
         self.snapshot_timer.start(30000)
 
+        # config.json 的 log 等級可在執行中修改：每 5 秒確認一次（只 stat，沒變不重讀）
+        self.log_config_timer = QTimer(self)
+        self.log_config_timer.timeout.connect(lambda: reload_log_config(CONFIG_FILE))
+        self.log_config_timer.start(5000)
+
       
 
         self.sync_runner_data()
@@ -338,9 +346,6 @@ class MainWindow(QMainWindow):
         # self.update_encoder_status_labels()
         # QTimer.singleShot(2000, self.update_encoder_status_labels)
         self.view.draw_grid()
-        self.check_timer = QTimer(self)
-        self.check_timer.timeout.connect(self.safe_check_schedule)
-        self.check_timer.start(1000)
         
         QTimer.singleShot(3000, self.update_all_encoder_snapshots)
   
@@ -355,23 +360,53 @@ class MainWindow(QMainWindow):
                         log(f"📂 自動載入之前選的檔案：{schedule_file}")
         except Exception as e:
             log(f"⚠️ config.json 載入失敗：{e}")
-    def refresh_left_status_async(self):
-        worker = _TrackLabelWorker(self.encoder_names, self.encoder_status_manager)
-        self._left_workers.append(worker)  # ✅ 保存參照
-        worker.signals.done.connect(self._apply_left_statuses)
+    def _init_schedule_store(self):
+        """config.json 有 schedule_db 時改用 SQLite 排程庫；資料庫是空的就先從 schedule_file 匯入一次。"""
+        try:
+            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        except Exception:
+            return
+        db_path = config.get("schedule_db")
+        if not db_path:
+            return
+        try:
+            store = ScheduleStore(db_path)
+            if store.count() == 0:
+                source = config.get("schedule_file") or "schedule.json"
+                if os.path.exists(source):
+                    store.import_json(source)
+            self.view.set_store(store)
+            log(f"🗄️ 使用排程資料庫：{db_path}")
+        except Exception as e:
+            log_exception(f"❌ 無法開啟排程資料庫 {db_path}，改用 JSON：{e}")
 
-        def _cleanup(_=None, w=worker):
-            try:
-                self._left_workers.remove(w)
-            except ValueError:
-                pass
-        worker.signals.done.connect(_cleanup)
+    def _connect_scheduler_daemon(self):
+        """config.json 有 scheduler_socket 時，錄影開始/停止交給 scheduler_daemon；連不上就照舊由本程式排程。"""
+        try:
+            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+                name = json.load(f).get("scheduler_socket")
+        except Exception:
+            return None
+        if not name:
+            return None
+        client = SchedulerClient(name, parent=self)
+        if not client.connect_to_daemon():
+            log(f"⚠️ 連不上排程 daemon（{name}），改由本程式排程", level="WARNING")
+            client.deleteLater()
+            return None
+        client.actionFired.connect(self._on_daemon_action)
+        log(f"🛰️ 已連線排程 daemon：{name}，錄影開始/停止由 daemon 執行")
+        return client
+
+    def _on_daemon_action(self, result):
+        # daemon 剛送出開始/停止：立即重查狀態，左側面板不必等下一輪輪詢
+        log("📡 daemon %s %s（%s）", result.get("action"), result.get("encoder_name"),
+            "OK" if result.get("ok") else "失敗", level="DEBUG", encoder=result.get("encoder_name"))
+        self.runner.refresh_encoder_statuses()
 
-        QThreadPool.globalInstance().start(worker)
-    # def refresh_left_status_async(self):
-    #         worker = _TrackLabelWorker(self.encoder_names, self.encoder_status_manager)
-    #         worker.signals.done.connect(self._apply_left_statuses)  # 回主線程
-    #         QThreadPool.globalInstance().start(worker)
+    def _on_left_status_changed(self, name: str, state):
+        self._apply_left_statuses({name: state})
 
     def _apply_left_statuses(self, statuses: dict):
         # statuses: {encoder_name: (status_text, color)}
@@ -380,22 +415,13 @@ class MainWindow(QMainWindow):
                 continue
             text, color = pair
             lbl = self.encoder_status.get(name)  # 左側每台 encoder 的 QLabel
-            if lbl:
+            if lbl and isValid(lbl):
                 lbl.setText(f"狀態：{text}")
                 lbl.setStyleSheet(f"color: {color}")
     def update_zoom(self, value):
-        self.view.hour_width = value
-        self.view.day_width = 24 * value
-        self.header.hour_width = value
-        self.header.day_width = 24 * value
-
-        self.view.draw_grid()
-        self.header.draw_header()
-
-        # 重新定位所有 block
-        for block in self.view.blocks:
-            block.update_geometry(self.view.base_date)
-            block.update_text_position()
+        # ✅ value 是每小時的像素寬；只換 view transform，不重畫格線、不重算 block
+        self.view.set_zoom(value)
+        self.header.set_zoom(value)
         self.view.center_on_now()
     def ensure_valid_paths(self):
         self.record_root = self.path_manager.record_root
@@ -469,9 +495,12 @@ class MainWindow(QMainWindow):
         self.encoder_preview_labels = {}
 
         self.runner.encoder_names = self.encoder_names
-        self.schedule_manager.encoder_names = self.encoder_names
         self.runner.encoder_status = self.encoder_status
-        self.schedule_manager.encoder_status = self.encoder_status
+        if self.schedule_manager is not None:
+            self.schedule_manager.encoder_names = self.encoder_names
+            self.schedule_manager.encoder_status = self.encoder_status
+        if self.scheduler_client is not None:
+            self.scheduler_client.send("reload_config")  # daemon 也重讀 encoders.json
         # ✅ 清空 encoder_panel UI 區塊
         encoder_panel = self.findChild(QWidget, "encoder_panel")
         if encoder_panel:
@@ -491,6 +520,8 @@ class MainWindow(QMainWindow):
         self.view.encoder_names = self.encoder_names
         self.view.encoder_status = self.encoder_status
         self.header.set_encoder_names(self.encoder_names)
+        self.status_service.set_encoder_names(self.encoder_names)
+        self.log_box.set_encoder_names(self.encoder_names)
 
         # ✅ 修正 block 對應 encoder track
         self.view.restore_orphan_blocks()
@@ -509,14 +540,6 @@ class MainWindow(QMainWindow):
         self.header.set_base_date(today)
         self.date_picker.setDate(today)
         self.view.center_on_now()  
-    def safe_check_schedule(self):
-        log("🕒 檢查排程中...")
-        try:
-            # 改成非同步：丟給 worker，避免主線程卡住
-            self.schedule_manager.tick_async()
-        except Exception as e:
-            log_exception(f"❌ [Timer] check_schedule 錯誤：{e}")
-        
     def build_encoder_widget(self, name):
         display = self.encoder_aliases.get(name, name)
         encoder_widget = QWidget()
@@ -614,50 +637,21 @@ class MainWindow(QMainWindow):
             self.update_preview_scaled(name)
         super().resizeEvent(event)
     def get_encoder_status(self, name):
-        result = self.encoder_status_manager.get_status(name)
-        log(f"🧪 get_status({name}) 回傳：{result}")
-        
-        if result:
-            status_text, _ = result
+        """從共用快取取狀態文字（不做 I/O）；還沒查到就顯示查詢中。"""
+        state = self.status_service.state(name)
+        if state:
+            status_text, _ = state
             return status_text
-        else:
-            # ❗❗❗ Fallback：如果解析失敗（None），保留舊狀態以避免 UI 閃跳
-            last = self.runner.encoder_last_state.get(name, "")
-            if "Running" in last or "Runned" in last:
-                return "✅ 錄影中"
-            elif "Paused" in last:
-                return "⏸ 暫停中"
-            elif "Stopped" in last or "None" in last:
-                return "⏹ 停止中"
-            elif "Prepared" in last or "Preparing" in last:
-                return "🟡 準備中"
-            elif "Error" in last or "disconnect" in last:
-                return "❌ 錯誤"
-            elif not last:
-                return "❌ 未連線"
-            else:
-                # 可選：log unknown 狀態但不顯示到 UI
-                log(f"⚠️ 無法解析狀態 fallback: {last}")
-                return ""
-
-
+        return "⏳ 查詢中"
 
     def update_encoder_status_labels(self):
         try:
-            for name, status_label in self.encoder_status.items():
-                # 用同一份狀態來源 ➜ 兩邊一致
-                result = self.encoder_status_manager.get_status(name)
-                # get_status 回傳 (status_text, color)
-                if not result:
-                    continue
-                status_text, color = result
-
-                # 左側控制面板（既有）
-                status_label.setText(f"狀態：{status_text}")
-                status_label.setStyleSheet(f"color: {color}")
-
-                # 右側時間表左邊的標題（新）
+            # 用同一份狀態來源 ➜ 左側面板與時間表標題一致
+            statuses = self.status_service.states()
+            self._apply_left_statuses(statuses)
+            for name, (status_text, color) in statuses.items():
                 self.view.set_track_label_status(name, status_text, color)
+            self.status_service.request_refresh()
         except Exception as e:
             log_exception(f"❌ [Timer] update_encoder_status_labels 發生錯誤：{e}")
             
@@ -746,6 +740,8 @@ class MainWindow(QMainWindow):
             # ✅ 更新給 runner、view、path_manager（若存在）
             if hasattr(self, "runner"):
                 self.runner.record_root = folder
+            if self.scheduler_client is not None:
+                self.scheduler_client.send("reload_config")
             if hasattr(self, "view"):
                 self.view.record_root = folder
                 if hasattr(self.view, "path_manager"):
@@ -779,6 +775,13 @@ class MainWindow(QMainWindow):
             name, qdate, time_obj, duration, encoder_name = dialog.get_values()
             track_index = self.encoder_names.index(encoder_name)
             start_hour = round(time_obj.hour() + time_obj.minute() / 60, 2)
+            recurrence = dialog.get_recurrence()
+            if recurrence is not None:
+                # ✅ 重複排程只存一條規則，每一次依畫面/排程器範圍展開
+                self.view.add_rule(make_rule(qdate, track_index, start_hour, duration, name, encoder_name, recurrence))
+                log(f"🔁 已新增重複排程：{name}（{describe(recurrence)}）", encoder=encoder_name)
+                self.sync_runner_data()
+                return
             self.block_manager.add_block_with_unique_label(
                 name, 
                 track_index=track_index, 
@@ -789,6 +792,63 @@ class MainWindow(QMainWindow):
                 )
             self.sync_runner_data()
             
+    def import_epg(self):
+        path, _ = QFileDialog.getOpenFileName(self, "選擇節目表", self.record_root, "節目表 (*.csv *.xml)")
+        if not path:
+            return
+        try:
+            import epg_import  # ➤ 用到才載入 NumPy：沒裝也不影響其他功能
+        except ImportError as e:
+            QMessageBox.warning(self, "無法匯入", f"EPG 匯入需要 NumPy：{e}")
+            return
+        try:
+            rows, invalid = epg_import.read_epg(path)
+            existing = []
+            if rows:
+                span = (int(min(r["start"] for r in rows).timestamp()), int(max(r["end"] for r in rows).timestamp()))
+                existing = self.view.intervals_between(*span)
+            report = epg_import.plan_import(
+                rows, epg_import.build_channel_map(load_encoder_config()), self.encoder_names,
+                existing, find_overlaps=self.view.find_overlaps,
+            )
+        except Exception as e:
+            log_exception(f"❌ 讀取節目表失敗：{path}：{e}")
+            QMessageBox.warning(self, "無法匯入", f"讀取節目表失敗：{e}")
+            return
+
+        blocks, rejected = report["blocks"], []
+        if blocks:
+            try:
+                rejected = self.view.add_blocks(blocks)  # ✅ 沒衝突的整批一次寫入（接 daemon 時由 daemon 再檢查）
+            except RuntimeError as e:
+                log(f"❌ EPG 匯入未完成：{e}", level="ERROR")
+                QMessageBox.warning(self, "無法匯入", f"排程 daemon 未完成匯入：{e}\n請稍後重新載入排程確認。")
+                return
+            self.sync_runner_data()
+        for r in rejected:
+            others = "、".join(c.get("label") or "" for c in r.get("conflicts") or [])
+            log(f"⚠️ EPG「{r.get('label')}」被排程 daemon 拒絕：{r.get('reason')}" + (f"（{others}）" if others else ""),
+                level="WARNING", block_id=r.get("id"))
+        imported = len(blocks) - len(rejected)
+        for c in report["conflicts"]:
+            others = "、".join(c["with"]) or ("同一份節目表內" if c["in_batch"] else "資料庫中的節目")
+            log(f"⚠️ EPG 第 {c['line']} 筆 {c['encoder_name']} {c['start']}「{c['title']}」與 {others} 重疊，未匯入",
+                level="WARNING", encoder=c["encoder_name"])
+        for u in report["unmapped"]:
+            reason = u.get("reason") or f"頻道 {u['channel']} 沒有對應的 encoder"
+            log(f"⚠️ EPG 第 {u['line']} 筆「{u['title']}」：{reason}", level="WARNING")
+        for bad in invalid:
+            log(f"⚠️ EPG 第 {bad['line']} 筆無法解析：{bad['reason']}", level="WARNING")
+        log(f"📥 已匯入 EPG：{path}（{imported} 筆）")
+        QMessageBox.information(self, "EPG 匯入完成", (
+            f"已匯入：{imported} 筆\n"
+            f"時間衝突（未匯入）：{len(report['conflicts']) + len(rejected)} 筆\n"
+            f"已存在（略過）：{len(report['duplicates'])} 筆\n"
+            f"無對應 encoder：{len(report['unmapped'])} 筆\n"
+            f"無法解析：{len(invalid)} 筆\n\n"
+            "未匯入的明細請看下方 log。"
+        ))
+
     def update_start_date(self, qdate):
         self.view.set_start_date(qdate)
         self.header.set_base_date(qdate)  
@@ -828,6 +888,11 @@ class MainWindow(QMainWindow):
                 open_action = menu.addAction("📂 開啟資料夾")
                 copy_action = menu.addAction("📋 複製路徑")
                 delete_action = menu.addAction("🗑️ 刪除排程")
+                block = self.view.block_index.get(item.block_id)
+                rule = self.view.rules.get(block.get("rule_id")) if block is not None else None
+                series_action = None
+                if rule is not None:
+                    series_action = menu.addAction(f"🗑️ 刪除整個系列（{describe(rule['recurrence'])}）")
                  # ✅ 禁用已結束 block 的刪除功能
                 if getattr(item, 'has_ended', False) or item.status.strip() in ["✅ 錄影中", "⏹ 停止中"]:
                     delete_action.setEnabled(False)
@@ -845,6 +910,15 @@ class MainWindow(QMainWindow):
                     clipboard.setText(path)
                 elif selected == delete_action:
                     self.block_manager.remove_block_by_id(item.block_id)
+                elif series_action is not None and selected == series_action:
+                    answer = QMessageBox.question(
+                        self, "刪除整個系列",
+                        f"確定刪除「{rule['label']}」所有尚未開始的重複排程？\n已開始或結束的節目會保留。",
+                    )
+                    if answer == QMessageBox.Yes:
+                        self.view.remove_rule(rule["id"])
+                        self.sync_runner_data()
+                        log(f"🗑️ 已刪除重複排程：{rule['label']}")
 
                 break
 
@@ -947,7 +1021,8 @@ class MainWindow(QMainWindow):
 
         if not already_exists:
             conflicts = find_conflict_blocks(
-                "schedule.json", qdate, track_index, start_hour, duration
+                "schedule.json", qdate, track_index, start_hour, duration,
+                index=self.view.block_index
             )
             if conflicts:
                 QMessageBox.warning(
@@ -981,13 +1056,17 @@ class MainWindow(QMainWindow):
         if block_id:
             self.runner.already_started.add(block_id)
             self.runner.start_encoder(encoder_name, filename, status_label, block_id)
-            self.schedule_manager.already_started.add(block_id)
+            if self.schedule_manager is not None:
+                self.schedule_manager.already_started.add(block_id)
+            elif self.scheduler_client is not None:
+                self.scheduler_client.send("mark_started", id=block_id)
             self.sync_runner_data()
             for b in self.view.block_data:
                 if b.get("id") == block_id:
                     b["status"] = "✅ 錄影中"
+                    self.view.touch_block(b, materialize=False)
                     break
-            self.view.save_schedule()  # ✅ 立即儲存
+            self.view.save_schedule(immediate=True)  # ✅ 立即儲存
         block = next((blk for blk in self.view.blocks if blk.block_id == block_id), None)
         if block:
             try:
@@ -1031,8 +1110,10 @@ class MainWindow(QMainWindow):
     def sync_runner_data(self):
         self.runner.schedule_data = self.view.block_data
         self.runner.blocks = self.view.blocks  # ✅ 這行很重要！
-        self.schedule_manager.schedule_data = self.view.block_data
-        self.schedule_manager.blocks = self.view.blocks
+        if self.schedule_manager is not None:
+            self.schedule_manager.schedule_data = self.view.block_data
+            self.schedule_manager.blocks = self.view.blocks
+            self.schedule_manager.notify_schedule_changed()
         log(f"🔁 [同步] Runner block 數量：{len(self.runner.blocks)}")
 
     def closeEvent(self, event):
@@ -1046,12 +1127,19 @@ class MainWindow(QMainWindow):
             self.encoder_status_timer.stop()
         if hasattr(self, "snapshot_timer"):
             self.snapshot_timer.stop()
-        if hasattr(self, "check_timer"):
-            self.check_timer.stop()
+        if getattr(self, "schedule_manager", None) is not None:
+            self.schedule_manager.stop()
+        if hasattr(self, "status_service"):
+            self.status_service.stop()
         if hasattr(self, "runner"):
             self.runner.stop_timers()
         if hasattr(self, "view"):
             self.view.stop_timers()
+            self.view.flush_schedule()  # ✅ 把 debounce 中的排程寫完再關
+            if self.view.store is not None:
+                self.view.store.close()
+        if getattr(self, "scheduler_client", None) is not None:
+            self.scheduler_client.close()
         if hasattr(self, "snapshot_futures"):
             for fut in self.snapshot_futures.values():
                 if hasattr(fut, "cancel_event"):
@@ -1,66 +1,332 @@
 # utils.py
 import sys
 import os
-from PySide6.QtCore import QDateTime
+import atexit
+import json
+import logging
+import queue
+import threading
+from collections import deque
+from PySide6.QtCore import QDateTime, QDate, QTime, QObject, Signal
 from PySide6.QtGui import QTextCursor
 from PySide6.QtCore import QTimer
 import traceback
 _log_box = None
-_buffered_logs = []
 MAX_LOG_LINES = 500
-DEBUG_MODE = True
+LOG_FILE = "log.txt"
+LOG_MAX_BYTES = 5 * 1024 * 1024   # log.txt 超過就輪替成 log.txt.1、.2 …
+LOG_BACKUP_COUNT = 3
+LOG_UI_FLUSH_MS = 100             # log 視窗最多每 100ms 批次更新一次
+LOG_WRITE_BATCH = 500             # 寫檔執行緒一次最多取幾行
+LOG_ROOT = "recorder"             # 各模組 logger 為 recorder.<模組名>
+DEFAULT_LOG_LEVEL = "INFO"
+_LOG_FORMAT = logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s", "%H:%M:%S")
+
+LOG_UI_PENDING_MAX = 10000        # 兩次批次更新之間最多暫存幾筆（爆量時丟最舊的）
+_ui_pending = deque(maxlen=LOG_UI_PENDING_MAX)  # 任何執行緒 ➜ 主線程 log 視窗；(created, levelno, module, encoder, text)
+_ui_lock = threading.Lock()
+_log_bridge = None
+_setup_lock = threading.Lock()
+_text_writer = None
+_json_writer = None
+_json_handler = None
+_log_config_mtime = None
+_STOP = object()
+
+
 def log_exception(e, note=""):
     tb = traceback.format_exc()
+    name = sys._getframe(1).f_globals.get("__name__", "")
     if note:
-        log(f"❌ {note}\n{tb}", level="ERROR")
+        _log(name, "ERROR", f"❌ {note}\n{tb}", (), {})
     else:
-        log(f"❌ Exception:\n{tb}", level="ERROR")
+        _log(name, "ERROR", f"❌ Exception:\n{tb}", (), {})
+
+
+class _LogBridge(QObject):
+    """在主線程建立；背景執行緒發 pending，Qt 會排到主線程執行（queued）。"""
+    pending = Signal()
+
+    def __init__(self):
+        super().__init__()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(LOG_UI_FLUSH_MS)
+        self._timer.timeout.connect(_flush_log_box)
+        self.pending.connect(self._schedule)
+
+    def _schedule(self):
+        if not self._timer.isActive():
+            self._timer.start()
+
+
 def set_log_box(widget):
-    global _log_box
+    """
+    widget 為 log_view.LogViewer（append_entries 批次附加，可篩選）；
+    也接受 QPlainTextEdit（行數上限交給 maximumBlockCount）。
+    """
+    global _log_box, _log_bridge
     _log_box = widget
+    if hasattr(widget, "setMaximumBlockCount"):
+        widget.setMaximumBlockCount(MAX_LOG_LINES)
+    if _log_bridge is None:
+        _log_bridge = _LogBridge()
+    _flush_log_box()  # 視窗建立前的 log 一次補上
 
-    for text in _buffered_logs:
-        _log_box.append(text)
-    _buffered_logs.clear()
 
+def _flush_log_box():
+    with _ui_lock:
+        if not _ui_pending:
+            return
+        lines = list(_ui_pending)
+        _ui_pending.clear()
+    if not _log_box:
+        return
     try:
-        _log_box.moveCursor(QTextCursor.End)
-    except Exception as e:
-        print(f"[log set_cursor error] {e}")
+        if hasattr(_log_box, "append_entries"):
+            _log_box.append_entries(lines)
+        else:
+            _log_box.appendPlainText("\n".join(entry[4] for entry in lines))
+            _log_box.moveCursor(QTextCursor.End)
+    except RuntimeError:
+        pass  # 視窗已關閉
 
 
 def is_frozen():
     return getattr(sys, 'frozen', False)
 
-def _append_log_safely(text):
-    if _log_box:
-        lines = _log_box.toPlainText().splitlines()
-        lines.append(text)
 
-        # ✅ 限制最大行數，重新設定文字
-        if len(lines) > MAX_LOG_LINES:
-            lines = lines[-MAX_LOG_LINES:]
-            _log_box.setPlainText("\n".join(lines))
-        else:
-            _log_box.append(text)
+class _LogWriter(threading.Thread):
+    """寫檔執行緒：檔案只開一次，批次寫入後 flush，超過 LOG_MAX_BYTES 就輪替。"""
+    def __init__(self, path, echo=False):
+        super().__init__(name=f"LogWriter-{os.path.basename(path)}", daemon=True)
+        self.path = path
+        self.echo = echo               # 同時印到 stdout（主 log 才需要）
+        self.queue = queue.SimpleQueue()
+        self._file = None
+        self._rotate_at = LOG_MAX_BYTES  # 檔案超過這個大小才輪替（改名失敗時往後延）
 
-        _log_box.moveCursor(QTextCursor.End)
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
 
-def log(text: str, level="INFO"):
-    timestamp = QDateTime.currentDateTime().toString("HH:mm:ss")
-    full_text = f"[{timestamp}] [{level}] {text}"
+    def _rotate(self):
+        self._file.close()
+        try:
+            for i in range(LOG_BACKUP_COUNT - 1, 0, -1):
+                src, dst = f"{self.path}.{i}", f"{self.path}.{i + 1}"
+                if os.path.exists(src):
+                    os.replace(src, dst)
+            os.replace(self.path, f"{self.path}.1")
+            self._rotate_at = LOG_MAX_BYTES
+        except OSError as e:
+            # ⚠️ Windows 上 log.txt 被其他程式開著就改不了名：繼續寫原檔，再長一段才重試
+            print(f"[log rotate error] {e}")
+            self._rotate_at += LOG_MAX_BYTES // 5
+        finally:
+            self._open()  # ✅ 不論成功與否都重新開檔，不會留著已關閉的 handle
+
+    def run(self):
+        try:
+            self._open()
+        except OSError as e:
+            print(f"[log open error] {e}")
+        while True:
+            lines = [self.queue.get()]
+            try:
+                while len(lines) < LOG_WRITE_BATCH:
+                    lines.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = _STOP in lines
+            lines = [line for line in lines if line is not _STOP]
+            if lines:
+                text = "\n".join(lines) + "\n"
+                if self.echo:
+                    print(text, end="")
+                if self._file:
+                    try:
+                        self._file.write(text)
+                        self._file.flush()
+                        if self._file.tell() > self._rotate_at:
+                            self._rotate()
+                    except Exception as e:
+                        print(f"[log write error] {e}")
+            if stop:
+                break
+        if self._file:
+            self._file.close()
+
+    def stop(self, timeout=2.0):
+        if self.is_alive():
+            self.queue.put(_STOP)
+            self.join(timeout)
+
+
+class _WriterHandler(logging.Handler):
+    """logging ➜ 寫檔執行緒（log.txt）＋ log 視窗；emit 只做格式化與放入佇列。"""
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+        self.setFormatter(_LOG_FORMAT)
 
-    if DEBUG_MODE or level in ("ERROR", "WARNING"):
-        print(full_text)
+    def emit(self, record):
         try:
-            with open("log.txt", "a", encoding="utf-8") as f:
-                f.write(full_text + "\n")
-        except:
-            pass
-
-    if _log_box and (DEBUG_MODE or level in ("ERROR", "WARNING")):
-        # ✅ 安全地轉到主執行緒
-        QTimer.singleShot(0, lambda: _append_log_safely(full_text))
+            text = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        self.writer.queue.put(text)
+        module = record.name[len(LOG_ROOT) + 1:]
+        encoder = (getattr(record, "fields", None) or {}).get("encoder")
+        with _ui_lock:
+            was_empty = not _ui_pending
+            _ui_pending.append((record.created, record.levelno, module, encoder, text))
+        if was_empty and _log_bridge is not None:
+            # ✅ 只有佇列由空變非空時通知主線程；100ms 內的其他行一起批次附加
+            try:
+                _log_bridge.pending.emit()
+            except RuntimeError:
+                pass
+
+
+class _JsonLinesHandler(logging.Handler):
+    """
+    結構化 log（每行一個 JSON）：ts、level、logger、msg，再加上呼叫端給的欄位
+    （encoder、block_id、command、latency_ms …），方便 grep / 統計效能。
+    """
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record):
+        try:
+            entry = {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "logger": record.name[len(LOG_ROOT) + 1:] or record.name,
+                "msg": record.getMessage(),
+            }
+            entry.update(getattr(record, "fields", None) or {})
+            self.writer.queue.put(json.dumps(entry, ensure_ascii=False, default=str))
+        except Exception:
+            self.handleError(record)
+
+
+def _ensure_logging():
+    global _text_writer
+    if _text_writer is not None:
+        return
+    with _setup_lock:
+        if _text_writer is None:
+            root = logging.getLogger(LOG_ROOT)
+            root.setLevel(DEFAULT_LOG_LEVEL)
+            root.propagate = False
+            writer = _LogWriter(LOG_FILE, echo=True)
+            writer.start()
+            root.addHandler(_WriterHandler(writer))
+            _text_writer = writer
+
+
+def get_logger(name: str) -> logging.Logger:
+    """模組專用 logger（recorder.<name>）；等級可在 config.json 的 log_levels 個別設定。"""
+    _ensure_logging()
+    return logging.getLogger(f"{LOG_ROOT}.{name}")
+
+
+def configure_logging(config: dict):
+    """
+    套用 config.json 的 log 設定（可重複呼叫）：
+      "log_level": "INFO"                           全域等級
+      "log_levels": {"encoder_client": "DEBUG"}     個別模組等級
+      "log_json": "log.jsonl"                       結構化 log 檔（留空＝關閉）
+    """
+    global _json_writer, _json_handler
+    _ensure_logging()
+    root = logging.getLogger(LOG_ROOT)
+    root.setLevel(str(config.get("log_level") or DEFAULT_LOG_LEVEL).upper())
+
+    # 先把之前設過、這次沒列出的模組還原成跟隨全域
+    for name, logger in list(logging.Logger.manager.loggerDict.items()):
+        if name.startswith(LOG_ROOT + ".") and isinstance(logger, logging.Logger):
+            logger.setLevel(logging.NOTSET)
+    for name, level in (config.get("log_levels") or {}).items():
+        logging.getLogger(f"{LOG_ROOT}.{name}").setLevel(str(level).upper())
+
+    json_path = config.get("log_json") or None
+    if _json_writer is not None and _json_writer.path != json_path:
+        root.removeHandler(_json_handler)
+        _json_writer.stop()
+        _json_writer = _json_handler = None
+    if json_path and _json_writer is None:
+        _json_writer = _LogWriter(json_path)
+        _json_writer.start()
+        _json_handler = _JsonLinesHandler(_json_writer)
+        root.addHandler(_json_handler)
+
+
+def reload_log_config(path):
+    """config.json 有變動才重新套用 log 設定（給計時器定期呼叫；沒變只多一次 stat）。"""
+    global _log_config_mtime
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        if mtime == _log_config_mtime:
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        _log_config_mtime = mtime
+        configure_logging(config)
+    except Exception as e:
+        print(f"[log config error] {e}")
+
+
+def shutdown_logging(timeout=2.0):
+    """把佇列裡的 log 寫完再結束（atexit 也會呼叫）。"""
+    for writer in (_text_writer, _json_writer):
+        if writer is not None:
+            writer.stop(timeout)
+
+
+atexit.register(shutdown_logging)
+
+
+def _log(module, level, text, args, fields):
+    _ensure_logging()
+    logger = logging.getLogger(f"{LOG_ROOT}.{module or 'main'}")
+    levelno = logging.getLevelName(str(level).upper())
+    if not isinstance(levelno, int):
+        levelno = logging.INFO
+    if not logger.isEnabledFor(levelno):
+        return  # ✅ 等級沒開就不格式化 % 參數
+    logger.log(levelno, text, *args, extra={"fields": fields} if fields else None)
+
+
+def log(text: str, *args, level="INFO", **fields):
+    """
+    任何執行緒都可呼叫；logger 依呼叫端模組自動決定（recorder.<模組名>）。
+    - 熱路徑請用 % 參數：log("⬅️ %s %.1f ms", verb, ms, level="DEBUG")，等級沒開就不格式化
+    - 其他關鍵字參數（encoder=…, block_id=…, command=…, latency_ms=…）只寫進 JSON-lines log
+    """
+    name = sys._getframe(1).f_globals.get("__name__", "")
+    _log("main" if name == "__main__" else name, level, text, args, fields)
+
+
+def block_time_range(b):
+    """block dict ➜ (start_ts, end_ts)；以 epoch 秒表示"""
+    qdate = b["qdate"]
+    if isinstance(qdate, str):
+        qdate = QDate.fromString(qdate, "yyyy-MM-dd")
+    start_hour = float(b["start_hour"])
+    start_dt = QDateTime(qdate, QTime(int(start_hour), int((start_hour % 1) * 60)))
+    start_ts = start_dt.toSecsSinceEpoch()
+    return start_ts, start_ts + int(float(b["duration"]) * 3600)
+
+
+def hour_label_step(hour_px, min_px):
+    """縮放後每小時只有 hour_px 像素時，每幾小時畫一條刻度/一個標籤（1、2、3、6、12）。"""
+    for step in (1, 2, 3, 6, 12):
+        if hour_px * step >= min_px:
+            return step
+    return 24
 
 
 def resource_path(relative_path):
@@ -1,8 +1,13 @@
 import os 
 from PySide6.QtCore import QDate, QDateTime, QTime
 import json
-from utils import resource_path  ,log
-def find_conflict_blocks(file_path, qdate, track_index, start_hour, duration):
+from utils import resource_path  ,log, block_time_range
+def find_conflict_blocks(file_path, qdate, track_index, start_hour, duration, index=None):
+    # ✅ 有傳入 ScheduleView.block_index 就直接查索引，不必重讀排程檔
+    if index is not None:
+        start_ts, end_ts = block_time_range({"qdate": qdate, "start_hour": start_hour, "duration": duration})
+        return [b["label"] for b in index.overlaps(track_index, start_ts, end_ts)]
+
     new_start_dt = QDateTime(qdate, QTime(int(start_hour), int((start_hour % 1) * 60)))
     new_end_dt = new_start_dt.addSecs(int(duration * 3600))
     